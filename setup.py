@@ -22,6 +22,7 @@ develop_requires = [
     'Flask-Script',
     'Flask-SQLAlchemy',
     'Flask-WebTest',
+    'pyarrow',
     'pyquery',
     'sqlalchemy_utils',
     'sqlalchemybwc',
@@ -29,6 +30,7 @@ develop_requires = [
     'xlrd',
     'xlsxwriter',
     'xlwt',
+    'zstandard',
 ]
 
 cdir = osp.abspath(osp.dirname(__file__))
@@ -63,7 +65,13 @@ setup(
         'develop': develop_requires,
         'i18n': [
             'morphi'
-        ]
+        ],
+        'arrow': [
+            'pyarrow'
+        ],
+        'zstd': [
+            'zstandard'
+        ],
     },
     zip_safe=False,
     include_package_data=True,
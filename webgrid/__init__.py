@@ -1,16 +1,19 @@
 from __future__ import absolute_import
+from collections import namedtuple
 import datetime as dt
+import enum
+import hashlib
 import inspect
 import json
 import logging
-import re
+from operator import itemgetter
 import sys
 import six
 import time
 import warnings
 
 from blazeutils.containers import HTMLAttributes
-from blazeutils.datastructures import BlankObject, OrderedDict
+from blazeutils.datastructures import OrderedDict
 from blazeutils.helpers import tolist
 from blazeutils.numbers import decimalfmt
 from blazeutils.strings import case_cw2us, randchars
@@ -19,10 +22,15 @@ from formencode import Invalid
 import formencode.validators as fev
 import sqlalchemy as sa
 import sqlalchemy.sql as sasql
+from sqlalchemy.sql import operators as sa_operators
+from sqlalchemy.sql.util import find_tables
 from werkzeug.datastructures import MultiDict
 
 from .extensions import gettext as _
-from .renderers import HTML, XLS, XLSX
+from .filters import shared_search_value
+from .renderers import HTML, XLS, XLSX, FilterOptions
+from .session_stores import WebSessionStore
+from .utils import GridArgsParser, copy_instance_state, shares_instance_state
 
 # conditional imports to support libs without requiring them
 try:
@@ -35,6 +43,11 @@ try:
 except ImportError:
     xlwt = None
 
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
 log = logging.getLogger(__name__)
 
 
@@ -54,6 +67,9 @@ def subtotal_function_map(v):
     return v
 
 
+GridSchema = namedtuple('GridSchema', 'columns key_indexes filtered_indexes subtotals')
+
+
 class _None(object):
     """
         A sentinal object to indicate no value
@@ -80,6 +96,7 @@ class _DeclarativeMeta(type):
         class_dict['_rowstylers'] = []
         class_dict['_colstylers'] = []
         class_dict['_colfilters'] = []
+        class_dict['_schema'] = None
         class_columns = []
 
         # add columns from base classes
@@ -108,16 +125,55 @@ class _DeclarativeMeta(type):
         return super(_DeclarativeMeta, cls).__new__(cls, name, bases, class_dict)
 
 
+class ColumnAttributes(object):
+    """
+        The HTML attributes of a column's header or body cells, given by the column's kwargs.
+        `hah` is only made when it is used, as most columns have no attributes. Other
+        attributes can be set, e.g. for templates, as on the objects these replace.
+    """
+
+    def __init__(self, kwargs):
+        self.kwargs = kwargs
+        self._hah = None
+
+    @property
+    def hah(self):
+        if self._hah is None:
+            self._hah = HTMLAttributes(self.kwargs)
+        return self._hah
+
+    @hah.setter
+    def hah(self, val):
+        self._hah = val
+
+    @property
+    def attrs(self):
+        """The attributes for rendering, or None when there are none to render."""
+        if self._hah is None and not self.kwargs:
+            return None
+        return self.hah
+
+
 class Column(object):
     """
         Column represents the fixed settings for a datagrid column
     """
     _creation_counter = 0
     xls_width = None
+    # how the XLSX renderer sizes the column when xls_width is not given: 'sample' measures
+    # a sample of the records, 'exact' measures every record, 'type' uses xls_width_estimate()
+    xls_width_mode = 'sample'
     xls_num_format = None
     xls_style = None
     _render_in = 'html', 'xls', 'xlsx', 'csv'
     _visible = True
+    # New instances start from a copy of the attributes compiled once by instance_schema(),
+    # rather than being constructed, when the class defining __init__ sets this (see
+    # webgrid.utils.shares_instance_state). That __init__ must then only set attributes from
+    # its arguments, and have no side effects. Lists, dicts and sets are copied per instance,
+    # other values are shared.
+    instance_schema_shared = True
+    _instance_schema = None
 
     @property
     def render_in(self):
@@ -154,7 +210,8 @@ class Column(object):
 
     def __init__(self, label, key=None, filter=None, can_sort=True,  # noqa: C901
                  xls_width=None, xls_style=None, xls_num_format=None,
-                 render_in=_None, has_subtotal=False, visible=True, group=None, **kwargs):
+                 render_in=_None, has_subtotal=False, visible=True, group=None,
+                 xls_width_mode=None, **kwargs):
         self.label = label
         self.key = key
         self.filter = filter
@@ -171,6 +228,8 @@ class Column(object):
         self.visible = visible
         if xls_width:
             self.xls_width = xls_width
+        if xls_width_mode:
+            self.xls_width_mode = xls_width_mode
         if xls_num_format:
             self.xls_num_format = xls_num_format
         if xls_style:
@@ -209,24 +268,23 @@ class Column(object):
                                    ' as the first argument'))
             self.filter = filter(self.expr)
 
-    def new_instance(self, grid):
+    def instance_schema(self):
+        """
+            The attributes every instance of this column starts with, compiled once from the
+            class level column: label, key, expression, sorting, rendering, group, subtotal,
+            and the arguments of subclasses (see `instance_schema_shared`).
+        """
+        if self._instance_schema is None:
+            self._instance_schema = vars(self.instance_template())
+        return self._instance_schema
+
+    def instance_template(self):
+        """A column constructed with the settings of this class level column."""
         cls = self.__class__
-        column = cls(self.label, self.key, None, self.can_sort, group=self.group, _dont_assign=True)
-        column.grid = grid
+        column = cls(self.label, self.key, None, self.can_sort, group=self.group,
+                     _dont_assign=True)
         column.expr = self.expr
 
-        if self.filter:
-            column.filter = self.filter.new_instance(dialect=grid.manager.db.engine.dialect)
-
-        column.head = BlankObject()
-        column.head.hah = HTMLAttributes(self.kwargs)
-        column.body = BlankObject()
-        column.body.hah = HTMLAttributes(self.kwargs)
-        if xlwt is not None:
-            column.xlwt_stymat = self.xlwt_stymat_init()
-        else:
-            column.xlwt_stymat = None
-
         # try to be smart about which attributes should get copied to the
         # new instance by looking for attributes on the class that have the
         # same name as arguments to the classes __init__ method
@@ -243,6 +301,29 @@ class Column(object):
         # lambdas that should be called per grid instance.
         column.render_in = self._render_in
         column.visible = self._visible
+        column.xls_width_mode = self.xls_width_mode
+        return column
+
+    def new_instance(self, grid):
+        cls = self.__class__
+        if shares_instance_state(cls, 'instance_schema_shared'):
+            column = cls.__new__(cls, _dont_assign=True)
+            column.__dict__.update(copy_instance_state(self.instance_schema()))
+        else:
+            column = self.instance_template()
+        column.grid = grid
+
+        # styles can be changed in place, so each instance has its own
+        if xlwt is not None:
+            column.xlwt_stymat = self.xlwt_stymat_init()
+        else:
+            column.xlwt_stymat = None
+
+        if self.filter:
+            column.filter = self.filter.new_instance(dialect=grid.manager.db.engine.dialect)
+
+        column.head = ColumnAttributes(self.kwargs)
+        column.body = ColumnAttributes(self.kwargs)
 
         return column
 
@@ -253,12 +334,19 @@ class Column(object):
         """
         data = self.extract_data(record)
         data = self.format_data(data)
-        for _filter, cname in self.grid._colfilters:
-            for_column = self.grid.column(cname)
-            if self.key == for_column.key:
-                data = _filter(self.grid, data)
+        for _filter in self.column_filters():
+            data = _filter(self.grid, data)
         return data
 
+    def column_filters(self):
+        """
+            The grid's `col_filter` functions for this column.
+        """
+        return [
+            _filter for _filter, cname in self.grid._colfilters
+            if self.key == self.grid.column(cname).key
+        ]
+
     def extract_data(self, record):
         """
             Locate the data for this column in the record and return it.
@@ -292,12 +380,54 @@ class Column(object):
         """
         return value
 
+    def renderer(self, render_type):
+        """
+            The function rendering a record for `render_type`. Exporters look it up once rather
+            than for every cell.
+        """
+        return getattr(self, 'render_{0}'.format(render_type), self.extract_and_format_data)
+
     def render(self, render_type, record, *args, **kwargs):
         render_attr = 'render_{0}'.format(render_type)
         if hasattr(self, render_attr):
             return getattr(self, render_attr)(record, *args, **kwargs)
         return self.extract_and_format_data(record)
 
+    def raw_value(self, value):
+        """
+            Convert a value extracted from the record for raw value exports. Unlike
+            format_data, this is not for display: it only unwraps types the export writers
+            don't know.
+        """
+        if arrow and isinstance(value, arrow.Arrow):
+            return value.datetime
+        if isinstance(value, enum.Enum):
+            return value.value
+        return value
+
+    def raw_value_getter(self, record):
+        """
+            Return a function giving the raw value of this column for records shaped like
+            `record`, skipping format_data and the render methods. Query result rows are read
+            by position.
+        """
+        fields = getattr(record, '_fields', None)
+        if isinstance(record, tuple) and fields and self.key in fields:
+            extract = itemgetter(fields.index(self.key))
+        else:
+            extract = self.extract_data
+        convert = self.raw_value
+        filters = self.column_filters()
+        if not filters:
+            return lambda record: convert(extract(record))
+
+        def getter(record):
+            data = convert(extract(record))
+            for _filter in filters:
+                data = _filter(self.grid, data)
+            return data
+        return getter
+
     def apply_sort(self, query, flag_desc):
         if self.expr is None:
             direction = 'DESC' if flag_desc else 'ASC'
@@ -316,6 +446,20 @@ class Column(object):
             return len(value)
         return len(str(value))
 
+    def xls_width_estimate(self):
+        """
+            Width of the column's values, derived from its type, for `xls_width_mode = 'type'`.
+            None when the column can't tell, in which case its values are sampled.
+        """
+        return None
+
+    def arrow_data_type(self):
+        """
+            The Apache Arrow type of the column's values in Parquet and Arrow exports. Values
+            are rendered with render_arrow when the column has it, otherwise as in CSV.
+        """
+        return pyarrow.string()
+
     def xlwt_stymat_init(self):
         """
             Because Excel gets picky about a lot of styles, its likely that
@@ -337,6 +481,7 @@ class Column(object):
 
 class LinkColumnBase(Column):
     link_attrs = {}
+    instance_schema_shared = True
 
     def __init__(self, label, key=None, filter=None, can_sort=True,
                  link_label=None, xls_width=None, xls_style=None, xls_num_format=None,
@@ -367,6 +512,8 @@ class LinkColumnBase(Column):
 
 
 class BoolColumn(Column):
+    xls_width_mode = 'type'
+    instance_schema_shared = True
 
     def __init__(self, label, key_or_filter=None, key=None, can_sort=True,
                  reverse=False, true_label=_('True'), false_label=_('False'),
@@ -386,8 +533,25 @@ class BoolColumn(Column):
             return self.true_label
         return self.false_label
 
+    def xls_width_estimate(self):
+        return max(len(str(self.true_label)), len(str(self.false_label)))
+
+    def arrow_data_type(self):
+        return pyarrow.bool_()
+
+    def render_arrow(self, record):
+        # same truth value as the labels of the other exports
+        return self.raw_value(self.extract_data(record))
+
+    def raw_value(self, value):
+        # NULL is missing data, not either truth value
+        if value is None:
+            return None
+        return not value if self.reverse else bool(value)
+
 
 class YesNoColumn(BoolColumn):
+    instance_schema_shared = True
 
     def __init__(self, label, key_or_filter=None, key=None, can_sort=True,
                  reverse=False, xls_width=None, xls_style=None, xls_num_format=None,
@@ -398,6 +562,8 @@ class YesNoColumn(BoolColumn):
 
 
 class DateColumnBase(Column):
+    xls_width_mode = 'type'
+    instance_schema_shared = True
 
     def __init__(self, label, key_or_filter=None, key=None, can_sort=True,
                  html_format=None, csv_format=None, xls_width=None, xls_style=None,
@@ -461,6 +627,23 @@ class DateColumnBase(Column):
             # must be the column heading
             return Column.xls_width_calc(self, value)
 
+    def xls_width_estimate(self):
+        # values are formatted to the same width, aside from day and month names. Use a date
+        #   having the longest of those.
+        return self.xls_width_calc(dt.datetime(2000, 9, 27, 23, 59, 59))
+
+    def render_arrow(self, record):
+        data = self.extract_and_format_data(record)
+        if not data:
+            return data
+        if arrow and isinstance(data, arrow.Arrow):
+            data = data.datetime
+        # the arrow types have no zone, so aware values are given in UTC rather than dropping
+        #   their offset
+        if isinstance(data, dt.datetime) and data.tzinfo is not None:
+            data = data.astimezone(dt.timezone.utc).replace(tzinfo=None)
+        return data
+
 
 class DateColumn(DateColumnBase):
     # !!!: localize
@@ -468,6 +651,9 @@ class DateColumn(DateColumnBase):
     csv_format = '%Y-%m-%d'
     xls_num_format = 'm/dd/yyyy'
 
+    def arrow_data_type(self):
+        return pyarrow.date32()
+
 
 class DateTimeColumn(DateColumnBase):
     # !!!: localize
@@ -475,6 +661,9 @@ class DateTimeColumn(DateColumnBase):
     csv_format = '%Y-%m-%d %H:%M:%S%z'
     xls_num_format = 'mm/dd/yyyy hh:mm am/pm'
 
+    def arrow_data_type(self):
+        return pyarrow.timestamp('us')
+
 
 class TimeColumn(DateColumnBase):
     # !!!: localize
@@ -482,6 +671,9 @@ class TimeColumn(DateColumnBase):
     csv_format = '%H:%M'
     xls_num_format = 'hh:mm am/pm'
 
+    def arrow_data_type(self):
+        return pyarrow.time64('us')
+
 
 class NumericColumn(Column):
     # !!!: localize
@@ -489,6 +681,9 @@ class NumericColumn(Column):
     xls_fmt_accounting = '_($* #,##0{dec_places}_);{neg_prefix}_($* (#,##0{dec_places})' + \
                          ';_($* "-"??_);_(@_)'
     xls_fmt_percent = '0{dec_places}%;{neg_prefix}-0{dec_places}%'
+    # digits of the decimal values in Parquet and Arrow exports, the most decimal128 holds
+    arrow_decimal_precision = 38
+    instance_schema_shared = True
 
     def __init__(self, label, key_or_filter=None, key=None, can_sort=True,
                  reverse=False, xls_width=None, xls_style=None, xls_num_format=None,
@@ -563,6 +758,18 @@ class NumericColumn(Column):
             return xlwt.easyxf(self.xls_style, num_format)
         return Column.xlwt_stymat_init(self)
 
+    def arrow_data_type(self):
+        # exact types when the SQL type gives them, floats otherwise
+        sa_type = getattr(self.expr, 'type', None)
+        if isinstance(sa_type, sa.Integer):
+            return pyarrow.int64()
+        if isinstance(sa_type, sa.Numeric) and sa_type.asdecimal and sa_type.scale is not None \
+                and sa_type.scale <= self.arrow_decimal_precision:
+            # the widest precision rather than the declared one, which not all databases hold
+            #   stored values to
+            return pyarrow.decimal128(self.arrow_decimal_precision, sa_type.scale)
+        return pyarrow.float64()
+
 
 class EnumColumn(Column):
     """
@@ -595,6 +802,8 @@ class BaseGrid(six.with_metaclass(_DeclarativeMeta, object)):
     hide_excel_link = False
     # enables keyed session store of grid arguments
     session_on = False
+    # where the session-stored grid arguments are kept, see webgrid.session_stores
+    session_store = WebSessionStore()
     # enables page/grand subtotals: none|page|grand|all
     subtotals = 'none'
     manager = None
@@ -619,6 +828,19 @@ class BaseGrid(six.with_metaclass(_DeclarativeMeta, object)):
     # Will ask for confirmation before exporting more than this many records.
     # Set to None to disable this check
     unconfirmed_export_limit = 10000
+    # Rows fetched at a time by iter_records (used by the exports)
+    iter_records_batch_size = 1000
+
+    # Option filters having more options than this will render only the selected options, and
+    # the full list is loaded by the browser from a cacheable JSON asset. None always inlines.
+    filter_options_asset_threshold = None
+
+    # Count the records in the page query, with COUNT(*) OVER (), rather than with a query of
+    # its own. Only on databases in window_count_dialects (name: minimum server version).
+    window_count = False
+    window_count_dialects = {'postgresql': (), 'mssql': (), 'sqlite': (3, 25)}
+    # name of the count's column, which page rows then have
+    window_count_label = 'webgrid_record_count'
 
     def __init__(self, ident=None, per_page=_None, on_page=_None, qs_prefix='', class_='datagrid',
                  **kwargs):
@@ -661,24 +883,46 @@ class BaseGrid(six.with_metaclass(_DeclarativeMeta, object)):
         self.per_page = per_page if per_page is not _None else self.__class__.per_page
         self.on_page = on_page if on_page is not _None else self.__class__.on_page
 
-        self.columns = []
         self.key_column_map = {}
 
         self._init_columns()
         self.post_init()
 
+    @classmethod
+    def schema(cls):
+        """
+            The grid's columns compiled once per grid class: the class level columns, the
+            positions of the columns by key and of the filtered columns, and the subtotal
+            functions. Grid instances make their columns from it.
+        """
+        if cls._schema is None:
+            columns = tuple(cls.__cls_cols__)
+            key_indexes = OrderedDict()
+            filtered_indexes = OrderedDict()
+            subtotals = OrderedDict()
+            for index, col in enumerate(columns):
+                key_indexes[col.key] = index
+                if col.filter is not None:
+                    filtered_indexes[col.key] = index
+                if col.has_subtotal is not False and col.has_subtotal is not None:
+                    subtotals[col.key] = (subtotal_function_map(col.has_subtotal), index)
+            cls._schema = GridSchema(
+                columns,
+                tuple(key_indexes.items()),
+                tuple(filtered_indexes.items()),
+                tuple((key, func, index) for key, (func, index) in subtotals.items()),
+            )
+        return cls._schema
+
     def _init_columns(self):
-        for col in self.__cls_cols__:
-            new_col = col.new_instance(self)
-            self.columns.append(new_col)
-            self.key_column_map[new_col.key] = new_col
-            if new_col.filter is not None:
-                self.filtered_cols[new_col.key] = new_col
-            if new_col.has_subtotal is not False and new_col.has_subtotal is not None:
-                self.subtotal_cols[new_col.key] = (
-                    subtotal_function_map(new_col.has_subtotal),
-                    new_col
-                )
+        schema = self.schema()
+        self.columns = [col.new_instance(self) for col in schema.columns]
+        for key, index in schema.key_indexes:
+            self.key_column_map[key] = self.columns[index]
+        for key, index in schema.filtered_indexes:
+            self.filtered_cols[key] = self.columns[index]
+        for key, func, index in schema.subtotals:
+            self.subtotal_cols[key] = (func, self.columns[index])
 
     def post_init(self):
         """Provided for subclasses to run post-initialization customizations"""
@@ -729,6 +973,7 @@ class BaseGrid(six.with_metaclass(_DeclarativeMeta, object)):
 
     def set_renderers(self):
         self.html = HTML(self)
+        self.filter_options = FilterOptions(self)
         for key, value in self.allowed_export_targets.items():
             setattr(self, key, value(self))
 
@@ -780,24 +1025,77 @@ class BaseGrid(six.with_metaclass(_DeclarativeMeta, object)):
 
     @property
     def record_count(self):
+        if self._record_count is None and self._records is None and self.uses_window_count():
+            # counted by the page query
+            self.records
         if self._record_count is None:
-            query = self.build_query(for_count=True)
-            t0 = time.perf_counter()
-            self._record_count = query.count()
-            t1 = time.perf_counter()
-            log.debug('Count query ran in {} seconds'.format(t1 - t0))
+            self._record_count = self.count_records(self.build_query(for_count=True))
         return self._record_count
 
+    def count_records(self, query):
+        """Run the count of `query`, the grid's query built for counting, on its session."""
+        count_statement = self.count_statement(query)
+        t0 = time.perf_counter()
+        if count_statement is None:
+            record_count = query.order_by(None).count()
+        else:
+            record_count = query.session.execute(count_statement).scalar()
+        t1 = time.perf_counter()
+        log.debug('Count query ran in {} seconds'.format(t1 - t0))
+        return record_count
+
     @property
     def records(self):
         if self._records is None:
             query = self.build_query()
+            count_deferred = self._record_count is None and self.uses_window_count()
+            # the count column would change the rows of distinct queries, and queries of just
+            # an entity would give rows rather than entities
+            window_count = count_deferred and not query._distinct \
+                and len(query.column_descriptions) > 1
+            if window_count:
+                query = query.add_columns(
+                    sa.func.count().over().label(self.window_count_label)
+                )
             t0 = time.perf_counter()
             self._records = query.all()
             t1 = time.perf_counter()
             log.debug('Data query ran in {} seconds'.format(t1 - t0))
+
+            if window_count and self._records:
+                self._record_count = getattr(self._records[0], self.window_count_label)
+            elif count_deferred and not self._records and self.on_page > self.page_count:
+                # the page is past the last one, which _apply_paging leaves to be checked here
+                self.on_page = self.page_count
+                self._records = None
+                return self.records
         return self._records
 
+    def uses_window_count(self):
+        """
+            Whether the record count comes from the page query (see `window_count`). An empty
+            page is counted separately.
+        """
+        if not self.window_count or not self.pager_on or not self.per_page or not self.on_page:
+            return False
+        dialect = self.manager.db.engine.dialect
+        return dialect.name in self.window_count_dialects and \
+            (dialect.server_version_info or ()) >= self.window_count_dialects[dialect.name]
+
+    def iter_records(self, batch_size=None):
+        """
+            Iterate over the grid's records, fetching `batch_size` rows at a time (through a
+            server-side cursor where the database driver supports it), so that memory use is
+            bounded by the batch size rather than the record count. Unlike `records`, the
+            records are not kept on the grid. Records already set on the grid are iterated as
+            they are.
+        """
+        if self._records is not None:
+            return iter(self._records)
+        query = self.build_query()
+        # yield_per also sets the stream_results execution option
+        return iter(query.yield_per(batch_size or self.iter_records_batch_size))
+
     def _totals_col_results(self, page_totals_only):
         SUB = self.build_query(for_count=(not page_totals_only)).subquery()
 
@@ -870,8 +1168,69 @@ class BaseGrid(six.with_metaclass(_DeclarativeMeta, object)):
 
         return query
 
-    def set_records(self, records):
-        self._record_count = len(records)
+    def count_statement(self, query):
+        """
+            A statement counting the records of `query`, the grid's query built for counting.
+            It selects only COUNT(*) over the query's FROM and WHERE clauses: no columns, no
+            ORDER BY, and no outer joins the count doesn't depend on (see `count_from`).
+
+            None when the query is grouped, distinct or limited, so has to be counted as a
+            subquery.
+        """
+        if query._statement is not None or query._group_by or query._having is not None \
+                or query._distinct or query._limit is not None or query._offset is not None:
+            return None
+        # eager loads add joins that aren't part of the records, as Query.count() knows
+        query = query.enable_eagerloads(False)
+        whereclause = query.whereclause
+        referenced = set()
+        if whereclause is not None:
+            referenced.update(find_tables(whereclause, check_columns=True, include_aliases=True))
+        froms = [self.count_from(from_, referenced) for from_ in query.statement.froms]
+        return sa.select([sa.func.count()], whereclause, from_obj=froms)
+
+    def count_from(self, from_, referenced):
+        """
+            `from_` without the outer joins at its end that can't change the number of rows:
+            joins to tables not in `referenced` (the tables filtered on), on conditions
+            matching all of the joined table's primary key, i.e. many-to-one joins.
+        """
+        while isinstance(from_, sasql.expression.Join) and from_.isouter and not from_.full:
+            right_tables = set(find_tables(from_.right, include_aliases=True))
+            if referenced & right_tables or not self._joins_one_row(from_, right_tables):
+                break
+            from_ = from_.left
+        return from_
+
+    def _joins_one_row(self, join, right_tables):
+        primary_key = list(getattr(join.right, 'primary_key', ()))
+        onclause = join.onclause
+        if not primary_key or onclause is None:
+            return False
+        if isinstance(onclause, sasql.expression.BooleanClauseList):
+            if onclause.operator is not sa_operators.and_:
+                return False
+            terms = onclause.clauses
+        else:
+            terms = [onclause]
+
+        matched = []
+        for term in terms:
+            if not isinstance(term, sasql.expression.BinaryExpression) or \
+                    term.operator is not sa_operators.eq:
+                continue
+            for column, other in ((term.left, term.right), (term.right, term.left)):
+                other_tables = set(find_tables(other, check_columns=True, include_aliases=True))
+                if not other_tables & right_tables:
+                    matched.append(column)
+        return all(any(key.shares_lineage(column) for column in matched) for key in primary_key)
+
+    def set_records(self, records, record_count=None):
+        """
+            Set the grid's records, e.g. fetched elsewhere. `records` may be an iterator (such as
+            a streamed query) when `record_count` is given.
+        """
+        self._record_count = len(records) if record_count is None else record_count
         self._records = records
 
     def query_base(self, has_sort, has_filters):
@@ -912,11 +1271,11 @@ class BaseGrid(six.with_metaclass(_DeclarativeMeta, object)):
 
     def apply_search(self, query, value):
         # We depend on the filters to know what to do with the search value, and then OR the
-        # expressions together for our query
-        return query.filter(sa.or_(*filter(
-            lambda item: item is not None,
-            (expr(value) for expr in self.search_expression_generators)
-        )))
+        # expressions together for our query. Filters read the value with filters.search_value,
+        # which parses it once for all of them.
+        with shared_search_value(value):
+            exprs = [expr(value) for expr in self.search_expression_generators]
+        return query.filter(sa.or_(*[expr for expr in exprs if expr is not None]))
 
     def query_paging(self, query):
         if self.on_page and self.per_page:
@@ -945,36 +1304,32 @@ class BaseGrid(six.with_metaclass(_DeclarativeMeta, object)):
 
         return query
 
+    @property
+    def qs_args_parser(self):
+        return GridArgsParser.for_prefix(self.qs_prefix)
+
+    def parse_qs_args(self, args):
+        return self.qs_args_parser.parse(args)
+
     def args_have_op(self, args):
         # any of the grid's query string args can be used to
         #   override the session behavior (except export_to)
-        r = re.compile(
-            self.qs_prefix + r'(op\(.*\))'
-        )
-        return any(r.match(a) for a in args.keys())
+        return self.parse_qs_args(args).has_filters
 
     def args_have_session_override(self, args):
-        r = re.compile(
-            self.qs_prefix + 'session_override'
-        )
-        return any(r.match(a) for a in args.keys())
+        return 'session_override' in self.parse_qs_args(args).session
 
     def args_have_page(self, args):
-        r = re.compile(
-            self.qs_prefix + '(onpage|perpage)'
-        )
-        return any(r.match(a) for a in args.keys())
+        return bool(self.parse_qs_args(args).paging)
 
     def args_have_sort(self, args):
-        r = re.compile(
-            self.qs_prefix + '(sort[1-3])'
-        )
-        return any(r.match(a) for a in args.keys())
+        return bool(self.parse_qs_args(args).sort)
 
     def apply_qs_args(self, add_user_warnings=True):
         args = MultiDict(self.manager.request_args())
-        if 'search' in args and self.can_search():
-            self.search_value = args['search'].strip()
+        request_grid_args = grid_args = self.parse_qs_args(args)
+        if grid_args.search is not None and self.can_search():
+            self.search_value = grid_args.search.strip()
 
         # args are pulled first from the request. If the session feature
         #   is enabled and the request doesn't include grid-related args,
@@ -982,22 +1337,19 @@ class BaseGrid(six.with_metaclass(_DeclarativeMeta, object)):
         #   session args store
         if self.session_on:
             # if session key is in request, set the unique key
-            self.session_key = args.get(
-                self.prefix_qs_arg_key('session_key'),
-                self.session_key
-            )
-            session_override = self.args_have_session_override(args)
+            self.session_key = grid_args.session.get('session_key', self.session_key)
+            session_override = 'session_override' in grid_args.session
             # apply arg indicates that filtering/paging/sorting form was submitted
-            apply = self.prefix_qs_arg_key('apply') in args
+            apply = 'apply' in grid_args.session
             args.pop(self.prefix_qs_arg_key('apply'), None)
-            if (not self.args_have_op(args) and not apply) or session_override:
+            if (not grid_args.has_filters and not apply) or session_override:
                 session_args = self.get_session_store(args, session_override)
                 # override paging if it exists in the query
-                if self.args_have_page(args):
+                if grid_args.paging:
                     session_args['onpage'] = args.get('onpage')
                     session_args['perpage'] = args.get('perpage')
                 # override sorting if it exists in the query
-                if self.args_have_sort(args):
+                if grid_args.sort:
                     session_args['sort1'] = args.get('sort1')
                     session_args['sort2'] = args.get('sort2')
                     session_args['sort3'] = args.get('sort3')
@@ -1007,45 +1359,40 @@ class BaseGrid(six.with_metaclass(_DeclarativeMeta, object)):
                     self.foreign_session_loaded = True
                 args = session_args
 
-            req_args = self.manager.request_args()
-            if self.prefix_qs_arg_key('export_to') in req_args:
-                args[self.prefix_qs_arg_key('export_to')] = \
-                    req_args[self.prefix_qs_arg_key('export_to')]
+            if 'export_to' in request_grid_args.export:
+                args[self.prefix_qs_arg_key('export_to')] = request_grid_args.export['export_to']
             self.save_session_store(args)
+            grid_args = self.parse_qs_args(args)
 
         # filtering (make sure this is above paging otherwise self.page_count
         # used in the paging section below won't work)
-        self._apply_filtering(args)
+        self._apply_filtering(grid_args)
 
         # paging
-        self._apply_paging(args)
+        self._apply_paging(grid_args)
 
         # sorting
-        self._apply_sorting(args)
+        self._apply_sorting(grid_args)
+
+        # filter options requests are read from the request, as the args may have come from
+        #   the session
+        self._apply_filter_options(request_grid_args)
 
         if add_user_warnings:
             for msg in self.user_warnings:
                 self.manager.flash_message('warning', msg)
 
-    def _apply_filtering(self, args):
+    def _apply_filtering(self, grid_args):
         for col in six.itervalues(self.filtered_cols):
             filter = col.filter
-            filter_op_qsk = self.prefix_qs_arg_key('op({0})'.format(col.key))
-            filter_v1_qsk = self.prefix_qs_arg_key('v1({0})'.format(col.key))
-            filter_v2_qsk = self.prefix_qs_arg_key('v2({0})'.format(col.key))
-
-            filter_op_value = args.get(filter_op_qsk, None)
+            filter_op_value = grid_args.filter_value(col.key, 'op')
 
             if filter._default_op:
                 filter.set(None, None, None)
 
             if filter_op_value is not None:
-                if filter.receives_list:
-                    v1 = args.getlist(filter_v1_qsk)
-                    v2 = args.getlist(filter_v2_qsk)
-                else:
-                    v1 = args.get(filter_v1_qsk, None)
-                    v2 = args.get(filter_v2_qsk, None)
+                v1 = grid_args.filter_value(col.key, 'v1', multi=filter.receives_list)
+                v2 = grid_args.filter_value(col.key, 'v2', multi=filter.receives_list)
 
                 try:
                     filter.set(
@@ -1057,36 +1404,51 @@ class BaseGrid(six.with_metaclass(_DeclarativeMeta, object)):
                     invalid_msg = filter.format_invalid(e, col)
                     self.user_warnings.append(invalid_msg)
 
-    def _apply_paging(self, args):
-        pp_qsk = self.prefix_qs_arg_key('perpage')
-        if pp_qsk in args:
-            per_page = self.apply_validator(fev.Int, args[pp_qsk], pp_qsk)
+    def _apply_paging(self, grid_args):
+        if 'perpage' in grid_args.paging:
+            pp_qsk = self.prefix_qs_arg_key('perpage')
+            per_page = self.apply_validator(fev.Int, grid_args.paging['perpage'], pp_qsk)
             if per_page is None or per_page < 1:
                 per_page = 1
             self.per_page = per_page
 
-        op_qsk = self.prefix_qs_arg_key('onpage')
-        if op_qsk in args:
-            on_page = self.apply_validator(fev.Int, args[op_qsk], op_qsk)
+        if 'onpage' in grid_args.paging:
+            op_qsk = self.prefix_qs_arg_key('onpage')
+            on_page = self.apply_validator(fev.Int, grid_args.paging['onpage'], op_qsk)
             if on_page is None or on_page < 1:
                 on_page = 1
-            if on_page > self.page_count:
+            # with the count from the page query, the page is checked when it is queried
+            if not self.uses_window_count() and on_page > self.page_count:
                 on_page = self.page_count
             self.on_page = on_page
 
-    def _apply_sorting(self, args):
-        sort_qs_keys = [
-            self.prefix_qs_arg_key('sort1'),
-            self.prefix_qs_arg_key('sort2'),
-            self.prefix_qs_arg_key('sort3'),
+    def _apply_sorting(self, grid_args):
+        sort_qs_values = [
+            grid_args.sort[sort_key] for sort_key in ('sort1', 'sort2', 'sort3')
+            if sort_key in grid_args.sort
         ]
-        sort_qs_values = [args[sort_qsk] for sort_qsk in sort_qs_keys if sort_qsk in args]
         if sort_qs_values:
             self.set_sort(*sort_qs_values)
 
         # handle other file formats
-        export_qsk = self.prefix_qs_arg_key('export_to')
-        self.set_export_to(args.get(export_qsk, None))
+        self.set_export_to(grid_args.export.get('export_to', None))
+
+    def _apply_filter_options(self, grid_args):
+        # a request for a filter's options asset is answered through the export mechanism, so
+        # that views which already handle exports need no changes.
+        col_key = grid_args.export.get('filter_options')
+        if col_key in self.filtered_cols and hasattr(self.filtered_cols[col_key].filter,
+                                                     'options_seq'):
+            self.filter_options.column = self.filtered_cols[col_key]
+            self.filter_options.version_requested = grid_args.export.get('filter_options_v')
+            self.filter_options.search_value = \
+                grid_args.export.get('filter_options_q', '').strip()
+            if 'filter_options_page' in grid_args.export:
+                options_page_qsk = self.prefix_qs_arg_key('filter_options_page')
+                on_page = self.apply_validator(fev.Int, grid_args.export['filter_options_page'],
+                                               options_page_qsk)
+                self.filter_options.on_page = max(on_page or 1, 1)
+            self.export_to = 'filter_options'
 
     def prefix_qs_arg_key(self, key):
         return '{0}{1}'.format(self.qs_prefix, key)
@@ -1108,29 +1470,81 @@ class BaseGrid(six.with_metaclass(_DeclarativeMeta, object)):
             raise ValueError('No export format set')
         exporter = getattr(self, self.export_to)
         if self.export_to in ['xls', 'xlsx']:
-            return exporter.as_response(wb, sheet_name)
-        return exporter.as_response()
+            response = exporter.as_response(wb, sheet_name)
+        else:
+            response = exporter.as_response()
+        etag = self.etag()
+        if etag is not None and response is not None:
+            self.manager.set_etag(response, etag)
+        return response
+
+    def data_version(self):
+        """
+            A value that changes whenever the grid's records do, e.g. the latest update
+            timestamp of the tables queried, for the grid's ETag. None (the default) disables
+            ETags. Include anything else the records depend on that the grid's args don't give,
+            like the current user when query_prep filters on it.
+        """
+        return None
+
+    def etag_state(self):
+        """The grid state a response depends on, other than the data version."""
+        return {
+            'grid': self.__class__.__name__,
+            'ident': self.ident,
+            'filters': [
+                [key, col.filter.op, col.filter.value1_set_with, col.filter.value2_set_with]
+                for key, col in six.iteritems(self.filtered_cols) if col.filter.is_active
+            ],
+            'search': self.search_value,
+            'sort': self.order_by,
+            'paging': [self.per_page, self.on_page],
+            'export_to': self.export_to,
+            'columns': [col.key for col in self.iter_columns(self.export_to or 'html')],
+            # filters on relative dates (e.g. "today") change with the date
+            'date': dt.date.today(),
+        }
+
+    def etag(self):
+        """
+            ETag for responses showing the grid in its current state, or None if the grid has
+            no data version.
+        """
+        version = self.data_version()
+        if version is None:
+            return None
+        state = json.dumps([self.etag_state(), version], sort_keys=True, default=str)
+        return hashlib.sha1(state.encode('utf-8')).hexdigest()
+
+    def not_modified_response(self):
+        """
+            After apply_qs_args, and before the grid is rendered or exported: return the
+            manager's 304 Not Modified response if the request's If-None-Match has the grid's
+            ETag, else None. Only the data version is queried for this.
+        """
+        etag = self.etag()
+        if etag is None:
+            return None
+        return self.manager.not_modified_response(etag)
 
     def get_session_store(self, args, session_override=False):
         # check args for a session key. If the key is present,
         #   look it up in the session and use the saved args
         #   (if they have been saved under that key). If not,
         #   look up the class name for a default arg store.
-        web_session = self.manager.web_session()
-        if 'dgsessions' not in web_session:
-            return args
-        dgsessions = web_session['dgsessions']
-        stored_args = None
+        stored_args_json = None
         # if dgreset is in args, store the session key if present
         #   and then pass back the incoming args
         reset = self.prefix_qs_arg_key('dgreset') in args
 
         # session is stored as a JSON-serialized list of tuples, which we can turn into MultiDict
-        session_key = '_{0}'.format(self.__class__.__name__)
         if args.get(self.prefix_qs_arg_key('session_key'), None):
-            if dgsessions.get(self.session_key, None):
-                session_key = self.session_key
-        stored_args_json = dgsessions.get(session_key, '[]')
+            stored_args_json = self.session_store.get(self.manager, self.session_key)
+        if not stored_args_json:
+            stored_args_json = self.session_store.get(
+                self.manager, '_{0}'.format(self.__class__.__name__)
+            )
+        stored_args_json = stored_args_json or '[]'
         if isinstance(stored_args_json, MultiDict):
             stored_args_json = json.dumps(list(stored_args_json.items(multi=True)))
         elif isinstance(stored_args_json, dict):
@@ -1143,27 +1557,55 @@ class BaseGrid(six.with_metaclass(_DeclarativeMeta, object)):
             stored_args.pop('session_override')
         return stored_args if (stored_args and not reset) else args
 
+    def session_store_args(self, args):
+        # only store args that differ from the grid's defaults
+        grid_args = self.parse_qs_args(args)
+        skip_keys = set()
+        for col_key, filter_args in grid_args.filters.items():
+            col = self.filtered_cols.get(col_key)
+            # values of an inactive filter are ignored, unless a blank op overrides a default op
+            if col is not None and not col.filter._default_op \
+                    and not any(filter_args.get('op', [])):
+                skip_keys.update(
+                    self.prefix_qs_arg_key('{0}({1})'.format(part, col_key))
+                    for part in filter_args
+                )
+        skip_keys.update(
+            self.prefix_qs_arg_key(sort_key)
+            for sort_key, value in grid_args.sort.items() if not value
+        )
+        if grid_args.paging.get('onpage') == '1':
+            skip_keys.add(self.prefix_qs_arg_key('onpage'))
+        # remove keys that should not be stored
+        skip_keys.update(self.prefix_qs_arg_key(key) for key in (
+            'export_to', 'dgreset', 'session_key', 'session_override',
+        ))
+        return MultiDict([
+            (key, value) for key, value in args.items(multi=True) if key not in skip_keys
+        ])
+
     def save_session_store(self, args):
         # save the args in the session under the session key
         #   and also as the default args for this grid
-        web_session = self.manager.web_session()
-        if 'dgsessions' not in web_session:
-            web_session['dgsessions'] = dict()
-        dgsessions = web_session['dgsessions']
-        # work with a copy here
-        args = MultiDict(args)
-        # remove keys that should not be stored
-        args.pop(self.prefix_qs_arg_key('export_to'), None)
-        args.pop(self.prefix_qs_arg_key('dgreset'), None)
+        args = self.session_store_args(args)
         args['datagrid'] = self.__class__.__name__
-        # serialize the args so we can enforce the correct MultiDict type on the other side
-        args_json = json.dumps(list(args.items(multi=True)))
+        # serialize the args so we can enforce the correct MultiDict type on the other side.
+        #   Keys are sorted (keeping the order of each key's values) so that the same grid
+        #   state always serializes the same way.
+        args_json = json.dumps(sorted(args.items(multi=True), key=itemgetter(0)))
         # save in store under grid default and session key
-        dgsessions[self.session_key] = args_json
-        dgsessions['_{0}'.format(self.__class__.__name__)] = args_json
-
-        # some frameworks/sessions need these changes manually persisted
-        self.manager.persist_web_session()
+        entries = {
+            self.session_key: args_json,
+            '_{0}'.format(self.__class__.__name__): args_json,
+        }
+        # skip unchanged entries, so that an unchanged grid state doesn't cause a session write
+        #   (and with cookie-backed sessions, a new cookie on the response)
+        entries = {
+            key: value for key, value in entries.items()
+            if self.session_store.get(self.manager, key) != value
+        }
+        if entries:
+            self.session_store.save(self.manager, entries)
 
     def __repr__(self):
         return '<Grid "{0}">'.format(self.__class__.__name__)
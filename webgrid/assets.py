@@ -0,0 +1,147 @@
+"""
+    Bundles of webgrid's static files, for pages to load the grid's assets in two requests, from
+    URLs that can be cached indefinitely:
+
+    - one script, of gettext.min.js, webgrid.js and jquery.multiple.select.js
+    - one stylesheet, of multiple-select.css and webgrid.css, with its images inlined as data URIs
+
+    Bundles are built in process on first use (no build step), stripped of comments and
+    indentation, and named by a hash of their content.
+"""
+from __future__ import absolute_import
+
+import base64
+from collections import namedtuple
+import hashlib
+from os import path
+import re
+import threading
+
+Asset = namedtuple('Asset', 'content mime_type')
+
+
+def minify_js(source):
+    """
+        Drop comment lines and blocks (other than a file's leading comment, which has its
+        license), indentation, and blank lines. Line breaks are kept, so statements relying on
+        them are not joined.
+    """
+    lines = []
+    in_comment = False
+    for line in source.splitlines():
+        line = line.strip()
+        if in_comment:
+            if '*/' in line:
+                in_comment = False
+                line = line.split('*/', 1)[1].strip()
+            else:
+                continue
+        elif line.startswith('/*') and lines:
+            if '*/' not in line:
+                in_comment = True
+                continue
+            line = line.split('*/', 1)[1].strip()
+        elif line.startswith('//'):
+            continue
+        if lines or line:
+            lines.append(line)
+    return '\n'.join(line for line in lines if line)
+
+
+def minify_css(source):
+    source = re.sub(r'/\*.*?\*/', '', source, flags=re.DOTALL)
+    return '\n'.join(line.strip() for line in source.splitlines() if line.strip())
+
+
+class StaticBundle(object):
+    js_files = ('gettext.min.js', 'webgrid.js', 'jquery.multiple.select.js')
+    css_files = ('multiple-select.css', 'webgrid.css')
+    mime_types = {
+        'js': 'application/javascript',
+        'css': 'text/css',
+        'png': 'image/png',
+    }
+    css_url_re = re.compile(r'''url\(\s*(['"]?)([\w.-]+\.png)\1\s*\)''')
+
+    def __init__(self, static_path):
+        self.static_path = static_path
+        self._assets = None
+        self._file_names = None
+        self._data_uris = {}
+        self._lock = threading.Lock()
+
+    def read(self, file_name, mode='r'):
+        kwargs = {'encoding': 'utf-8'} if mode == 'r' else {}
+        with open(path.join(self.static_path, file_name), mode, **kwargs) as f:
+            return f.read()
+
+    def data_uri(self, file_name):
+        if file_name not in self._data_uris:
+            data = base64.b64encode(self.read(file_name, 'rb')).decode('ascii')
+            mime_type = self.mime_types[file_name.rsplit('.', 1)[-1]]
+            self._data_uris[file_name] = 'data:{0};base64,{1}'.format(mime_type, data)
+        return self._data_uris[file_name]
+
+    def inline_images(self, css):
+        return self.css_url_re.sub(
+            lambda match: 'url({0})'.format(self.data_uri(match.group(2))), css
+        )
+
+    def build(self):
+        # files are separated so that a statement at the end of one doesn't run into the next
+        js = ';\n'.join(minify_js(self.read(file_name)) for file_name in self.js_files)
+        css = '\n'.join(
+            self.inline_images(minify_css(self.read(file_name))) for file_name in self.css_files
+        )
+        assets = {}
+        file_names = {}
+        for kind, content in (('js', js), ('css', css)):
+            content = content.encode('utf-8')
+            file_name = 'webgrid-{0}.{1}'.format(hashlib.sha256(content).hexdigest()[:16], kind)
+            assets[file_name] = Asset(content, self.mime_types[kind])
+            file_names[kind] = file_name
+        return assets, file_names
+
+    def ensure_built(self):
+        if self._assets is None:
+            with self._lock:
+                if self._assets is None:
+                    assets, file_names = self.build()
+                    self._file_names = file_names
+                    self._assets = assets
+
+    def file_name(self, kind):
+        """The fingerprinted file name of the 'js' or 'css' bundle."""
+        self.ensure_built()
+        return self._file_names[kind]
+
+    def get(self, file_name):
+        """The Asset for a bundle file name, or None if it isn't a current bundle."""
+        self.ensure_built()
+        return self._assets.get(file_name)
+
+
+class StaticBundleMixin(object):
+    """
+        Manager support for the static bundles. Set `bundle_assets` to also have the paging
+        images inlined as data URIs, rather than each loaded by URL.
+    """
+    bundle_assets = False
+    bundle_max_age = 31536000
+    _static_bundle = None
+
+    @property
+    def static_bundle(self):
+        if self._static_bundle is None:
+            self._static_bundle = StaticBundle(self.static_path())
+        return self._static_bundle
+
+    def inline_static_url(self, url_tail):
+        """A data URI for `url_tail` when images are inlined, else None."""
+        if self.bundle_assets and url_tail.endswith('.png'):
+            return self.static_bundle.data_uri(url_tail)
+        return None
+
+    def bundle_cache_control(self):
+        # bundle names change with their content, so the content at a name never changes
+        return 'public, max-age={0}, immutable'.format(self.bundle_max_age)
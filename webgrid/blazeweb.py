@@ -12,13 +12,15 @@ from blazeweb.utils import abort
 from blazeweb.wrappers import StreamResponse
 import jinja2 as jinja
 from jinja2.exceptions import TemplateNotFound
+from werkzeug.wrappers import Response
 from sqlalchemybwc import db as sabwc_db
 from webgrid import BaseGrid
+from webgrid.assets import StaticBundleMixin
 from webgrid.extensions import gettext
 from webgrid.renderers import render_html_attributes
 
 
-class WebGrid(object):
+class WebGrid(StaticBundleMixin, object):
     jinja_loader = jinja.PackageLoader('webgrid', 'templates')
 
     def __init__(self, db=None, component='webgrid'):
@@ -57,8 +59,24 @@ class WebGrid(object):
     def static_path(self):
         return path.join(path.dirname(__file__), 'static')
 
+    # the app routes this prefix to bundle_response
+    bundle_url_prefix = '/webgrid/bundle'
+
     def static_url(self, url_tail):
-        return abs_static_url('component/webgrid/{0}'.format(url_tail))
+        return self.inline_static_url(url_tail) \
+            or abs_static_url('component/webgrid/{0}'.format(url_tail))
+
+    def bundle_url(self, kind):
+        """URL of the fingerprinted 'js' or 'css' bundle, see webgrid.assets."""
+        return '{0}/{1}'.format(self.bundle_url_prefix, self.static_bundle.file_name(kind))
+
+    def bundle_response(self, file_name):
+        asset = self.static_bundle.get(file_name)
+        if asset is None:
+            abort(404)
+        rp = Response(asset.content, mimetype=asset.mime_type)
+        rp.headers['Cache-Control'] = self.bundle_cache_control()
+        abort(rp)
 
     def file_as_response(self, data_stream, file_name, mime_type):
         rp = StreamResponse(data_stream)
@@ -66,6 +84,27 @@ class WebGrid(object):
         rp.headers['Content-Disposition'] = 'attachment; filename={}'.format(file_name)
         abort(rp)
 
+    def not_modified_response(self, etag):
+        if not rg.request.if_none_match.contains_weak(etag):
+            return None
+        rp = Response(status=304)
+        rp.set_etag(etag)
+        abort(rp)
+
+    def set_etag(self, response, etag):
+        response.set_etag(etag)
+
+    def stream_as_response(self, chunks, mime_type='text/html'):
+        rp = Response(chunks, mimetype=mime_type)
+        abort(rp)
+
+    def json_as_response(self, data, max_age=None):
+        rp = StreamResponse(io.BytesIO(data.encode('utf-8')))
+        rp.headers['Content-Type'] = 'application/json'
+        if max_age:
+            rp.headers['Cache-Control'] = 'public, max-age={}'.format(max_age)
+        abort(rp)
+
     def xls_as_response(self, wb, file_name):
         warnings.warn(
             'xls_as_response is deprecated. Use file_as_response instead',
@@ -2,7 +2,9 @@ from __future__ import absolute_import
 import calendar
 import datetime as dt
 from decimal import Decimal as D
+from contextlib import contextmanager
 import inspect
+import threading
 
 from blazeutils import tolist
 from blazeutils.dates import ensure_date, ensure_datetime
@@ -19,6 +21,7 @@ from .extensions import (
     gettext,
     lazy_gettext as _
 )
+from .utils import copy_instance_state, shares_instance_state
 
 
 class UnrecognizedOperator(ValueError):
@@ -26,6 +29,8 @@ class UnrecognizedOperator(ValueError):
 
 
 class Operator(object):
+    __slots__ = ('key', 'display', 'field_type', 'hint')
+
     def __init__(self, key, display, field_type, hint=None):
         self.key = key
         self.display = display
@@ -39,6 +44,20 @@ class Operator(object):
         return hash(self.key)
 
 
+class OperatorTable(object):
+    """
+        Lookups for a filter class's operators, built once per class and shared by its
+        instances.
+    """
+    __slots__ = ('operators', 'by_key', 'keys', 'validator')
+
+    def __init__(self, operators):
+        self.operators = operators
+        self.by_key = {op.key: op for op in operators}
+        self.keys = [op.key for op in operators]
+        self.validator = feval.OneOf(self.keys, not_empty=True)
+
+
 class ops(object):
     eq = Operator('eq', _('is'), 'input')
     not_eq = Operator('!eq', _('is not'), 'input')
@@ -76,6 +95,14 @@ class FilterBase(object):
     input_types = 'input',
     # does this filter take a list of values in it's set() method
     receives_list = False
+    # New instances start from a copy of the state of one instance constructed with the
+    # arguments, rather than being constructed, when the class defining __init__ sets this (see
+    # webgrid.utils.shares_instance_state). That __init__ must then only set attributes from
+    # its arguments, and have no side effects. Lists, dicts and sets are copied per instance,
+    # other values are shared.
+    instance_state_shared = True
+    _instance_state = None
+    _operator_table = None
 
     def __init__(self, sa_col, default_op=None, default_value1=None, default_value2=None,
                  dialect=None):
@@ -93,7 +120,6 @@ class FilterBase(object):
         self.value2 = None
         self.value1_set_with = None
         self.value2_set_with = None
-        self._op_keys = None
         self.error = False
 
         # find the outermost call to a subclass's init method so we can store the exact arguments
@@ -114,11 +140,22 @@ class FilterBase(object):
 
         self._kwargs = outermost.locals[outermost.keywords] if outermost.keywords else {}
 
+    @property
+    def operator_table(self):
+        table = self._operator_table
+        if table is None or table.operators is not self.operators:
+            table = OperatorTable(self.operators)
+            if self.operators is type(self).operators:
+                type(self)._operator_table = table
+            else:
+                # operators were set on the instance
+                self._operator_table = table
+        return table
+
     @property
     def is_active(self):
-        operator_by_key = {op.key: op for op in self.operators}
         return self.op is not None and not self.error and (
-            operator_by_key[self.op].field_type is None or self.value1 is not None
+            self.operator_table.by_key[self.op].field_type is None or self.value1 is not None
         )
 
     @property
@@ -127,9 +164,7 @@ class FilterBase(object):
 
     @property
     def op_keys(self):
-        if self._op_keys is None:
-            self._op_keys = [op.key for op in self.operators]
-        return self._op_keys
+        return self.operator_table.keys
 
     def _default_value(self, value):
         if callable(value):
@@ -150,9 +185,7 @@ class FilterBase(object):
 
         # set values used in display first, since processing validation may
         #   raise exceptions
-        self.op = feval.OneOf(self.op_keys, not_empty=True).to_python(
-            op or self.default_op
-        )
+        self.op = self.operator_table.validator.to_python(op or self.default_op)
         self.value1_set_with = value1
         self.value2_set_with = value2
         try:
@@ -215,7 +248,15 @@ class FilterBase(object):
         compatibility in future
         """
         cls = self.__class__
-        new_filter = cls(*self._vargs, **self._kwargs)
+        if not shares_instance_state(cls, 'instance_state_shared'):
+            new_filter = cls(*self._vargs, **self._kwargs)
+        else:
+            if self._instance_state is None:
+                # the state a new filter starts with is the same every time, so the constructor
+                # only runs once
+                self._instance_state = vars(cls(*self._vargs, **self._kwargs))
+            new_filter = cls.__new__(cls)
+            new_filter.__dict__.update(copy_instance_state(self._instance_state))
         new_filter.dialect = kwargs.get('dialect')
         return new_filter
 
@@ -229,11 +270,95 @@ class _NoValue(object):
     pass
 
 
+class SearchValue(object):
+    """
+        The grid's single-search value, as read by the filters searching it. Typed readings are
+        parsed on first use and are None when the value isn't of that type.
+    """
+    # characters of numbers as text, e.g. -1.5E+10
+    number_chars = frozenset('0123456789.+-eE')
+    date_field_names = 'year', 'month', 'day', 'hour', 'minute', 'second'
+
+    def __init__(self, text):
+        self.text = text
+        self.lowered = text.lower()
+        self.is_number_text = all(char in self.number_chars for char in text)
+        self._date = _NoValue
+        self._date_fields = None
+
+    @property
+    def date(self):
+        """The value parsed as a date and time, with fields not given taken from today."""
+        if self._date is _NoValue:
+            try:
+                self._date = parse(self.text)
+            except (ValueError, OverflowError):
+                self._date = None
+        return self._date
+
+    @property
+    def date_fields(self):
+        """
+            The names of the date fields the value gives, e.g. ('year', 'month') for
+            "June 2019". Fields not given were filled in by the parser.
+        """
+        if self._date_fields is None:
+            date = self.date
+            if date is None:
+                self._date_fields = ()
+            else:
+                # parse again with every default different, a field having the same value both
+                # times was given
+                today = dt.date.today()
+                other_default = dt.datetime(
+                    2000 if today.year != 2000 else 2004,
+                    1 if today.month != 1 else 2,
+                    1 if today.day != 1 else 2,
+                    1, 1, 1,
+                )
+                other = parse(self.text, default=other_default)
+                self._date_fields = tuple(
+                    name for name in self.date_field_names
+                    if getattr(date, name) == getattr(other, name)
+                )
+        return self._date_fields
+
+
+_current_search = threading.local()
+
+
+@contextmanager
+def shared_search_value(text):
+    """
+        Within the block, search_value(text) gives the same SearchValue, so that the filters
+        searching for `text` parse it once between them. Used by BaseGrid.apply_search for
+        one search: the readings depend on today's date, so they aren't kept past it.
+    """
+    previous = getattr(_current_search, 'value', None)
+    _current_search.value = SearchValue(text)
+    try:
+        yield _current_search.value
+    finally:
+        _current_search.value = previous
+
+
+def search_value(text):
+    """The SearchValue for `text`, the one shared by the current search if there is one."""
+    current = getattr(_current_search, 'value', None)
+    if current is not None and current.text == text:
+        return current
+    return SearchValue(text)
+
+
 class OptionsFilterBase(FilterBase):
     operators = ops.is_, ops.not_is, ops.empty, ops.not_empty
     input_types = 'select'
     receives_list = True
     options_from = ()
+    # when True, the page only includes the selected options and the browser searches the
+    # options on demand (see webgrid.renderers.FilterOptions)
+    lazy_options = False
+    instance_state_shared = True
 
     def __init__(self, sa_col, value_modifier='auto', default_op=None, default_value1=None,
                  default_value2=None):
@@ -342,13 +467,12 @@ class OptionsFilterBase(FilterBase):
                 return _NoValue
         return value
 
+    def match_options_for_value(self, value):
+        value = value.lower()
+        return [item for item in self.options_seq if value in str(item[1]).lower()]
+
     def match_keys_for_value(self, value):
-        return [
-            key for (key, _) in filter(
-                lambda item: value.lower() in str(item[1]).lower(),
-                self.options_seq
-            )
-        ]
+        return [key for (key, _) in self.match_options_for_value(value)]
 
     def get_search_expr(self):
         # The important thing to remember here is that a user will be searching for the displayed
@@ -356,6 +480,8 @@ class OptionsFilterBase(FilterBase):
         # to get the keys needed for lookup into the data source.
         def search(value):
             matching_keys = self.match_keys_for_value(value)
+            if not matching_keys:
+                return sa.false()
             return self.sa_col.in_(matching_keys)
         return search
 
@@ -378,6 +504,8 @@ class OptionsFilterBase(FilterBase):
 
 
 class OptionsIntFilterBase(OptionsFilterBase):
+    instance_state_shared = True
+
     def __init__(self, sa_col, value_modifier=feval.Int, default_op=None, default_value1=None,
                  default_value2=None):
         OptionsFilterBase.__init__(self, sa_col, value_modifier, default_op, default_value1,
@@ -491,8 +619,12 @@ class NumberFilterBase(FilterBase):
         # This is a naive implementation that simply converts the number column to string and
         # uses a LIKE. We could go nuts with things like stripping thousands separators,
         # parenthesis, monetary symbols, etc. from the search value, but then we get to deal with
-        # locale.
-        return lambda value: sa.sql.cast(self.sa_col, sa.Unicode).like('%{}%'.format(value))
+        # locale. Values that can't be part of a number don't need the query to cast every row.
+        def expr(value):
+            if not search_value(value).is_number_text:
+                return sa.false()
+            return sa.sql.cast(self.sa_col, sa.Unicode).like('%{}%'.format(value))
+        return expr
 
 
 class IntFilter(NumberFilterBase):
@@ -517,6 +649,8 @@ class NumberFilter(NumberFilterBase):
 
 
 class _DateMixin(object):
+    # also search the column's text (CAST(col AS Unicode) LIKE '%value%'), which casts every row
+    search_as_text = False
     options_from = [
         (1, _('01-Jan')), (2, _('02-Feb')), (3, _('03-Mar')), (4, _('04-Apr')),
         (5, _('05-May')), (6, _('06-Jun')), (7, _('07-Jul')), (8, _('08-Aug')),
@@ -730,25 +864,63 @@ class _DateMixin(object):
             return min_dt(1753, 1, 1) <= value <= max_dt(9999, 12, 31, 23, 59, 59, 997)
         return True
 
+    def search_range(self, value):
+        """
+            The half-open range [start, end) of dates named by a search value giving a year,
+            month/year, month/day, month or full date, or None. Given no year, it's this year.
+        """
+        fields = value.date_fields
+        if not fields or 'hour' in fields:
+            return None
+        start = value.date.date()
+        if 'month' in fields and 'day' in fields:
+            step = relativedelta(days=1)
+        elif 'month' in fields:
+            start = start.replace(day=1)
+            step = relativedelta(months=1)
+        elif 'year' in fields:
+            start = start.replace(month=1, day=1)
+            step = relativedelta(years=1)
+        else:
+            return None
+        try:
+            end = start + step
+        except (ValueError, OverflowError):
+            # the range ends after the last representable date
+            end = None
+        return start, end
+
+    def search_range_expr(self, start, end):
+        start, end = self.search_range_bound(start), self.search_range_bound(end)
+        if not self.valid_date_for_backend(start):
+            return None
+        if end is None or not self.valid_date_for_backend(end):
+            return self.sa_col >= start
+        return and_(self.sa_col >= start, self.sa_col < end)
+
+    def search_range_bound(self, value):
+        return value
+
     def get_search_expr(self, date_comparator=None):
-        # This is a naive implementation that simply converts the date/time column to string and
-        # uses a LIKE. Only addition is to support a common month/day/year format, but only if
-        # the value is easily parsible
+        # Dates named by the search value are searched as ranges on the column, which can use
+        # an index. Values giving a time are compared with date_comparator. Searching the
+        # column's text as well casts every row, so is only done with search_as_text.
         date_comparator = date_comparator or (lambda value: self.sa_col == value)
 
         def expr(value):
-            base_expr = sa.sql.cast(self.sa_col, sa.Unicode).like('%{}%'.format(value))
-            try:
-                date_value = parse(value)
-                if not self.valid_date_for_backend(date_value):
-                    return base_expr
-                return or_(
-                    base_expr,
-                    date_comparator(date_value)
-                )
-            except ValueError:
-                pass
-            return base_expr
+            exprs = []
+            if self.search_as_text:
+                exprs.append(sa.sql.cast(self.sa_col, sa.Unicode).like('%{}%'.format(value)))
+            value = search_value(value)
+            date_range = self.search_range(value)
+            if date_range is not None:
+                exprs.append(self.search_range_expr(*date_range))
+            elif 'hour' in value.date_fields and self.valid_date_for_backend(value.date):
+                exprs.append(date_comparator(value.date))
+            exprs = [expr for expr in exprs if expr is not None]
+            if not exprs:
+                return sa.false()
+            return or_(*exprs)
         return expr
 
 
@@ -826,6 +998,11 @@ class DateFilter(_DateOpQueryMixin, _DateMixin, FilterBase):
         ops.last_month, ops.this_year
     )
     input_types = 'input', 'select', 'input2'
+    days_validator = feval.Int(not_empty=True)
+    date_year_validator = feval.Int(min=1900)
+    month_validator = feval.Int(not_empty=False)
+    year_validator = feval.Int(not_empty=False, min=1900, max=9999)
+    instance_state_shared = True
 
     def __init__(self, sa_col, _now=None, default_op=None, default_value1=None,
                  default_value2=None):
@@ -879,7 +1056,7 @@ class DateFilter(_DateOpQueryMixin, _DateMixin, FilterBase):
     def _process_days_operator(self, value, is_value2):
         if is_value2:
             return None
-        filter_value = feval.Int(not_empty=True).to_python(value)
+        filter_value = self.days_validator.to_python(value)
 
         if self.op in (ops.days_ago, ops.less_than_days_ago, ops.more_than_days_ago):
             try:
@@ -902,7 +1079,7 @@ class DateFilter(_DateOpQueryMixin, _DateMixin, FilterBase):
             d = ensure_date(parse(value))
 
             if isinstance(d, (dt.date, dt.datetime)) and d.year < 1900:
-                return feval.Int(min=1900).to_python(d.year)
+                return self.date_year_validator.to_python(d.year)
 
             return d
         except ValueError:
@@ -933,8 +1110,8 @@ class DateFilter(_DateOpQueryMixin, _DateMixin, FilterBase):
 
         if self.op == ops.select_month:
             if is_value2:
-                return feval.Int(not_empty=False, min=1900, max=9999).to_python(value)
-            return feval.Int(not_empty=False).to_python(value)
+                return self.year_validator.to_python(value)
+            return self.month_validator.to_python(value)
 
         if self.op in self.days_operators:
             return self._process_days_operator(value, is_value2)
@@ -1017,6 +1194,7 @@ class DateTimeFilter(DateFilter):
         ops.between: lambda self, query, today: query.filter(self._between_clause()),
         ops.not_between: lambda self, query, today: query.filter(~self._between_clause()),
     }})
+    instance_state_shared = True
 
     def __init__(self, sa_col, _now=None, default_op=None, default_value1=None,
                  default_value2=None):
@@ -1099,8 +1277,8 @@ class DateTimeFilter(DateFilter):
 
         if self.op == ops.select_month:
             if is_value2:
-                return feval.Int(not_empty=False, min=1900, max=9999).to_python(value)
-            return feval.Int(not_empty=False).to_python(value)
+                return self.year_validator.to_python(value)
+            return self.month_validator.to_python(value)
 
         if self.op in self.days_operators:
             return self._process_days_operator(value, is_value2)
@@ -1115,24 +1293,18 @@ class DateTimeFilter(DateFilter):
             and '00:00' not in value
         )
 
-    def get_search_expr(self):
-        # This is a naive implementation that simply converts the date/time column to string and
-        # uses a LIKE. Only addition is to support a common month/day/year format, but only if
-        # the value is easily parsible
-        def date_comparator(value):
-            if self._has_date_only(value, ''):
-                left_side = ensure_datetime(value.date())
-                right_side = ensure_datetime(value.date(), time_part=dt.time(23, 59, 59, 999999))
-                return self.sa_col.between(left_side, right_side)
-            return self.sa_col == value
-
-        return super().get_search_expr(date_comparator=date_comparator)
+    def search_range_bound(self, value):
+        if value is None:
+            return None
+        return ensure_datetime(value)
 
 
 class TimeFilter(FilterBase):
     operators = (ops.eq, ops.not_eq, ops.less_than_equal, ops.greater_than_equal, ops.between,
                  ops.not_between, ops.empty, ops.not_empty)
     input_types = 'input', 'input2'
+    # also search the column's text (CAST(col AS Unicode) LIKE '%value%'), which casts every row
+    search_as_text = False
 
     # !!!: localize
     time_format = '%I:%M %p'
@@ -1177,10 +1349,42 @@ class TimeFilter(FilterBase):
         except ValueError:
             raise formencode.Invalid(_('invalid time'), value, self)
 
+    def search_range(self, value):
+        """
+            The half-open range [start, end) of times named by a search value giving an hour,
+            minute or second, or None.
+        """
+        fields = value.date_fields
+        if 'hour' not in fields:
+            return None
+        start = value.date.replace(microsecond=0)
+        if 'second' in fields:
+            end = start + dt.timedelta(seconds=1)
+        elif 'minute' in fields:
+            end = start + dt.timedelta(minutes=1)
+        else:
+            end = start + dt.timedelta(hours=1)
+        # the last hour, minute or second of the day has no end
+        return start.time(), end.time() if end.day == start.day else None
+
     def get_search_expr(self, date_comparator=None):
-        # This is a naive implementation that simply converts the time column to string and
-        # uses a LIKE.
-        return lambda value: sa.sql.cast(self.sa_col, sa.Unicode).like('%{}%'.format(value))
+        # Times named by the search value are searched as ranges on the column. Searching the
+        # column's text as well casts every row, so is only done with search_as_text.
+        def expr(value):
+            exprs = []
+            if self.search_as_text:
+                exprs.append(sa.sql.cast(self.sa_col, sa.Unicode).like('%{}%'.format(value)))
+            time_range = self.search_range(search_value(value))
+            if time_range is not None:
+                start, end = time_range
+                if end is None:
+                    exprs.append(self.sa_col >= start)
+                else:
+                    exprs.append(and_(self.sa_col >= start, self.sa_col < end))
+            if not exprs:
+                return sa.false()
+            return or_(*exprs)
+        return expr
 
 
 class YesNoFilter(FilterBase):
@@ -1197,9 +1401,10 @@ class YesNoFilter(FilterBase):
 
     def get_search_expr(self):
         def expr(value):
-            if value.lower() in self.ops.yes.display:
+            lowered = search_value(value).lowered
+            if lowered in self.ops.yes.display:
                 return self.sa_col == sa.true()
-            elif value.lower() in self.ops.no.display:
+            elif lowered in self.ops.no.display:
                 return self.sa_col == sa.false()
             return None
         return expr
@@ -4,9 +4,13 @@ import io
 import warnings
 from os import path
 
-from flask import request, session, flash, Blueprint, url_for, send_file
+from flask import (
+    abort, current_app, request, session, flash, Blueprint, url_for, send_file,
+    stream_with_context
+)
 import jinja2 as jinja
 
+from webgrid.assets import StaticBundleMixin
 from webgrid.extensions import translation_manager
 
 try:
@@ -15,7 +19,7 @@ except ImportError:
     configure_jinja_environment = lambda *args, **kwargs: None  # noqa: E731
 
 
-class WebGrid(object):
+class WebGrid(StaticBundleMixin, object):
     jinja_loader = jinja.PackageLoader('webgrid', 'templates')
 
     def __init__(self, db=None):
@@ -51,7 +55,19 @@ class WebGrid(object):
         return path.join(path.dirname(__file__), 'static')
 
     def static_url(self, url_tail):
-        return url_for('webgrid.static', filename=url_tail)
+        return self.inline_static_url(url_tail) or url_for('webgrid.static', filename=url_tail)
+
+    def bundle_url(self, kind):
+        """URL of the fingerprinted 'js' or 'css' bundle, see webgrid.assets."""
+        return url_for('webgrid.bundle', file_name=self.static_bundle.file_name(kind))
+
+    def bundle_response(self, file_name):
+        asset = self.static_bundle.get(file_name)
+        if asset is None:
+            abort(404)
+        response = current_app.response_class(asset.content, mimetype=asset.mime_type)
+        response.headers['Cache-Control'] = self.bundle_cache_control()
+        return response
 
     def init_app(self, app):
         bp = Blueprint(
@@ -60,6 +76,9 @@ class WebGrid(object):
             static_folder='static',
             static_url_path=app.static_url_path + '/webgrid'
         )
+        bp.add_url_rule(
+            app.static_url_path + '/webgrid/bundle/<file_name>', 'bundle', self.bundle_response
+        )
         app.register_blueprint(bp)
         configure_jinja_environment(app.jinja_env, translation_manager)
 
@@ -67,6 +86,27 @@ class WebGrid(object):
         return send_file(data_stream, mimetype=mime_type, as_attachment=True,
                          attachment_filename=file_name)
 
+    def not_modified_response(self, etag):
+        if not request.if_none_match.contains_weak(etag):
+            return None
+        response = current_app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+
+    def set_etag(self, response, etag):
+        response.set_etag(etag)
+
+    def stream_as_response(self, chunks, mime_type='text/html'):
+        # chunks are generated with the request context still available
+        return current_app.response_class(stream_with_context(chunks), mimetype=mime_type)
+
+    def json_as_response(self, data, max_age=None):
+        response = current_app.response_class(data, mimetype='application/json')
+        if max_age:
+            response.cache_control.public = True
+            response.cache_control.max_age = max_age
+        return response
+
     def xls_as_response(self, workbook, file_name):
         warnings.warn('xls_as_response is deprecated. Use file_as_response instead',
                       DeprecationWarning)
@@ -2,10 +2,24 @@ from __future__ import absolute_import
 
 import re
 from abc import ABC, abstractmethod
+import datetime as dt
+from decimal import Context, Decimal
+from enum import Enum
+import gzip
+import hashlib
+import inspect
 import io
+import itertools
+import multiprocessing
+import os
+import random
 from operator import itemgetter
 import warnings
-from collections import defaultdict
+import weakref
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import tempfile
 
 import six
 from blazeutils.functional import identity
@@ -16,9 +30,11 @@ from blazeutils.datastructures import BlankObject
 from blazeutils.helpers import tolist
 from blazeutils.jsonh import jsonmod
 from blazeutils.spreadsheets import Writer, WriterX, xlsxwriter
-from blazeutils.strings import reindent, randnumerics
+from blazeutils.strings import case_cw2us, reindent, randnumerics
 import jinja2 as jinja
-from werkzeug.datastructures import MultiDict
+import sqlalchemy as sa
+import sqlalchemy.orm as sa_orm
+import sqlalchemy.sql.operators as sa_operators
 from werkzeug.urls import Href
 
 from .extensions import (
@@ -26,7 +42,7 @@ from .extensions import (
     ngettext,
     translation_manager
 )
-from .utils import current_url
+from .utils import LRUCache, URLBuilder, current_url
 import csv
 
 try:
@@ -44,6 +60,18 @@ try:
 except ImportError:
     xlwt = None
 
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 
 def fix_xls_value(value):
     """
@@ -62,6 +90,8 @@ class RenderLimitExceeded(Exception):
 
 class Renderer(ABC):
     _columns = None
+    # export raw record values rather than values formatted by the columns
+    raw_values = False
 
     @property
     @abstractmethod
@@ -86,6 +116,269 @@ class Renderer(ABC):
     def render(self):
         pass
 
+    def row_renderer(self, render_type, record):
+        """
+            Return a function rendering records shaped like `record` to lists of column values,
+            with each column's render function resolved up front. With `raw_values` set, the
+            columns' raw values are given instead (see `Column.raw_value_getter`).
+        """
+        if self.raw_values:
+            getters = [col.raw_value_getter(record) for col in self.columns]
+        else:
+            getters = [col.renderer(render_type) for col in self.columns]
+        return lambda record: [getter(record) for getter in getters]
+
+
+class CompressionMixin:
+    """
+        Optional compression for exports. Set `compression` to 'gzip', or 'zstd' (requires the
+        zstandard package). Data is compressed in chunks as it is written, to a temporary file
+        rather than an in-memory buffer, and the file is served as `<file name>.gz` or `.zst`.
+    """
+    compression = None
+    # level for the compressor, or None for its default
+    compression_level = None
+    # compression -> (file extension, mime type)
+    compression_formats = {
+        'gzip': ('gz', 'application/gzip'),
+        'zstd': ('zst', 'application/zstd'),
+    }
+
+    def compressor(self, output):
+        if self.compression == 'gzip':
+            level = 6 if self.compression_level is None else self.compression_level
+            return gzip.GzipFile(filename='', mode='wb', compresslevel=level, fileobj=output)
+        if self.compression == 'zstd':
+            if zstandard is None:
+                raise ImportError('you must have zstandard installed to use zstd compression')
+            level = 3 if self.compression_level is None else self.compression_level
+            return zstandard.ZstdCompressor(level=level).stream_writer(output, closefd=False)
+        raise ValueError('unknown compression: {0}'.format(self.compression))
+
+    def compressed_file(self, write):
+        """Call `write` with a binary stream, and return a file of the data compressed."""
+        output = tempfile.TemporaryFile()
+        with self.compressor(output) as stream:
+            write(stream)
+        output.seek(0)
+        return output
+
+    def compressed_response(self, write, file_name):
+        extension, mime_type = self.compression_formats[self.compression]
+        return self.grid.manager.file_as_response(
+            self.compressed_file(write), '{0}.{1}'.format(file_name, extension), mime_type
+        )
+
+
+# Exports being rendered by PartitionMixin, by export id. Worker processes are forked with these
+#   in memory, so only the ids are passed to them.
+_partitioned_exports = {}
+_partitioned_export_ids = itertools.count()
+
+
+# Pools and connections a worker inherited from the parent process. They are kept referenced,
+#   as closing them, which garbage collection would do, closes them for the parent as well.
+_inherited_connections = []
+_partition_worker = False
+# SQLAlchemy 1.4.33 and up can replace an engine's pool without closing its connections
+_dispose_keeps_connections = 'close' in inspect.signature(sa.engine.Engine.dispose).parameters
+
+
+def _record_connection_pid(dbapi_connection, connection_record):
+    connection_record.info['pid'] = os.getpid()
+
+
+def _check_connection_pid(dbapi_connection, connection_record, connection_proxy):
+    # connections made before the listeners were added belong to the process adding them,
+    #   which is never a worker
+    pid = connection_record.info.setdefault('pid', None if _partition_worker else os.getpid())
+    if pid != os.getpid():
+        # the pool makes a new connection in place of this one, which is dropped without closing
+        _inherited_connections.append(dbapi_connection)
+        connection_record.connection = connection_proxy.connection = None
+        raise sa.exc.DisconnectionError(
+            'Connection belongs to process {0}, not {1}'.format(pid, os.getpid())
+        )
+
+
+def _init_partition_worker(export_id):
+    global _partition_worker
+    _partition_worker = True
+    renderer, queries, bind = _partitioned_exports[export_id]
+    renderer.init_partition_worker(bind)
+
+
+def _render_partition(export_id, index):
+    renderer, queries, bind = _partitioned_exports[export_id]
+    session = sa_orm.Session(bind=bind)
+    try:
+        query = queries[index].with_session(session)
+        return renderer.render_partition(query.yield_per(renderer.grid.iter_records_batch_size))
+    finally:
+        session.close()
+
+
+class PartitionMixin:
+    """
+        Optional parallel rendering of an export's records. With `workers` > 1, the grid's query
+        is split into `partitions` keyset ranges on its leading ORDER BY expression (or the
+        primary key, when unordered), so that the ranges in sequence give the records in the
+        grid's order. Records of each range are rendered by `render_partition` in a worker
+        process having its own database connections, and the results are given back in order.
+
+        Workers are forked, so the grid need not be rebuilt in them. Where fork is not
+        available, or the query can't be partitioned (e.g. it is sorted on text), records are
+        rendered in this process.
+    """
+    workers = 1
+    # number of ranges the query is split into, defaults to four per worker
+    partitions = None
+    # ORDER BY is NULLS FIRST in these dialects, and NULLS LAST in others
+    nulls_first_dialects = ('sqlite', 'mysql', 'mssql')
+    # functions in a sort expression that keep the query from being partitioned
+    aggregate_functions = frozenset((
+        'avg', 'count', 'max', 'min', 'sum', 'array_agg', 'string_agg', 'group_concat',
+        'bool_and', 'bool_or', 'every', 'stddev', 'variance',
+    ))
+    aggregate_elements = (
+        sa.sql.expression.Over, sa.sql.expression.WithinGroup, sa.sql.expression.FunctionFilter,
+    )
+    # rendered ranges waiting to be given back, per worker. Bounds the memory used for
+    #   results while keeping the workers busy.
+    partitions_ahead = 2
+
+    def partition_key(self, query):
+        """Return (expression, descending) to partition `query` on, or None."""
+        # the ranges are filtered in WHERE, where grouped results can't be
+        if query._group_by or query._having is not None:
+            return None
+        if query._order_by:
+            expr = query._order_by[0]
+            desc = getattr(expr, 'modifier', None) is sa_operators.desc_op
+            if isinstance(expr, sa.sql.expression.UnaryExpression):
+                expr = expr.element
+            if isinstance(expr, sa.sql.expression.Label):
+                expr = expr.element
+            if isinstance(expr, sa.sql.expression.TextClause) or self.is_aggregate(expr):
+                return None
+            return expr, desc
+        entity = query.column_descriptions[0]['entity'] if query.column_descriptions else None
+        mapper = sa.inspect(entity, raiseerr=False) if entity is not None else None
+        if mapper is None or len(mapper.primary_key) != 1:
+            return None
+        return mapper.primary_key[0], False
+
+    def is_aggregate(self, expr):
+        # aggregate and window functions are not allowed in WHERE
+        for element in sa.sql.visitors.iterate(expr, {}):
+            if isinstance(element, self.aggregate_elements) or (
+                isinstance(element, sa.sql.functions.FunctionElement)
+                and getattr(element, 'name', '').lower() in self.aggregate_functions
+            ):
+                return True
+        return False
+
+    def partition_bounds(self, query, expr, count):
+        # lower bounds of the ranges after the first, each the key at an even step through the
+        #   keys. Repeated keys are dropped, so that rows having the same key are in one range.
+        keys = query.with_entities(expr).filter(expr.isnot(None)).order_by(None).order_by(expr)
+        total = keys.count()
+        bounds = []
+        for step in range(1, count):
+            value = keys.offset(total * step // count).limit(1).scalar()
+            if value is not None and (not bounds or value != bounds[-1]):
+                bounds.append(value)
+        return bounds
+
+    def partition_queries(self, query):
+        """The grid query split into range queries, in the grid's order, or None."""
+        partition_key = self.partition_key(query)
+        if partition_key is None:
+            return None
+        expr, desc = partition_key
+        bounds = self.partition_bounds(query, expr, self.partitions or self.workers * 4)
+        queries = []
+        for low, high in zip([None] + bounds, bounds + [None]):
+            conditions = [expr.isnot(None) if low is None else expr >= low]
+            if high is not None:
+                conditions.append(expr < high)
+            queries.append(query.filter(*conditions))
+        if desc:
+            queries.reverse()
+        nulls_first = query.session.get_bind().dialect.name in self.nulls_first_dialects
+        if nulls_first != desc:
+            queries.insert(0, query.filter(expr.is_(None)))
+        else:
+            queries.append(query.filter(expr.is_(None)))
+        return queries
+
+    def shares_connections(self, bind):
+        # in-memory SQLite databases only exist on the connection, so workers use the inherited one
+        return bind.url.get_backend_name() == 'sqlite' and \
+            bind.url.database in (None, '', ':memory:')
+
+    def prepare_partition_bind(self, bind):
+        """
+            Called before workers are forked. Connections inherited from this process can't be
+            used or closed by the workers (closing would close them for this process too). Where
+            the engine's pool can't be replaced without closing them, pool events are added
+            that make the workers' pools drop connections made in another process.
+        """
+        if _dispose_keeps_connections or self.shares_connections(bind) or \
+                sa.event.contains(bind, 'checkout', _check_connection_pid):
+            return
+        sa.event.listen(bind, 'connect', _record_connection_pid)
+        sa.event.listen(bind, 'checkout', _check_connection_pid)
+
+    def init_partition_worker(self, bind):
+        if _dispose_keeps_connections and not self.shares_connections(bind):
+            _inherited_connections.append(bind.pool)
+            bind.dispose(close=False)
+
+    @abstractmethod
+    def render_partition(self, records):
+        """Render the records of one range in a worker. The result must be picklable."""
+
+    def iter_partitions(self):
+        """
+            Yield the rendered ranges in order, or return None if the records are to be rendered
+            in this process.
+        """
+        if self.workers <= 1 or self.grid._records is not None:
+            return None
+        try:
+            mp_context = multiprocessing.get_context('fork')
+        except ValueError:
+            return None
+        query = self.grid.build_query()
+        queries = self.partition_queries(query)
+        if queries is None:
+            return None
+        bind = query.session.get_bind()
+        self.prepare_partition_bind(bind)
+        return self._iter_partitions(mp_context, queries, bind)
+
+    def _iter_partitions(self, mp_context, queries, bind):
+        export_id = next(_partitioned_export_ids)
+        _partitioned_exports[export_id] = (self, queries, bind)
+        try:
+            with ProcessPoolExecutor(self.workers, mp_context=mp_context,
+                                     initializer=_init_partition_worker,
+                                     initargs=(export_id,)) as executor:
+                # ranges are submitted as results are given back, rather than all at once
+                indexes = iter(range(len(queries)))
+                pending = deque(
+                    executor.submit(_render_partition, export_id, index)
+                    for index in itertools.islice(indexes, self.workers * self.partitions_ahead)
+                )
+                while pending:
+                    result = pending.popleft().result()
+                    for index in itertools.islice(indexes, 1):
+                        pending.append(executor.submit(_render_partition, export_id, index))
+                    yield result
+        finally:
+            del _partitioned_exports[export_id]
+
 
 class GroupMixin:
     def has_groups(self):
@@ -161,12 +454,21 @@ class HTML(GroupMixin, Renderer):
     #
     #   filtering_operator_labels['eq'] = 'equals'
     filtering_operator_labels = {}
+    # filter and sort form fragments are cached here, keyed by everything they are rendered
+    # from (see cached_fragment). Shared by all instances, set to None to disable.
+    fragment_cache = LRUCache(maxsize=500)
+    # rows rendered at a time, and the size of the chunks given, when streaming
+    stream_batch_size = 100
+    stream_buffer_size = 16384
 
     @property
     def name(self):
         return 'html'
 
     def init(self):
+        self._options_keys = {}
+        self._url_builder = None
+        self.streaming = False
         self.manager = self.grid.manager
         if self.manager:
             self.jinja_env = self.manager.jinja_environment
@@ -188,6 +490,56 @@ class HTML(GroupMixin, Renderer):
         template = self.jinja_env.from_string(source)
         return Markup(template.render(**kwargs))
 
+    def cached_fragment(self, key, render):
+        """
+            Return the fragment cached under `key`, calling `render` to produce it on a miss.
+            The key must include every input the fragment depends on. Keys that turn out not to
+            be hashable (e.g. list option values) are rendered without caching.
+        """
+        if self.fragment_cache is None:
+            return render()
+        key = (type(self), ) + tuple(key)
+        try:
+            fragment = self.fragment_cache.get(key)
+        except TypeError:
+            return render()
+        if fragment is None:
+            fragment = render()
+            self.fragment_cache.set(key, fragment)
+        return fragment
+
+    def options_key(self, filter):
+        """
+            A cache key component standing in for a filter's full option list. Labels are
+            resolved to text so that translated labels key separately.
+        """
+        if id(filter) not in self._options_keys:
+            options = tuple((value, six.text_type(label)) for value, label in filter.options_seq)
+            try:
+                self._options_keys[id(filter)] = (len(options), hash(options))
+            except TypeError:
+                # unhashable option values, cached_fragment will skip the cache
+                self._options_keys[id(filter)] = options
+        return self._options_keys[id(filter)]
+
+    def filter_state_key(self, col):
+        filter = col.filter
+        return (
+            col.key,
+            six.text_type(col.label),
+            type(filter),
+            tuple((op.key, six.text_type(op.display)) for op in filter.operators),
+            filter.op,
+            tuple(tolist(filter.value1_set_with)),
+            tuple(tolist(filter.value2_set_with)),
+            tuple(tolist(filter.value1)),
+            self.options_key(filter) if 'select' in filter.input_types else None,
+            tuple(sorted(getattr(filter, 'html_extra', {}).items())),
+            self.grid.qs_prefix,
+            # the options asset URL is on the current page's path
+            self.url_builder().base_url if self.use_options_asset(filter) else None,
+        )
+
     def __call__(self):
         return self.render()
 
@@ -199,6 +551,36 @@ class HTML(GroupMixin, Renderer):
             raise RenderLimitExceeded('Unable to render HTML table')
         return self.load_content('grid.html')
 
+    def stream(self):
+        """
+            Render the grid as a generator of HTML chunks, for the manager's
+            `stream_as_response`. The output is the same as `render` gives, but records are
+            fetched and rendered `stream_batch_size` rows at a time as the chunks are consumed,
+            so the page need not be built in memory first. Templates are rendered with the
+            renderer's Jinja environment.
+        """
+        if not self.can_render():
+            raise RenderLimitExceeded('Unable to render HTML table')
+        return self._stream()
+
+    def _stream(self):
+        # Jinja generates many small strings, which are joined up to stream_buffer_size
+        self.streaming = True
+        try:
+            buffer = []
+            size = 0
+            for text in self.load_content_stream('grid.html'):
+                buffer.append(text)
+                size += len(text)
+                if size >= self.stream_buffer_size:
+                    yield ''.join(buffer)
+                    buffer = []
+                    size = 0
+            if buffer:
+                yield ''.join(buffer)
+        finally:
+            self.streaming = False
+
     def grid_attrs(self):
         return self.grid.hah
 
@@ -234,7 +616,10 @@ class HTML(GroupMixin, Renderer):
     def filtering_fields(self):
         rows = []
         for col in six.itervalues(self.grid.filtered_cols):
-            rows.append(self.filtering_table_row(col))
+            rows.append(self.cached_fragment(
+                ('filtering_table_row', ) + self.filter_state_key(col),
+                lambda: self.filtering_table_row(col)
+            ))
         rows = Markup('\n'.join(rows))
 
         search_row = ''
@@ -277,11 +662,16 @@ class HTML(GroupMixin, Renderer):
 
         field_name = 'op({0})'.format(col.key)
         field_name = self.grid.prefix_qs_arg_key(field_name)
-
-        return self.render_select(
-            [(op.key, op.display) for op in filter.operators],
-            current_selected,
-            name=field_name
+        options = [(op.key, op.display) for op in filter.operators]
+
+        return self.cached_fragment(
+            (
+                'filtering_col_op_select',
+                field_name,
+                tuple((key, six.text_type(display)) for key, display in options),
+                current_selected,
+            ),
+            lambda: self.render_select(options, current_selected, name=field_name)
         )
 
     def filtering_col_inputs1(self, col):
@@ -304,21 +694,49 @@ class HTML(GroupMixin, Renderer):
             )
         if 'select' in filter.input_types:
             current_selected = tolist(filter.value1) or []
-            inputs += self.render_select(
-                filter.options_seq,
-                current_selection=current_selected,
-                placeholder=None,
-                multiple=filter.receives_list,
-                name=field_name
+            select_attrs = {}
+            options = filter.options_seq
+            options_subset = None
+            if self.use_options_asset(filter):
+                # only the current selection is inlined, webgrid.js loads the rest
+                options = options_subset = [
+                    option for option in options if option[0] in current_selected
+                ]
+                select_attrs.update(self.grid.filter_options.select_attrs(col))
+            inputs += self.cached_fragment(
+                (
+                    'filtering_col_select',
+                    field_name,
+                    self.options_key(filter),
+                    tuple(current_selected),
+                    filter.receives_list,
+                    tuple(select_attrs.items()),
+                ),
+                lambda: self.render_select(
+                    options,
+                    current_selection=current_selected,
+                    placeholder=None,
+                    multiple=filter.receives_list,
+                    name=field_name,
+                    **select_attrs
+                )
             )
             if filter.receives_list:
                 inputs += self.filtering_multiselect(
                     field_name,
                     current_selected,
-                    self.filtering_filter_options_multi(filter, field_name)
+                    self.filtering_filter_options_multi(filter, field_name, options_subset)
                 )
         return inputs
 
+    def use_options_asset(self, filter):
+        if not filter.receives_list:
+            return False
+        if getattr(filter, 'lazy_options', False):
+            return True
+        threshold = self.grid.filter_options_asset_threshold
+        return threshold is not None and len(filter.option_keys) > threshold
+
     def filtering_multiselect(self, field_name, current_selected, options):
         return self._render_jinja(
             '''
@@ -356,11 +774,27 @@ class HTML(GroupMixin, Renderer):
             options=options,
         )
 
-    def filtering_filter_options_multi(self, filter, field_name):
+    def filtering_filter_options_multi(self, filter, field_name, options=None):
+        # options may be given as a subset of the filter's options (see use_options_asset)
         selected = filter.value1 or []
+        subset = options is not None
+        if not subset:
+            options = filter.options_seq
+        return self.cached_fragment(
+            (
+                'filtering_filter_options_multi',
+                field_name,
+                self.options_key(filter),
+                subset,
+                tuple(selected),
+            ),
+            lambda: self._render_filter_options_multi(options, field_name, selected)
+        )
+
+    def _render_filter_options_multi(self, options, field_name, selected):
         return self._render_jinja(
             '''
-            {% for value, label in filter.options_seq %}
+            {% for value, label in options %}
                 <label>
                     <input
                         {% if value in selected %}checked{% endif %}
@@ -372,7 +806,7 @@ class HTML(GroupMixin, Renderer):
                 </label>
             {% endfor %}
             ''',
-            filter=filter,
+            options=options,
             field_name=field_name,
             selected=selected,
         )
@@ -482,11 +916,15 @@ class HTML(GroupMixin, Renderer):
             if flag_desc:
                 currently_selected = '-' + currently_selected
 
-        return self.render_select(
-            self.sorting_select_options(),
-            currently_selected,
-            name=sort_qsk,
-            id=sort_qsk,
+        options = self.sorting_select_options()
+        return self.cached_fragment(
+            (
+                'sorting_select',
+                sort_qsk,
+                tuple((key, six.text_type(label)) for key, label in options),
+                currently_selected,
+            ),
+            lambda: self.render_select(options, currently_selected, name=sort_qsk, id=sort_qsk)
         )
 
     def sorting_select1(self):
@@ -580,6 +1018,11 @@ class HTML(GroupMixin, Renderer):
     def table(self):
         return self.load_content('grid_table.html')
 
+    def table_chunks(self):
+        if self.streaming:
+            return self.load_content_stream('grid_table.html')
+        return [self.table()]
+
     def no_records(self):
         return self._render_jinja(
             '<p class="no-records">{{msg}}</p>',
@@ -653,7 +1096,7 @@ class HTML(GroupMixin, Renderer):
             )
         return self._render_jinja(
             '<th{{attrs|wg_attributes}}>{{label}}</th>',
-            attrs=col.head.hah,
+            attrs=col.head.attrs,
             label=label
         )
 
@@ -663,18 +1106,47 @@ class HTML(GroupMixin, Renderer):
         for rownum, record in enumerate(self.grid.records):
             rows.append(self.table_tr(rownum, record))
         # process subtotals (if any)
-        if rows and self.grid.subtotals in ('page', 'all') and \
-                self.grid.subtotal_cols:
+        if rows:
+            rows.extend(self.table_totals_rows(rownum))
+        rows_str = '\n        '.join(rows)
+        return Markup(rows_str)
+
+    def table_totals_rows(self, rownum):
+        rows = []
+        if self.grid.subtotals in ('page', 'all') and self.grid.subtotal_cols:
             rows.append(
                 self.table_pagetotals(rownum + 1, self.grid.page_totals)
             )
-        if rows and self.grid.subtotals in ('grand', 'all') and \
-                self.grid.subtotal_cols:
+        if self.grid.subtotals in ('grand', 'all') and self.grid.subtotal_cols:
             rows.append(
                 self.table_grandtotals(rownum + 2, self.grid.grand_totals)
             )
-        rows_str = '\n        '.join(rows)
-        return Markup(rows_str)
+        return rows
+
+    def table_row_chunks(self):
+        if self.streaming:
+            return self.iter_table_rows()
+        return [self.table_rows().lstrip()]
+
+    def iter_table_rows(self):
+        """
+            Yield the rows `table_rows` gives, in chunks of `stream_batch_size` rows. Records
+            are iterated without keeping them on the grid.
+        """
+        separator = '\n        '
+        rows = []
+        rownum = None
+        leading = ''
+        for rownum, record in enumerate(self.grid.iter_records()):
+            rows.append(self.table_tr(rownum, record))
+            if len(rows) >= self.stream_batch_size:
+                yield Markup(leading + separator.join(rows))
+                leading = separator
+                rows = []
+        if rownum is not None:
+            rows.extend(self.table_totals_rows(rownum))
+        if rows:
+            yield Markup(leading + separator.join(rows))
 
     def table_tr_styler(self, rownum, record):
         # handle row styling
@@ -757,7 +1229,7 @@ class HTML(GroupMixin, Renderer):
         return self.table_totals(rownum, record, _('Grand Totals'), count)
 
     def table_td(self, col, record):
-        col_hah = HTMLAttributes(col.body.hah)
+        col_hah = HTMLAttributes(col.body.attrs or ())
 
         # allow column stylers to set attributes
         for styler, cname in self.grid._colstylers:
@@ -786,6 +1258,9 @@ class HTML(GroupMixin, Renderer):
     def footer(self):
         return self.load_content('grid_footer.html')
 
+    def footer_paging(self):
+        return self.load_content('grid_paging.html')
+
     def load_content(self, endpoint, **kwargs):
         kwargs['renderer'] = self
         kwargs['grid'] = self.grid
@@ -802,34 +1277,34 @@ class HTML(GroupMixin, Renderer):
         template = self.jinja_env.get_template(endpoint)
         return template.render(**kwargs)
 
-    def current_url(self, **kwargs):
-        curl = current_url(self.grid.manager, strip_querystring=True, strip_host=True)
-        href = Href(curl, sort=True)
-
-        req_args = MultiDict(self.grid.manager.request_args())
-
-        # kwargs will be modified with new keys if there is a prefix, so copy the original set
-        # of keys first. Otherwise, the loop may pick up new keys and apply the prefix again
-        key_list = list(kwargs.keys())
-        for key in key_list:
-            # arg keys may need to be prefixed
-            if self.grid.qs_prefix:
-                prefixed_key = self.grid.qs_prefix + key
-                kwargs[prefixed_key] = kwargs[key]
-                del kwargs[key]
-                key = prefixed_key
-
-            # multidicts extend, not replace, so we need to get rid of the
-            # keys first
-            try:
-                del req_args[key]
-            except KeyError:
-                pass
+    def load_content_stream(self, endpoint, **kwargs):
+        kwargs['renderer'] = self
+        kwargs['grid'] = self.grid
+        return self.jinja_env.get_template(endpoint).generate(**kwargs)
+
+    def url_builder(self):
+        # request args are parsed once per request, not once per link
+        req_args = self.grid.manager.request_args()
+        if self._url_builder is None or self._url_builder.args is not req_args:
+            curl = current_url(self.grid.manager, strip_querystring=True, strip_host=True)
+            self._url_builder = URLBuilder(curl, req_args)
+        return self._url_builder
+
+    @contextmanager
+    def url_args_dropped(self, *keys):
+        """Links rendered within the block leave the given (unprefixed) request args out."""
+        builder = self.url_builder()
+        self._url_builder = builder.without(*[self.grid.qs_prefix + key for key in keys])
+        try:
+            yield
+        finally:
+            self._url_builder = builder
 
-        # convert to md first so that if we have lists in the kwargs, they
-        # are converted appropriately
-        req_args.update(MultiDict(kwargs))
-        return href(req_args)
+    def current_url(self, **kwargs):
+        # arg keys may need to be prefixed
+        if self.grid.qs_prefix:
+            kwargs = {self.grid.qs_prefix + key: value for key, value in kwargs.items()}
+        return self.url_builder()(kwargs)
 
     def reset_url(self, session_reset=True):
         url_args = {}
@@ -859,6 +1334,17 @@ class HTML(GroupMixin, Renderer):
         warnings.warn('xls_url is deprecated. Use export_url instead.', DeprecationWarning)
         return self.export_url('xls')
 
+    def json_data_key(self):
+        # webgrid.js patches the table in place for paging/sorting links when the grid has a JSON
+        # target it can request, so give it the (prefixed) arg name to add to the link
+        for key, renderer_cls in six.iteritems(self.grid.allowed_export_targets):
+            if issubclass(renderer_cls, JSON):
+                return jsonmod.dumps({
+                    'arg': self.grid.prefix_qs_arg_key('export_to'),
+                    'value': key,
+                })
+        return jsonmod.dumps(None)
+
     def get_search_row(self):
         return self._render_jinja(
             '''
@@ -874,8 +1360,11 @@ class HTML(GroupMixin, Renderer):
         )
 
 
-class XLS(Renderer):
+class XLS(CompressionMixin, Renderer):
     mime_type = 'application/vnd.ms-excel'
+    # Parsed styles, shared by all XLS renderers, as parsing style strings is slow. Styles
+    # from here are only ever read, which is what makes sharing them across workbooks safe.
+    xlwt_style_cache = LRUCache(maxsize=500)
 
     @property
     def name(self):
@@ -896,9 +1385,20 @@ class XLS(Renderer):
             total_rows += 1
         return total_rows <= 65536 and sum(1 for _ in self.columns) <= 256
 
+    def get_xlwt_style(self, style_str, num_format_str=None):
+        key = (style_str, num_format_str)
+        style = self.xlwt_style_cache.get(key)
+        if style is None:
+            style = xlwt.easyxf(style_str, num_format_str)
+            self.xlwt_style_cache.set(key, style)
+        return style
+
     def define_styles(self):
         self.style = BlankObject()
-        self.style.bold = xlwt.easyxf('font: bold True;')
+        self.style.bold = self.get_xlwt_style('font: bold True;')
+        self.style.totals = self.get_xlwt_style('font: bold on; border: top thin')
+        # per-column styles of the totals row
+        self.total_styles = {}
 
     def sanitize_sheet_name(self, sheet_name):
         return sheet_name if len(sheet_name) <= 30 else (sheet_name[:27] + '...')
@@ -964,7 +1464,7 @@ class XLS(Renderer):
         self.grid.set_paging(None, None)
 
         rownum = 0
-        for rownum, record in enumerate(self.grid.records):
+        for rownum, record in enumerate(self.grid.iter_records()):
             self.record_row(xlh, rownum, record)
 
         # totals
@@ -980,7 +1480,7 @@ class XLS(Renderer):
     def totals_row(self, xlh, rownum, record):
         colspan = 0
         firstcol = True
-        totals_xf = xlwt.easyxf('font: bold on; border: top thin')
+        totals_xf = self.style.totals
         for col in self.columns:
             if col.key not in list(self.grid.subtotal_cols.keys()):
                 if firstcol:
@@ -1016,9 +1516,12 @@ class XLS(Renderer):
     def total_cell(self, xlh, col, record):
         value = col.render('xls', record)
         self.register_col_width(col, value)
-        stymat = col.xlwt_stymat_init()
-        stymat.font.bold = True
-        stymat.borders.top = xlwt.Formatting.Borders.THIN
+        stymat = self.total_styles.get(col.key)
+        if stymat is None:
+            # xlwt_stymat_init gives a new style object, so it can be modified
+            stymat = self.total_styles[col.key] = col.xlwt_stymat_init()
+            stymat.font.bold = True
+            stymat.borders.top = xlwt.Formatting.Borders.THIN
         xlh.awrite(fix_xls_value(value), stymat)
 
     def file_name(self):
@@ -1026,14 +1529,22 @@ class XLS(Renderer):
 
     def as_response(self, wb=None, sheet_name=None):
         wb = self.build_sheet(wb, sheet_name)
+        if self.compression:
+            return self.compressed_response(wb.save, self.file_name())
         buffer = io.BytesIO()
         wb.save(buffer)
         buffer.seek(0)
         return self.grid.manager.file_as_response(buffer, self.file_name(), self.mime_type)
 
 
-class XLSX(GroupMixin, Renderer):
+class XLSX(PartitionMixin, GroupMixin, Renderer):
     mime_type = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    # formats belong to a workbook, so they are cached per workbook and shared by all the
+    # sheets written to it (see XLSXWorkbook)
+    xlsx_format_caches = weakref.WeakKeyDictionary()
+    # widths of 'sample' mode columns are measured on this many records, plus a random sample
+    # of the later ones (see sample_width_row)
+    width_sample_size = 100
 
     @property
     def name(self):
@@ -1041,9 +1552,11 @@ class XLSX(GroupMixin, Renderer):
 
     def init(self):
         self.styles_cache = LazyDict()
-        self._xlsx_format_cache = {}
         self.default_style = {}
         self.col_widths = {}
+        self._width_cols = None
+        # seeded, so that the same records give the same widths
+        self._width_random = random.Random(0)
 
     def get_xlsx_format(self, wb, style_dict):
         """
@@ -1059,9 +1572,10 @@ class XLSX(GroupMixin, Renderer):
         See xlsxwriter.format::Format._get_xf_index for how the caching works.
         """
         key = tuple(sorted(style_dict.items(), key=itemgetter(0)))
-        if key not in self._xlsx_format_cache:
-            self._xlsx_format_cache[key] = wb.add_format(style_dict)
-        return self._xlsx_format_cache[key]
+        format_cache = self.xlsx_format_caches.setdefault(wb, {})
+        if key not in format_cache:
+            format_cache[key] = wb.add_format(style_dict)
+        return format_cache[key]
 
     def style_for_column(self, wb, col):
         if col.key not in self.styles_cache:
@@ -1075,6 +1589,41 @@ class XLSX(GroupMixin, Renderer):
         width = max((col.xls_width_calc(data), self.col_widths.get(col.key, 0)))
         self.col_widths[col.key] = width
 
+    def width_columns(self):
+        """
+            Returns keys of the columns to measure on every record and of the columns to measure
+            on sampled records. Fixed width columns need no measuring, and 'type' mode columns
+            are given their estimated width here.
+        """
+        if self._width_cols is None:
+            exact, sampled = set(), set()
+            for col in self.columns:
+                if col.xls_width:
+                    self.col_widths[col.key] = col.xls_width
+                    continue
+                mode = col.xls_width_mode
+                if mode == 'type':
+                    estimate = col.xls_width_estimate()
+                    if estimate is not None:
+                        self.col_widths[col.key] = max(estimate, self.col_widths.get(col.key, 0))
+                        continue
+                    mode = 'sample'
+                if mode == 'exact' or self.width_sample_size is None:
+                    exact.add(col.key)
+                else:
+                    sampled.add(col.key)
+            self._width_cols = frozenset(exact), frozenset(exact | sampled)
+        return self._width_cols
+
+    def sample_width_row(self, rownum):
+        # The first width_sample_size rows are measured. After that, a row is measured with the
+        #   probability it would enter a reservoir sample of that size, so that the number of
+        #   rows measured only grows with the log of the record count.
+        size = self.width_sample_size
+        if size is None or rownum < size:
+            return True
+        return self._width_random.random() * (rownum + 1) < size
+
     def adjust_column_widths(self, writer):
         for idx, col in enumerate(self.columns):
             if col.key in self.col_widths:
@@ -1126,7 +1675,7 @@ class XLSX(GroupMixin, Renderer):
         pass
 
     def body_headings(self, xlh, wb):
-        heading_style = wb.add_format({'bold': True})
+        heading_style = self.get_xlsx_format(wb, {'bold': True})
 
         # Render group labels above column headings.
         if self.has_groups():
@@ -1153,25 +1702,48 @@ class XLSX(GroupMixin, Renderer):
         xlh.nextrow()
 
     def body_records(self, xlh, wb):
-        # turn off paging
-        self.grid.set_paging(None, None)
+        # turn off paging (unless already off, which would clear records set on the grid, e.g.
+        #   by XLSXWorkbook)
+        if self.grid.per_page is not None or self.grid.on_page is not None:
+            self.grid.set_paging(None, None)
 
         rownum = 0
-        for rownum, record in enumerate(self.grid.records):
-            self.record_row(xlh, rownum, record, wb)
+        partitions = self.iter_partitions()
+        if partitions is None:
+            for rownum, record in enumerate(self.grid.iter_records()):
+                self.record_row(xlh, rownum, record, wb)
+        else:
+            # worker processes render the values, which are written here in order
+            rows = itertools.chain.from_iterable(partitions)
+            for rownum, values in enumerate(rows):
+                self.write_row(xlh, rownum, values, wb)
 
         # totals
         if rownum and self.grid.subtotals != 'none' and self.grid.subtotal_cols:
             self.totals_row(xlh, rownum + 1, self.grid.grand_totals, wb)
 
     def record_row(self, xlh, rownum, record, wb):
-        for col in self.columns:
-            value = col.render('xlsx', record)
+        self.write_row(xlh, rownum, [col.render('xlsx', record) for col in self.columns], wb)
+
+    def write_row(self, xlh, rownum, values, wb):
+        exact_cols, sampled_cols = self.width_columns()
+        width_cols = sampled_cols if self.sample_width_row(rownum) else exact_cols
+        for col, value in zip(self.columns, values):
             style = self.style_for_column(wb, col)
             xlh.awrite(fix_xls_value(value), style)
-            self.update_column_width(col, value)
+            if col.key in width_cols:
+                self.update_column_width(col, value)
         xlh.nextrow()
 
+    def render_partition(self, records):
+        rows = []
+        render_row = None
+        for record in records:
+            if render_row is None:
+                render_row = self.row_renderer('xlsx', record)
+            rows.append([fix_xls_value(value) for value in render_row(record)])
+        return rows
+
     def totals_row(self, xlh, rownum, record, wb):
         colspan = 0
         firstcol = True
@@ -1179,7 +1751,7 @@ class XLSX(GroupMixin, Renderer):
             'bold': True,
             'top': 6  # Double think border
         }
-        base_style = wb.add_format(base_style_attrs)
+        base_style = self.get_xlsx_format(wb, base_style_attrs)
         for col in self.columns:
             if col.key not in list(self.grid.subtotal_cols.keys()):
                 if firstcol:
@@ -1211,7 +1783,7 @@ class XLSX(GroupMixin, Renderer):
 
             style = base_style_attrs.copy()
             style.update(getattr(col, 'xlsx_style', self.default_style))
-            style = wb.add_format(style)
+            style = self.get_xlsx_format(wb, style)
             value = col.render('xlsx', record)
             xlh.awrite(fix_xls_value(value), style)
             self.update_column_width(col, value)
@@ -1229,7 +1801,96 @@ class XLSX(GroupMixin, Renderer):
         return self.grid.manager.file_as_response(wb.filename, self.file_name(), self.mime_type)
 
 
-class CSV(Renderer):
+class XLSXWorkbook(object):
+    """
+        Writes several grids as the sheets of one XLSX workbook:
+
+            workbook = XLSXWorkbook('management_report', max_workers=4)
+            workbook.add_sheet(OpenOrdersGrid(), 'Open Orders')
+            workbook.add_sheet(ClosedOrdersGrid(), 'Closed Orders')
+            return workbook.as_response()
+
+        For several sheets from one grid class with different filters, add one grid instance per
+        sheet, each with its filters set.
+
+        Each sheet's records are counted, then streamed from the grid's query as the sheet is
+        written (see `BaseGrid.iter_records`). With `max_workers` above 1, the queries are started
+        in parallel in a thread pool, each grid's on its own session (and so pooled connection),
+        while sheets are written in order as their records arrive. The workbook is written in
+        xlsxwriter's constant memory mode to a temporary file.
+    """
+    mime_type = XLSX.mime_type
+
+    def __init__(self, name='workbook', max_workers=1):
+        self.name = name
+        self.max_workers = max_workers
+        self.sheets = []
+
+    def add_sheet(self, grid, sheet_name=None):
+        self.sheets.append((grid, sheet_name))
+        return self
+
+    def fetch_records(self, grid, query, count_query, bind):
+        # runs in a worker thread: sessions are not thread-safe, so use a new one for the
+        #   queries. The records query is started here, and its rows are fetched in batches as
+        #   the sheet is written.
+        session = sa_orm.Session(bind=bind)
+        try:
+            record_count = grid.count_records(count_query.with_session(session))
+            records = iter(query.with_session(session).yield_per(grid.iter_records_batch_size))
+        except BaseException:
+            session.close()
+            raise
+        return records, record_count, session
+
+    def build(self, output=None):
+        if xlsxwriter is None:
+            raise ImportError('you must have xlsxwriter installed to use the XLSX renderer')
+        if output is None:
+            output = tempfile.TemporaryFile()
+        # the whole export is for the workbook, so turn off paging before querying
+        for grid, sheet_name in self.sheets:
+            grid.set_paging(None, None)
+
+        futures = []
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                if self.max_workers > 1:
+                    for grid, sheet_name in self.sheets:
+                        query = grid.build_query()
+                        futures.append(executor.submit(
+                            self.fetch_records, grid, query, grid.build_query(for_count=True),
+                            query.session.get_bind()
+                        ))
+                try:
+                    with xlsxwriter.Workbook(output, options={'constant_memory': True}) as wb:
+                        for idx, (grid, sheet_name) in enumerate(self.sheets):
+                            if futures:
+                                records, record_count, session = futures[idx].result()
+                                grid.set_records(records, record_count)
+                            grid.xlsx.build_sheet(wb, sheet_name)
+                finally:
+                    for future in futures:
+                        future.cancel()
+        finally:
+            # leaving the executor waited for the queries already running, so every future not
+            #   cancelled is done, and holds a session unless its queries failed
+            for future in futures:
+                if not future.cancelled() and future.exception() is None:
+                    future.result()[-1].close()
+
+        output.seek(0)
+        return output
+
+    def file_name(self):
+        return '{0}_{1}.xlsx'.format(self.name, randnumerics(6))
+
+    def as_response(self):
+        manager = self.sheets[0][0].manager
+        return manager.file_as_response(self.build(), self.file_name(), self.mime_type)
+
+
+class CSV(CompressionMixin, PartitionMixin, Renderer):
     mime_type = 'text/csv'
 
     @property
@@ -1238,10 +1899,24 @@ class CSV(Renderer):
 
     def render(self):
         self.output = six.StringIO()
-        self.writer = csv.writer(self.output, delimiter=',', quotechar='"')
+        self.write_csv(self.output)
+
+    def write_csv(self, output):
+        self.csv_output = output
+        self.writer = self.csv_writer(output)
         self.body_headings()
         self.body_records()
 
+    def csv_writer(self, output):
+        return csv.writer(output, delimiter=',', quotechar='"')
+
+    def write_encoded(self, stream):
+        # rows go through the text wrapper's buffer to the stream in chunks
+        output = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+        self.write_csv(output)
+        output.flush()
+        output.detach()
+
     def file_name(self):
         return '{0}_{1}.csv'.format(self.grid.ident, randnumerics(6))
 
@@ -1261,13 +1936,333 @@ class CSV(Renderer):
         # turn off paging
         self.grid.set_paging(None, None)
 
-        for rownum, record in enumerate(self.grid.records):
-            row = []
-            for col in self.columns:
-                row.append(col.render('csv', record))
-            self.writer.writerow(row)
+        partitions = self.iter_partitions()
+        if partitions is None:
+            self.write_records(self.writer, self.grid.iter_records())
+        else:
+            # worker processes give CSV text, which is written here in order
+            for text in partitions:
+                self.csv_output.write(text)
+
+    def write_records(self, writer, records):
+        render_row = None
+        for record in records:
+            if render_row is None:
+                render_row = self.row_renderer('csv', record)
+            writer.writerow(render_row(record))
+
+    def render_partition(self, records):
+        output = six.StringIO()
+        self.write_records(self.csv_writer(output), records)
+        return output.getvalue()
 
     def as_response(self):
+        if self.compression:
+            return self.compressed_response(self.write_encoded, self.file_name())
         buffer = self.build_csv()
         buffer.seek(0)
         return self.grid.manager.file_as_response(buffer, self.file_name(), self.mime_type)
+
+
+class ArrowBase(Renderer):
+    """
+        Base for exports written with Apache Arrow. Records are fetched and converted to
+        columnar record batches of `batch_size` rows, typed by each column's `arrow_data_type`,
+        which are written out one at a time to a temporary file. Memory use is bounded by the
+        batch size rather than the record count.
+    """
+    batch_size = 10000
+    file_extension = None
+
+    @property
+    def columns(self):
+        # same columns as the CSV export
+        if not self._columns:
+            self._columns = list(self.grid.iter_columns('csv'))
+        return self._columns
+
+    def field_name(self, col):
+        return col.key if col.key is not None else six.text_type(col.label)
+
+    def arrow_schema(self):
+        return pyarrow.schema([
+            pyarrow.field(self.field_name(col), col.arrow_data_type()) for col in self.columns
+        ])
+
+    def value_converter(self, arrow_type):
+        # Convert values Arrow won't take as they are for the column's type. Most types take
+        #   values as the database driver gives them.
+        if pyarrow.types.is_string(arrow_type):
+            return six.text_type
+        if pyarrow.types.is_floating(arrow_type):
+            return float
+        if pyarrow.types.is_decimal(arrow_type):
+            # floats, and values having more places than the type, are rounded to its scale
+            context = Context(prec=arrow_type.precision)
+            exponent = Decimal(1).scaleb(-arrow_type.scale)
+            return lambda value: context.quantize(Decimal(value), exponent)
+        return None
+
+    def iter_records(self):
+        # turn off paging
+        self.grid.set_paging(None, None)
+        return self.grid.iter_records(self.batch_size)
+
+    def iter_batches(self, schema):
+        converters = [self.value_converter(field.type) for field in schema]
+        records = self.iter_records()
+        render_row = None
+        while True:
+            records_batch = list(itertools.islice(records, self.batch_size))
+            if not records_batch:
+                break
+            if render_row is None:
+                render_row = self.row_renderer('arrow', records_batch[0])
+            rows = [render_row(record) for record in records_batch]
+            arrays = []
+            for idx, field in enumerate(schema):
+                values = [row[idx] for row in rows]
+                converter = converters[idx]
+                if converter is not None:
+                    values = [None if value is None else converter(value) for value in values]
+                arrays.append(pyarrow.array(values, type=field.type))
+            yield pyarrow.RecordBatch.from_arrays(arrays, schema=schema)
+
+    @abstractmethod
+    def write(self, output, schema):
+        pass
+
+    def render(self):
+        if pyarrow is None:
+            raise ImportError('you must have pyarrow installed to use the {0} renderer'.format(
+                self.__class__.__name__
+            ))
+        output = tempfile.TemporaryFile()
+        self.write(output, self.arrow_schema())
+        output.seek(0)
+        return output
+
+    def file_name(self):
+        return '{0}_{1}.{2}'.format(self.grid.ident, randnumerics(6), self.file_extension)
+
+    def as_response(self):
+        return self.grid.manager.file_as_response(self.render(), self.file_name(), self.mime_type)
+
+
+class Parquet(ArrowBase):
+    mime_type = 'application/vnd.apache.parquet'
+    file_extension = 'parquet'
+
+    @property
+    def name(self):
+        return 'parquet'
+
+    def write(self, output, schema):
+        with pyarrow.parquet.ParquetWriter(output, schema) as writer:
+            for batch in self.iter_batches(schema):
+                writer.write_batch(batch)
+
+
+class ArrowIPC(ArrowBase):
+    mime_type = 'application/vnd.apache.arrow.file'
+    file_extension = 'arrow'
+
+    @property
+    def name(self):
+        return 'arrow'
+
+    def write(self, output, schema):
+        with pyarrow.ipc.new_file(output, schema) as writer:
+            for batch in self.iter_batches(schema):
+                writer.write_batch(batch)
+
+
+class JSON(Renderer):
+    """
+        Renders the current page of records, counts, and totals as a JSON document. Rows are
+        given both as data values for API consumers and as rendered HTML fragments, so that
+        webgrid.js can replace the table body and pager without reloading the whole grid.
+    """
+    mime_type = 'application/json'
+
+    @property
+    def name(self):
+        return 'json'
+
+    @property
+    def columns(self):
+        # the JSON payload mirrors the HTML table, so use the same set of columns
+        if not self._columns:
+            self._columns = list(self.grid.iter_columns('html'))
+        return self._columns
+
+    def render(self):
+        return jsonmod.dumps(self.data(), default=self.json_default)
+
+    def json_default(self, value):
+        if isinstance(value, (dt.date, dt.datetime, dt.time)):
+            return value.isoformat()
+        if isinstance(value, Decimal):
+            return str(value)
+        if isinstance(value, Enum):
+            return value.value
+        return six.text_type(value)
+
+    def data(self):
+        grid = self.grid
+        return {
+            'columns': self.column_schema(),
+            'records': [self.record_values(record) for record in grid.records],
+            'record_count': grid.record_count,
+            'page_count': grid.page_count,
+            'on_page': grid.on_page,
+            'per_page': grid.per_page,
+            'totals': self.totals(),
+            'html': self.html_fragments(),
+        }
+
+    def column_schema(self):
+        return [
+            {
+                'key': col.key,
+                'label': six.text_type(col.label),
+                'sortable': bool(col.can_sort),
+                'type': self.column_type(col),
+            }
+            for col in self.columns
+        ]
+
+    def column_type(self, col):
+        # describe the column by the nearest webgrid column class, so that grid-specific
+        # subclasses still report e.g. "numeric" or "date_time"
+        for cls in type(col).__mro__:
+            if cls.__module__ == 'webgrid':
+                name = re.sub(r'Column(Base)?$', '', cls.__name__)
+                return case_cw2us(name) if name else None
+        return None
+
+    def record_values(self, record):
+        return [col.render('json', record) for col in self.columns]
+
+    def totals(self):
+        grid = self.grid
+        if grid.subtotals == 'none' or not grid.subtotal_cols:
+            return None
+        totals = {}
+        if grid.subtotals in ('page', 'all'):
+            totals['page'] = self.totals_values(grid.page_totals)
+        if grid.subtotals in ('grand', 'all'):
+            totals['grand'] = self.totals_values(grid.grand_totals)
+        return totals
+
+    def totals_values(self, record):
+        if record is None:
+            return None
+        return {key: getattr(record, key) for key in self.grid.subtotal_cols.keys()}
+
+    def html_fragments(self):
+        html = self.grid.html
+        # the fragments replace the HTML grid's, so their links must not request JSON again
+        with html.url_args_dropped('export_to'):
+            return {
+                'rows': six.text_type(html.table_rows()),
+                'headings': six.text_type(html.table_column_headings()),
+                'paging': six.text_type(html.footer_paging()) if self.grid.pager_on else None,
+            }
+
+    def file_name(self):
+        return '{0}_{1}.json'.format(self.grid.ident, randnumerics(6))
+
+    def as_response(self):
+        buffer = six.BytesIO(self.render().encode('utf-8'))
+        return self.grid.manager.file_as_response(buffer, self.file_name(), self.mime_type)
+
+
+class FilterOptions(Renderer):
+    """
+        Serves the option list of an options filter as JSON, for filters whose options are not
+        inlined into the page. Two modes:
+
+        - filters with more options than the grid's `filter_options_asset_threshold` are served
+          whole. The URL carries a version hash of the options, so the response can be cached by
+          the browser for as long as the options don't change.
+        - filters with `lazy_options` set are searched (with the filter's
+          `match_options_for_value`) and paged as the user types.
+    """
+    mime_type = 'application/json'
+    # cache lifetime for a response whose requested version matches the current options
+    max_age = 365 * 24 * 60 * 60
+    # number of matching options returned per request for lazy filters
+    per_page = 50
+
+    @property
+    def name(self):
+        return 'filter_options'
+
+    def init(self):
+        self.column = None
+        self.version_requested = None
+        self.search_value = None
+        self.on_page = 1
+
+    def options_data(self, col):
+        return [[value, six.text_type(label)] for value, label in col.filter.options_seq]
+
+    def options_json(self, col):
+        return jsonmod.dumps(self.options_data(col), default=six.text_type)
+
+    def version(self, col):
+        html = self.grid.html
+        return html.cached_fragment(
+            ('filter_options_version', col.key, html.options_key(col.filter)),
+            lambda: hashlib.sha1(self.options_json(col).encode('utf-8')).hexdigest()[:12]
+        )
+
+    def url(self, col):
+        # Only the options args go in the URL, so that it is the same regardless of the grid's
+        # current filters, sort and paging and can be cached.
+        curl = current_url(self.grid.manager, strip_querystring=True, strip_host=True)
+        url_args = {self.grid.prefix_qs_arg_key('filter_options'): col.key}
+        if not self.is_lazy(col):
+            url_args[self.grid.prefix_qs_arg_key('filter_options_v')] = self.version(col)
+        return Href(curl, sort=True)(url_args)
+
+    def select_attrs(self, col):
+        attrs = {'data-options-url': self.url(col)}
+        if self.is_lazy(col):
+            attrs['data-options-lazy'] = True
+            attrs['data-options-search-arg'] = self.grid.prefix_qs_arg_key('filter_options_q')
+            attrs['data-options-page-arg'] = self.grid.prefix_qs_arg_key('filter_options_page')
+        return attrs
+
+    def is_lazy(self, col):
+        return getattr(col.filter, 'lazy_options', False)
+
+    def search_data(self, col, value, on_page):
+        filter = col.filter
+        if value:
+            matches = filter.match_options_for_value(value)
+        else:
+            matches = list(filter.options_seq)
+        start = (on_page - 1) * self.per_page
+        return {
+            'options': [
+                [key, six.text_type(label)]
+                for key, label in matches[start:start + self.per_page]
+            ],
+            'more': len(matches) > start + self.per_page,
+        }
+
+    def render(self):
+        if self.is_lazy(self.column):
+            return jsonmod.dumps(
+                self.search_data(self.column, self.search_value, self.on_page),
+                default=six.text_type
+            )
+        return self.options_json(self.column)
+
+    def as_response(self):
+        max_age = None
+        if not self.is_lazy(self.column) and self.version_requested == self.version(self.column):
+            max_age = self.max_age
+        return self.grid.manager.json_as_response(self.render(), max_age=max_age)
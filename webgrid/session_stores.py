@@ -0,0 +1,188 @@
+"""
+    Stores for the grid args saved between requests when a grid has `session_on` set.
+
+    The default, `WebSessionStore`, keeps the args in the web session itself. With cookie-backed
+    sessions, that makes every response carry the saved args of every grid the user has seen, so
+    the server-side stores keep the args in process memory or a database table instead and put
+    only a short reference token in the web session:
+
+        class MyGrid(Grid):
+            session_on = True
+            session_store = DatabaseStore('sqlite:////var/lib/myapp/grid-state.db')
+
+    All stores keep a bounded number of saved states per user, dropping the least recently saved
+    ones first.
+"""
+from __future__ import absolute_import
+
+from abc import ABC, abstractmethod
+import threading
+import time
+
+from blazeutils.strings import randchars
+import sqlalchemy as sa
+
+from .utils import LRUCache
+
+
+class SessionStore(ABC):
+    """
+        Saves serialized grid args under a key (a grid's `session_key`, or `_<ClassName>` for a
+        grid class' default args) for the current user.
+    """
+
+    def __init__(self, max_entries=20):
+        self.max_entries = max_entries
+
+    @abstractmethod
+    def get(self, manager, key):
+        """Return the args saved under `key`, or None."""
+
+    @abstractmethod
+    def save(self, manager, entries):
+        """Save `entries`, a dict of key -> serialized args."""
+
+
+class WebSessionStore(SessionStore):
+    """
+        Keeps the args in the web session, in a `dgsessions` dict. Only `session_key` entries
+        count toward `max_entries`. The per-class default entries are bounded by the number of
+        grid classes.
+    """
+
+    def get(self, manager, key):
+        return manager.web_session().get('dgsessions', {}).get(key)
+
+    def save(self, manager, entries):
+        web_session = manager.web_session()
+        if 'dgsessions' not in web_session:
+            web_session['dgsessions'] = dict()
+        dgsessions = web_session['dgsessions']
+        dgsessions.update(entries)
+        if self.max_entries is not None:
+            self.evict(web_session, dgsessions, entries)
+
+        # some frameworks/sessions need these changes manually persisted
+        manager.persist_web_session()
+
+    def evict(self, web_session, dgsessions, saved_keys):
+        # sessions may be serialized with sorted keys, so save order is tracked in a list,
+        #   oldest first. Entries saved before the list existed are treated as the oldest.
+        order = web_session.get('dgsessions_order', [])
+        untracked = [key for key in dgsessions if not key.startswith('_') and key not in order]
+        order = [
+            key for key in untracked + order if key in dgsessions and key not in saved_keys
+        ] + [key for key in saved_keys if not key.startswith('_')]
+        while len(order) > self.max_entries:
+            dgsessions.pop(order.pop(0), None)
+        web_session['dgsessions_order'] = order
+
+
+class ServerSessionStore(SessionStore):
+    """
+        Base for stores that keep the args on the server. The web session only holds a token
+        identifying the user's saved states.
+    """
+    token_session_key = 'dgstate_token'
+
+    def user_token(self, manager, create=False):
+        web_session = manager.web_session()
+        token = web_session.get(self.token_session_key)
+        if token is None and create:
+            token = web_session[self.token_session_key] = randchars(24)
+            manager.persist_web_session()
+        return token
+
+    def get(self, manager, key):
+        token = self.user_token(manager)
+        if token is None:
+            return None
+        return self.get_state(token, key)
+
+    def save(self, manager, entries):
+        self.save_states(self.user_token(manager, create=True), entries)
+
+    @abstractmethod
+    def get_state(self, token, key):
+        pass
+
+    @abstractmethod
+    def save_states(self, token, entries):
+        pass
+
+
+class MemoryStore(ServerSessionStore):
+    """
+        Keeps the args in process memory, for up to `max_users` users. Saved states are lost on
+        restart and are not shared between processes.
+    """
+
+    def __init__(self, max_entries=20, max_users=10000):
+        super(MemoryStore, self).__init__(max_entries)
+        self.users = LRUCache(maxsize=max_users)
+        self._lock = threading.Lock()
+
+    def get_state(self, token, key):
+        states = self.users.get(token)
+        if states is None:
+            return None
+        return states.get(key)
+
+    def save_states(self, token, entries):
+        with self._lock:
+            states = self.users.get(token)
+            if states is None:
+                states = LRUCache(maxsize=self.max_entries)
+                self.users.set(token, states)
+        for key, value in entries.items():
+            states.set(key, value)
+
+
+class DatabaseStore(ServerSessionStore):
+    """
+        Keeps the args in a database table, created if it does not exist. `engine` is a
+        SQLAlchemy engine or database URL; a `sqlite:///<path>` URL gives a file store.
+    """
+
+    def __init__(self, engine, table_name='webgrid_session_state', max_entries=20):
+        super(DatabaseStore, self).__init__(max_entries)
+        if isinstance(engine, str):
+            engine = sa.create_engine(engine)
+        self.engine = engine
+        self.table = sa.Table(
+            table_name, sa.MetaData(),
+            sa.Column('user_token', sa.String(32), primary_key=True),
+            sa.Column('state_key', sa.String(255), primary_key=True),
+            sa.Column('args', sa.Text, nullable=False),
+            sa.Column('saved_at', sa.Float, nullable=False, index=True),
+        )
+        self.table.create(self.engine, checkfirst=True)
+
+    def get_state(self, token, key):
+        table = self.table
+        query = sa.select([table.c.args]).where(
+            sa.and_(table.c.user_token == token, table.c.state_key == key)
+        )
+        with self.engine.connect() as conn:
+            return conn.execute(query).scalar()
+
+    def save_states(self, token, entries):
+        table = self.table
+        saved_at = time.time()
+        with self.engine.begin() as conn:
+            conn.execute(table.delete().where(
+                sa.and_(table.c.user_token == token, table.c.state_key.in_(list(entries)))
+            ))
+            conn.execute(table.insert(), [
+                {'user_token': token, 'state_key': key, 'args': value, 'saved_at': saved_at}
+                for key, value in entries.items()
+            ])
+            if self.max_entries is not None:
+                expired = sa.select([table.c.state_key]).where(
+                    table.c.user_token == token
+                ).order_by(table.c.saved_at.desc()).offset(self.max_entries)
+                expired_keys = [row.state_key for row in conn.execute(expired)]
+                if expired_keys:
+                    conn.execute(table.delete().where(sa.and_(
+                        table.c.user_token == token, table.c.state_key.in_(expired_keys)
+                    )))
@@ -24,6 +24,8 @@ $(document).ready(function() {
         $(this).siblings('input').val($(this).val());
     });
     $('.datagrid .export-link').click(verify_export);
+    $(document).on('click', '.datagrid ul.paging a, .datagrid table.records thead a',
+                   datagrid_fetch_page);
     $('.datagrid form.header').submit(datagrid_cleanup_before_form_submission);
     _datagrid_is_loaded = true;
 });
@@ -35,6 +37,12 @@ $(document).ready(function() {
 
 */
 function datagrid_activate_mselect_ui(jq_select) {
+    var options_url = jq_select.data('options-url');
+    var lazy_options = options_url && jq_select.data('options-lazy');
+    if (options_url && !lazy_options && !jq_select.data('options-loaded')) {
+        datagrid_load_select_options(jq_select, options_url);
+        return;
+    }
     var all_opt = $(jq_select).find('option[value="-1"]');
     var use_all_opt = (all_opt.text() == _('-- All --', 'webgrid'));
     if ( use_all_opt ) {
@@ -56,6 +64,115 @@ function datagrid_activate_mselect_ui(jq_select) {
     if ( use_all_opt ) {
         $(all_opt).prependTo(jq_select);
     }
+    if (lazy_options && !jq_select.data('options-loaded')) {
+        datagrid_bind_lazy_options(jq_select);
+    }
+}
+
+/*
+ datagrid_load_select_options()
+
+ Filters with large option lists render only their selected options. Fetch the full list from
+ its (cacheable) JSON asset, add the missing options to the select and the multi-select UI, and
+ then activate the UI.
+
+*/
+function datagrid_load_select_options(jq_select, options_url) {
+    jq_select.data('options-loaded', true);
+    $.getJSON(options_url).done(function(options) {
+        datagrid_add_select_options(jq_select, options);
+    }).always(function() {
+        datagrid_activate_mselect_ui(jq_select);
+    });
+}
+
+/*
+ datagrid_add_select_options()
+
+ Add options (a list of [value, label] pairs) that are not already present to the select and the
+ multi-select UI.
+
+*/
+function datagrid_add_select_options(jq_select, options) {
+    var field_name = jq_select.attr('name');
+    var jq_list_end = jq_select.siblings('.ms-parent').find('.ms-drop .ms-no-results');
+    var present = {};
+    jq_select.find('option').each(function() {
+        present[$(this).val()] = true;
+    });
+    $.each(options, function(idx, option) {
+        var value = String(option[0]);
+        if (present[value]) {
+            return;
+        }
+        jq_select.append($('<option>').val(value).text(option[1]));
+        var jq_checkbox = $('<input type="checkbox" />')
+            .val(value).attr('name', 'selectItem' + field_name);
+        jq_list_end.before($('<label>').append(jq_checkbox, ' ', document.createTextNode(option[1])));
+    });
+}
+
+/*
+ datagrid_bind_lazy_options()
+
+ Filters with lazy options render only their selected options. Search the options on the server
+ as the user types in the multi-select search box, and fetch the next page of matches when the
+ list is scrolled to the bottom.
+
+*/
+function datagrid_bind_lazy_options(jq_select) {
+    var jq_parent = jq_select.siblings('.ms-parent');
+    var search_timer = null;
+    jq_select.data('options-loaded', true);
+    // bound on the container: the multi-select UI rebinds its own search input handlers when
+    // refreshed
+    jq_parent.on('keyup', '.ms-search input', function() {
+        clearTimeout(search_timer);
+        search_timer = setTimeout(function() {
+            datagrid_fetch_lazy_options(jq_select, 1);
+        }, 250);
+    });
+    jq_parent.find('.ms-drop ul').on('scroll', function() {
+        var near_bottom = this.scrollTop + $(this).innerHeight() >= this.scrollHeight - 20;
+        if (near_bottom && jq_select.data('options-more') && !jq_select.data('options-fetching')) {
+            datagrid_fetch_lazy_options(jq_select, jq_select.data('options-page') + 1);
+        }
+    });
+    datagrid_fetch_lazy_options(jq_select, 1);
+}
+
+function datagrid_fetch_lazy_options(jq_select, page) {
+    var jq_parent = jq_select.siblings('.ms-parent');
+    var search_value = $.trim(jq_parent.find('.ms-search input').val());
+    var options_url = jq_select.data('options-url') + '&' +
+        encodeURIComponent(jq_select.data('options-search-arg')) + '=' +
+        encodeURIComponent(search_value) + '&' +
+        encodeURIComponent(jq_select.data('options-page-arg')) + '=' + page;
+    jq_select.data('options-fetching', true);
+    $.getJSON(options_url).done(function(data) {
+        if ($.trim(jq_parent.find('.ms-search input').val()) != search_value) {
+            // a newer search is pending
+            return;
+        }
+        if (page == 1) {
+            // keep the selected options, replace the rest with the new matches
+            var field_name = jq_select.attr('name');
+            jq_parent.find('.ms-drop input[name="selectItem' + field_name + '"]:not(:checked)')
+                .each(function() {
+                    var value = $(this).val();
+                    jq_select.find('option').filter(function() {
+                        return $(this).val() == value;
+                    }).remove();
+                    $(this).parent().remove();
+                });
+        }
+        datagrid_add_select_options(jq_select, data.options);
+        jq_select.data('options-page', page);
+        jq_select.data('options-more', data.more);
+        jq_select.webgridMultipleSelect('refresh');
+    }).always(function() {
+        jq_select.data('options-fetching', false);
+    });
 }
 
 /*
@@ -282,3 +399,50 @@ function datagrid_cleanup_before_form_submission() {
     });
     return true;
 }
+
+
+/*
+ datagrid_fetch_page()
+
+ Called when a paging or sorting link is clicked. If the grid has a JSON target available, the
+ page is requested as JSON and only the table headings, body and pager are replaced. Otherwise
+ (or if anything goes wrong) the link is followed normally.
+
+ */
+function datagrid_fetch_page(event) {
+    if (typeof datagrid_json_data === "undefined" || !datagrid_json_data) {
+        return true;
+    }
+    var href = $(this).attr('href');
+    var jq_grid = $(this).closest('.datagrid');
+    var jq_table = jq_grid.find('table.records');
+    if (!href || jq_table.length == 0) {
+        return true;
+    }
+    event.preventDefault();
+
+    var url = href + (href.indexOf('?') == -1 ? '?' : '&') +
+        encodeURIComponent(datagrid_json_data.arg) + '=' +
+        encodeURIComponent(datagrid_json_data.value);
+    $.getJSON(url).done(function(data) {
+        if (!data.record_count) {
+            // no table to patch, let the server render the "no records" page
+            window.location = href;
+            return;
+        }
+        jq_table.find('thead tr').last().html(data.html.headings);
+        jq_table.find('tbody').html(data.html.rows);
+        if (data.html.paging) {
+            jq_grid.find('ul.paging').replaceWith(data.html.paging);
+        }
+        jq_grid.find('.header .record-count').text(data.record_count);
+        jq_grid.find('.header .page input').val(data.on_page).attr('max', data.page_count);
+        jq_grid.find('.header .perpage input').val(data.per_page);
+        if (window.history && window.history.pushState) {
+            window.history.pushState(null, '', href);
+        }
+    }).fail(function() {
+        window.location = href;
+    });
+    return false;
+}
@@ -8,7 +8,7 @@ import formencode
 from nose.tools import eq_, assert_raises
 from .helpers import query_to_str
 
-from webgrid.filters import Operator
+from webgrid.filters import Operator, ops
 from webgrid.filters import OptionsFilterBase, TextFilter, IntFilter, NumberFilter, DateFilter, \
     DateTimeFilter, FilterBase, TimeFilter, YesNoFilter, OptionsEnumFilter
 from webgrid_ta.model.entities import ArrowRecord, Person, db, AccountType
@@ -74,6 +74,32 @@ class TestOperator:
         lookup = {a: 1, b: 2, c: 3}
         assert lookup[a] == 1
 
+    def test_operator_table_shared(self):
+        tf = TextFilter(Person.firstname)
+        tf2 = tf.new_instance()
+        assert tf.operator_table is tf2.operator_table
+        assert TextFilter(Person.lastname).operator_table is tf.operator_table
+        assert DateFilter(Person.due_date).operator_table is not tf.operator_table
+        eq_(tf.op_keys, ['eq', '!eq', 'contains', '!contains', 'empty', '!empty'])
+
+        class CustomFilter(TextFilter):
+            operators = ops.eq, ops.empty
+        eq_(CustomFilter(Person.firstname).op_keys, ['eq', 'empty'])
+
+        tf2.operators = ops.eq,
+        eq_(tf2.op_keys, ['eq'])
+        eq_(tf.op_keys, ['eq', '!eq', 'contains', '!contains', 'empty', '!empty'])
+
+    def test_is_active(self):
+        tf = TextFilter(Person.firstname)
+        assert not tf.is_active
+        tf.set('contains', None)
+        assert not tf.is_active
+        tf.set('empty', None)
+        assert tf.is_active
+        tf.set('contains', 'foo')
+        assert tf.is_active
+
 
 class TestTextFilter(CheckFilterBase):
     def test_eq(self):
@@ -272,6 +298,10 @@ class TestNumberFilters(CheckFilterBase):
         assert str(expr) == 'CAST(persons.numericcol AS VARCHAR) LIKE :param_1', str(expr)
         assert expr.right.value == '%12345%'
 
+        # the text of a number can't contain this, so no cast is needed
+        expr = expr_factory('12 Main St')
+        assert str(expr) == 'false', str(expr)
+
 
 class TestDateFilter(CheckFilterBase):
     between_sql = "WHERE persons.due_date BETWEEN '2012-01-01' AND '2012-01-31'"
@@ -730,9 +760,23 @@ class TestDateFilter(CheckFilterBase):
         expr_factory = DateFilter(Person.due_date).get_search_expr()
         assert callable(expr_factory)
         expr = expr_factory('foo')
+        assert str(expr) == 'false', str(expr)
+
+    def test_search_expr_as_text(self):
+        class TextSearchDateFilter(DateFilter):
+            search_as_text = True
+
+        expr_factory = TextSearchDateFilter(Person.due_date).get_search_expr()
+        expr = expr_factory('foo')
         assert str(expr) == 'CAST(persons.due_date AS VARCHAR) LIKE :param_1', str(expr)
         assert expr.right.value == '%foo%'
 
+        expr = expr_factory('6/2019')
+        assert str(expr) == (
+            'CAST(persons.due_date AS VARCHAR) LIKE :param_1'
+            ' OR persons.due_date >= :due_date_1 AND persons.due_date < :due_date_2'
+        ), str(expr)
+
     def test_search_expr_with_numeric(self):
         fake_dialect = namedtuple('dialect', 'name')
 
@@ -741,29 +785,58 @@ class TestDateFilter(CheckFilterBase):
         expr_factory = filter.get_search_expr()
         assert callable(expr_factory)
         expr = expr_factory('1753')
-        assert str(expr) == (
-            'CAST(persons.due_date AS VARCHAR) LIKE :param_1 OR persons.due_date = :due_date_1'
-        )
-        assert expr.clauses[0].right.value == '%1753%', expr.clauses[0].right.value
-        assert expr.clauses[1].right.value.year == 1753
+        assert str(expr) == 'persons.due_date >= :due_date_1 AND persons.due_date < :due_date_2'
+        assert expr.clauses[0].right.value == dt.date(1753, 1, 1)
+        assert expr.clauses[1].right.value == dt.date(1754, 1, 1)
 
         # mssql out of range
         filter = DateFilter(Person.due_date).new_instance(dialect=fake_dialect('mssql'))
         expr_factory = filter.get_search_expr()
         assert callable(expr_factory)
         expr = expr_factory('1752')
-        assert str(expr) == 'CAST(persons.due_date AS VARCHAR) LIKE :param_1'
-        assert expr.right.value == '%1752%'
+        assert str(expr) == 'false'
+
+        # a number that doesn't name a date
+        expr = expr_factory('12')
+        assert str(expr) == 'false'
 
     def test_search_expr_with_date(self):
         expr_factory = DateFilter(Person.due_date).get_search_expr()
         assert callable(expr_factory)
         expr = expr_factory('6/19/2019')
-        assert str(expr) == (
-            'CAST(persons.due_date AS VARCHAR) LIKE :param_1 OR persons.due_date = :due_date_1'
+        assert str(expr) == 'persons.due_date >= :due_date_1 AND persons.due_date < :due_date_2'
+        assert expr.clauses[0].right.value == dt.date(2019, 6, 19)
+        assert expr.clauses[1].right.value == dt.date(2019, 6, 20)
+
+        self.assert_in_query(
+            db.session.query(Person.id).filter(expr_factory('2019-06-19')),
+            "WHERE persons.due_date >= '2019-06-19' AND persons.due_date < '2019-06-20'"
         )
-        assert expr.clauses[0].right.value == '%6/19/2019%'
-        assert expr.clauses[1].right.value == dt.datetime(2019, 6, 19)
+
+    def test_search_expr_with_partial_date(self):
+        expr_factory = DateFilter(Person.due_date).get_search_expr()
+        this_year = dt.date.today().year
+
+        def assert_range(value, start, end):
+            expr = expr_factory(value)
+            eq_(expr.clauses[0].right.value, start)
+            eq_(expr.clauses[1].right.value, end)
+
+        assert_range('2019', dt.date(2019, 1, 1), dt.date(2020, 1, 1))
+        assert_range('12/2019', dt.date(2019, 12, 1), dt.date(2020, 1, 1))
+        assert_range('June 2019', dt.date(2019, 6, 1), dt.date(2019, 7, 1))
+        assert_range('6/19', dt.date(this_year, 6, 19), dt.date(this_year, 6, 20))
+        assert_range('June', dt.date(this_year, 6, 1), dt.date(this_year, 7, 1))
+
+        # the range is open ended when it would end after the last date
+        expr = expr_factory('9999')
+        assert str(expr) == 'persons.due_date >= :due_date_1', str(expr)
+
+    def test_search_expr_with_time(self):
+        expr_factory = DateFilter(Person.due_date).get_search_expr()
+        expr = expr_factory('6/19/2019 10:30')
+        assert str(expr) == 'persons.due_date = :due_date_1', str(expr)
+        assert expr.right.value == dt.datetime(2019, 6, 19, 10, 30)
 
     def test_valid_date_for_backend(self):
         fake_dialect = namedtuple('dialect', 'name')
@@ -1289,20 +1362,27 @@ class TestDateTimeFilter(CheckFilterBase):
         expr_factory = DateTimeFilter(Person.due_date).get_search_expr()
         assert callable(expr_factory)
         expr = expr_factory('foo')
-        assert str(expr) == 'CAST(persons.due_date AS VARCHAR) LIKE :param_1', str(expr)
-        assert expr.right.value == '%foo%'
+        assert str(expr) == 'false', str(expr)
 
     def test_search_expr_with_date(self):
         expr_factory = DateTimeFilter(Person.due_date).get_search_expr()
         assert callable(expr_factory)
         expr = expr_factory('6/19/2019')
         assert str(expr) == (
-            'CAST(persons.due_date AS VARCHAR) LIKE :param_1 '
-            'OR persons.due_date BETWEEN :due_date_1 AND :due_date_2'
+            'persons.due_date >= :due_date_1 AND persons.due_date < :due_date_2'
         ), str(expr)
-        assert expr.clauses[0].right.value == '%6/19/2019%'
-        assert expr.clauses[1].right.clauses[0].value == dt.datetime(2019, 6, 19)
-        assert expr.clauses[1].right.clauses[1].value == dt.datetime(2019, 6, 19, 23, 59, 59, 999999)  # noqa: E501
+        assert expr.clauses[0].right.value == dt.datetime(2019, 6, 19)
+        assert expr.clauses[1].right.value == dt.datetime(2019, 6, 20)
+
+        expr = expr_factory('2019')
+        assert expr.clauses[0].right.value == dt.datetime(2019, 1, 1)
+        assert expr.clauses[1].right.value == dt.datetime(2020, 1, 1)
+
+    def test_search_expr_with_time(self):
+        expr_factory = DateTimeFilter(Person.due_date).get_search_expr()
+        expr = expr_factory('6/19/2019 10:30')
+        assert str(expr) == 'persons.due_date = :due_date_1', str(expr)
+        assert expr.right.value == dt.datetime(2019, 6, 19, 10, 30)
 
     def test_search_expr_invalid_date(self):
         fake_dialect = namedtuple('dialect', 'name')
@@ -1311,8 +1391,7 @@ class TestDateTimeFilter(CheckFilterBase):
         expr_factory = filter.get_search_expr()
         assert callable(expr_factory)
         expr = expr_factory('6/19/1752')
-        assert str(expr) == 'CAST(persons.due_date AS VARCHAR) LIKE :param_1', str(expr)
-        assert expr.right.value == '%6/19/1752%'
+        assert str(expr) == 'false', str(expr)
 
 
 class TestTimeFilter(CheckFilterBase):
@@ -1370,6 +1449,27 @@ class TestTimeFilter(CheckFilterBase):
         expr_factory = TimeFilter(Person.start_time).get_search_expr()
         assert callable(expr_factory)
         expr = expr_factory('foo')
+        assert str(expr) == 'false', str(expr)
+
+        expr = expr_factory('10:30 am')
+        assert str(expr) == (
+            'persons.start_time >= :start_time_1 AND persons.start_time < :start_time_2'
+        ), str(expr)
+        assert expr.clauses[0].right.value == dt.time(10, 30)
+        assert expr.clauses[1].right.value == dt.time(10, 31)
+
+        expr = expr_factory('2 pm')
+        assert expr.clauses[0].right.value == dt.time(14)
+        assert expr.clauses[1].right.value == dt.time(15)
+
+        expr = expr_factory('11 pm')
+        assert str(expr) == 'persons.start_time >= :start_time_1', str(expr)
+
+    def test_search_expr_as_text(self):
+        class TextSearchTimeFilter(TimeFilter):
+            search_as_text = True
+
+        expr = TextSearchTimeFilter(Person.start_time).get_search_expr()('foo')
         assert str(expr) == 'CAST(persons.start_time AS VARCHAR) LIKE :param_1', str(expr)
         assert expr.right.value == '%foo%'
 
@@ -1413,6 +1513,9 @@ class TestOptionsFilter(CheckFilterBase):
         assert expr.right.clauses[0].value == 'bar'
         assert expr.right.clauses[1].value == 5
 
+        expr = expr_factory('qux')
+        assert str(expr) == 'false'
+
     def test_is(self):
         filter = StateFilter(Person.state).new_instance()
         # the "foo" should get filtered out
@@ -2,18 +2,39 @@ from __future__ import absolute_import
 
 import csv
 import datetime as dt
+from decimal import Decimal
+import gc
+import gzip
 import json
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 import warnings
 from io import BytesIO
 
 import arrow
+from blazeutils.datastructures import BlankObject
+import flask
+from mock import mock
 import six
 import xlrd
 import xlsxwriter
+import xlwt
+import zstandard
 from markupsafe import Markup
 from nose.tools import eq_, raises
 from pyquery import PyQuery
+import pyarrow
+import pyarrow.ipc
+import pyarrow.parquet
+import sqlalchemy as sa
+import sqlalchemy.orm as sa_orm
 from six.moves import range
+from werkzeug.datastructures import MultiDict
+from werkzeug.urls import Href, url_encode
 
 from webgrid import (
     BoolColumn,
@@ -26,12 +47,17 @@ from webgrid import (
     col_styler,
     row_styler,
 )
+from webgrid import renderers
 from webgrid.filters import TextFilter
 from webgrid.renderers import (
+    ArrowIPC,
     CSV,
     HTML,
+    JSON,
+    Parquet,
     XLS,
     XLSX,
+    XLSXWorkbook,
     RenderLimitExceeded,
     render_html_attributes,
 )
@@ -51,7 +77,7 @@ from webgrid_ta.model.entities import (
     db,
 )
 
-from .helpers import eq_html, inrequest, render_in_grid
+from .helpers import assert_in_query, eq_html, inrequest, render_in_grid
 
 
 class PeopleGrid(PG):
@@ -303,6 +329,32 @@ class TestHtmlRenderer(object):
         eq_('/thepage?onpage=1&perpage=5', g.html.current_url())
         eq_('/thepage?onpage=1&perpage=10', g.html.current_url(perpage=10))
 
+    @inrequest('/thepage?zed=b&zed=a&v1(name)=x%20y&perpage=5&a=%26')
+    def test_current_url_matches_href(self):
+        g = self.get_grid()
+        req_args = MultiDict(flask.request.args)
+        replace_args = {'perpage': 10, 'v1(name)': ['c', 'b'], 'sort1': None, 'a': None}
+        for key in replace_args:
+            req_args.poplist(key)
+        req_args.update(MultiDict(replace_args))
+        eq_(Href('/thepage', sort=True)(req_args), g.html.current_url(**replace_args))
+
+    @inrequest('/thepage?perpage=5&onpage=1&sort1=a&sort2=b&sort2=c')
+    def test_current_url_encodes_only_replaced_args(self):
+        g = self.get_grid()
+        g.html.url_builder()
+        with mock.patch('webgrid.utils.url_encode', wraps=url_encode) as m_url_encode:
+            eq_(g.html.current_url(onpage=2, sort2=None, zed=['b', 'a']),
+                '/thepage?onpage=2&perpage=5&sort1=a&zed=a&zed=b')
+        eq_(m_url_encode.call_count, 3)
+
+    @inrequest('/thepage?perpage=5')
+    def test_current_url_builder_reused(self):
+        g = self.get_grid()
+        builder = g.html.url_builder()
+        g.html.current_url(perpage=10)
+        assert g.html.url_builder() is builder
+
     @inrequest('/thepage')
     def test_current_url_qs_prefix(self):
         g = self.get_grid(qs_prefix='dg_')
@@ -666,6 +718,26 @@ class TestAllTotals(object):
         assert_tag(html, 'td', text='Page Totals (3 records):', class_='totals-label', colspan='7')
 
 
+class TestHtmlStreaming(object):
+    @inrequest('/')
+    def test_stream_matches_render(self):
+        g = PGAllTotals()
+        g.html.stream_batch_size = 2
+        g.html.stream_buffer_size = 1
+        chunks = list(g.html.stream())
+        assert len(chunks) > 1
+        eq_(''.join(chunks), g.html())
+        assert not g.html.streaming
+
+    @inrequest('/')
+    def test_stream_response(self):
+        g = PGAllTotals()
+        response = g.manager.stream_as_response(g.html.stream())
+        assert response.is_streamed
+        eq_(response.mimetype, 'text/html')
+        eq_(response.get_data(as_text=True), g.html())
+
+
 class PGTotalsStringExpr(PeopleGrid):
     subtotals = 'all'
     Column('FloatCol', 'float_col', has_subtotal=True)
@@ -706,6 +778,26 @@ class TestXLSRenderer(object):
         eq_(sh.cell_value(3, 7), 1)
         eq_(sh.nrows, 4)
 
+    @inrequest('/')
+    def test_gzip_response(self):
+        g = render_in_grid(PeopleGrid, 'xls')(per_page=1)
+        g.xls.compression = 'gzip'
+        response = g.xls.as_response()
+        eq_(response.mimetype, 'application/gzip')
+        assert response.headers['Content-Disposition'].endswith('.xls.gz')
+        response.direct_passthrough = False
+        book = xlrd.open_workbook(file_contents=gzip.decompress(response.get_data()))
+        eq_(book.sheet_by_name('render_in_grid').cell_value(3, 0), 'fn001')
+
+    def test_styles_parsed_once(self):
+        grids = [PGGrandTotals(), PGGrandTotals()]
+        wb = xlwt.Workbook()
+        grids[0].xls.build_sheet(wb, 'first')
+        with mock.patch('webgrid.renderers.xlwt.easyxf', wraps=xlwt.easyxf) as m_easyxf:
+            grids[1].xls.build_sheet(wb, 'second')
+        # only the totals style of the subtotaled column is created (once) for a new renderer
+        eq_(m_easyxf.call_count, 1)
+
     def test_subtotals_with_no_records(self):
         g = PGGrandTotals()
         g.column('firstname').filter.op = 'eq'
@@ -782,6 +874,18 @@ class TestXLSXRenderer(object):
         eq_(sh.cell_value(3, 7), 'st001')
         eq_(sh.nrows, 4)
 
+    def test_partitioned_export(self):
+        sheets = []
+        for workers in (1, 2):
+            g = PeopleGrid()
+            g.set_sort('-createdts')
+            g.xlsx.workers = workers
+            wb = g.xlsx()
+            book = xlrd.open_workbook(file_contents=wb.filename.getvalue())
+            sheet = book.sheet_by_index(0)
+            sheets.append([sheet.row_values(rownum) for rownum in range(sheet.nrows)])
+        eq_(sheets[0], sheets[1])
+
     def test_group_headings(self):
         grid = StopwatchGrid()
         wb = grid.xlsx()
@@ -811,6 +915,46 @@ class TestXLSXRenderer(object):
         wb = g.xlsx()
         wb.filename.seek(0)
 
+    def test_formats_shared_in_workbook(self):
+        wb = xlsxwriter.Workbook(BytesIO(), options={'in_memory': True})
+        PGGrandTotals().xlsx.build_sheet(wb, 'first')
+        format_count = len(wb.formats)
+        PGGrandTotals().xlsx.build_sheet(wb, 'second')
+        eq_(len(wb.formats), format_count)
+        wb.close()
+
+    def test_column_widths(self):
+        g = PeopleGrid()
+        g.xlsx()
+        widths = g.xlsx.col_widths
+        # label is wider than the values
+        eq_(widths['firstname'], len('First Name'))
+        # type-derived
+        eq_(widths['createdts'], len('09/27/2000 11:59 PM'))
+        eq_(widths['inactive'], len('Active'))
+
+    def test_column_widths_sampled(self):
+        class WidthGrid(Grid):
+            Column('A', 'a')
+            Column('B', 'b', xls_width_mode='exact')
+            Column('C', 'c', xls_width=20)
+
+        def get_widths(sample_size):
+            g = WidthGrid(per_page=None, on_page=None)
+            g.xlsx.width_sample_size = sample_size
+            records = [{'a': 'a', 'b': 'b', 'c': 'c'} for _ in range(1000)]
+            records[0] = records[-1] = {'a': 'a' * 5, 'b': 'b' * 5, 'c': 'c' * 50}
+            g.set_records(records)
+            g.xlsx()
+            return g.xlsx.col_widths
+
+        eq_(get_widths(1), {'a': 5, 'b': 5, 'c': 20})
+
+        with mock.patch.object(XLSX, 'sample_width_row', return_value=False):
+            eq_(get_widths(10), {'a': 1, 'b': 5, 'c': 20})
+
+        eq_(get_widths(None), {'a': 5, 'b': 5, 'c': 20})
+
     def test_long_grid_name(self):
         class PeopleGridWithAReallyReallyLongName(PeopleGrid):
             pass
@@ -918,8 +1062,282 @@ class TestXLSXRenderer(object):
         assert format1 is format2
 
 
+class PeopleArrowGrid(PeopleGrid):
+    allowed_export_targets = {'parquet': Parquet, 'arrow': ArrowIPC}
+
+
+class TestArrowRenderers(object):
+    def check_table(self, table):
+        # columns without a key are named by their label
+        eq_(table.column_names, [
+            'firstname', 'Full Name', 'inactive', 'Emails', 'status', 'createdts', 'due_date',
+            'numericcol', 'account_type',
+        ])
+        eq_(table.schema.field('inactive').type, pyarrow.bool_())
+        eq_(table.schema.field('createdts').type, pyarrow.timestamp('us'))
+        eq_(table.schema.field('due_date').type, pyarrow.date32())
+        eq_(table.schema.field('numericcol').type, pyarrow.float64())
+        rows = table.to_pylist()
+        eq_(rows[0], {
+            'firstname': 'fn004',
+            'Full Name': 'fn004 ln004',
+            # NULL in the database
+            'inactive': None,
+            'Emails': 'email004@example.com, email004@gmail.com',
+            'status': None,
+            'createdts': dt.datetime(2012, 2, 22, 10, 4, 16),
+            'due_date': dt.date(2012, 2, 4),
+            'numericcol': 2.13,
+            'account_type': None,
+        })
+        eq_(rows[2]['account_type'], 'Admin')
+        eq_(rows[2]['status'], 'in process')
+        eq_(len(rows), 3)
+
+    def test_parquet(self):
+        g = PeopleArrowGrid()
+        self.check_table(pyarrow.parquet.read_table(g.parquet.render()))
+
+    def test_arrow_ipc_batches(self):
+        g = PeopleArrowGrid()
+        g.arrow.batch_size = 2
+        reader = pyarrow.ipc.open_file(g.arrow.render())
+        eq_(reader.num_record_batches, 2)
+        self.check_table(reader.read_all())
+
+    def test_raw_values(self):
+        g = PeopleArrowGrid()
+        g.parquet.raw_values = True
+        self.check_table(pyarrow.parquet.read_table(g.parquet.render()))
+
+    def test_bool_nulls(self):
+        for reverse in (False, True):
+            col = BoolColumn('Active', Person.inactive, reverse=reverse, _dont_assign=True)
+            eq_(col.raw_value(None), None)
+            eq_(col.raw_value(True), not reverse)
+
+    def test_numeric_types(self):
+        def arrow_type(sa_type):
+            col = NumericColumn('N', sa.literal_column('n', sa_type), _dont_assign=True)
+            return col.arrow_data_type()
+
+        eq_(arrow_type(sa.Integer()), pyarrow.int64())
+        eq_(arrow_type(sa.Numeric()), pyarrow.float64())
+        eq_(arrow_type(sa.Numeric(5, 2)), pyarrow.decimal128(38, 2))
+        eq_(arrow_type(sa.Numeric(60, 45)), pyarrow.float64())
+
+        decimal_type = pyarrow.decimal128(38, 2)
+        convert = PeopleArrowGrid().parquet.value_converter(decimal_type)
+        # values past the declared precision, or with more places than the scale, still fit
+        values = [convert(value) for value in (Decimal('123456.789'), 1.1)]
+        eq_(pyarrow.array(values, type=decimal_type).to_pylist(),
+            [Decimal('123456.79'), Decimal('1.10')])
+
+    @inrequest('/?export_to=parquet')
+    def test_export_target(self):
+        g = PeopleArrowGrid()
+        g.apply_qs_args()
+        eq_(g.export_to, 'parquet')
+        response = g.export_as_response()
+        eq_(response.mimetype, 'application/vnd.apache.parquet')
+
+
+class TestXLSXWorkbook(object):
+    def get_workbook(self, max_workers=1):
+        in_process = PeopleGrid()
+        in_process.column('status').filter.set('is', ['2'])
+        workbook = XLSXWorkbook('report', max_workers=max_workers)
+        workbook.add_sheet(PGGrandTotals(), 'All')
+        workbook.add_sheet(in_process, 'In Process')
+        return workbook
+
+    def check_workbook(self, output):
+        book = xlrd.open_workbook(file_contents=output.read())
+        eq_(book.sheet_names(), ['All', 'In Process'])
+        sheet = book.sheet_by_name('All')
+        eq_(sheet.cell_value(1, 0), 'fn004')
+        # headings, 3 records and totals
+        eq_(sheet.nrows, 5)
+        eq_(sheet.cell_value(4, 0), 'Totals (3 records):')
+        sheet = book.sheet_by_name('In Process')
+        eq_(sheet.col_values(0), ['First Name', 'fn001'])
+
+    def check_queries(self, max_workers, counts_first):
+        workbook = self.get_workbook(max_workers=max_workers)
+        with mock.patch.object(PeopleGrid, 'build_query', autospec=True,
+                               side_effect=PeopleGrid.build_query) as m_build_query, \
+                mock.patch.object(sa_orm.Query, 'yield_per', autospec=True,
+                                  side_effect=sa_orm.Query.yield_per) as m_yield_per:
+            output = workbook.build()
+        # a count and a records query per grid (grand totals use their own query)
+        eq_([call[1].get('for_count', False) for call in m_build_query.call_args_list],
+            counts_first)
+        # records are streamed, not fetched at once
+        eq_(m_yield_per.call_count, 2)
+        self.check_workbook(output)
+
+    def test_sheets(self):
+        self.check_queries(1, [True, False, True, True, False])
+
+    def test_parallel_queries(self):
+        # both grids' queries are built up front for the workers
+        self.check_queries(2, [False, True, False, True, True])
+
+    def test_parallel_sessions_closed_on_error(self):
+        sessions = []
+
+        class Workbook(XLSXWorkbook):
+            def fetch_records(self, *args):
+                result = super(Workbook, self).fetch_records(*args)
+                sessions.append(result[-1])
+                return result
+
+        workbook = Workbook('report', max_workers=2)
+        workbook.add_sheet(PGGrandTotals(), 'All')
+        workbook.add_sheet(PeopleGrid(), 'People')
+        with mock.patch.object(sa_orm.Session, 'close', autospec=True,
+                               side_effect=sa_orm.Session.close) as m_close, \
+                mock.patch.object(XLSX, 'build_sheet', side_effect=ValueError):
+            try:
+                workbook.build()
+                assert False, 'expected ValueError'
+            except ValueError:
+                pass
+        # including the session of the sheet not written, unless cancelled before it started
+        assert sessions
+        closed = [call[0][0] for call in m_close.call_args_list]
+        assert all(session in closed for session in sessions)
+
+    @inrequest('/')
+    def test_as_response(self):
+        response = self.get_workbook().as_response()
+        eq_(response.mimetype, XLSX.mime_type)
+        assert response.headers['Content-Disposition'].startswith(
+            'attachment; filename=report_'
+        )
+
+
 class TestCSVRenderer(object):
 
+    def compressed_response(self, compression):
+        g = render_in_grid(PeopleCSVGrid, 'csv')(per_page=1)
+        g.csv.compression = compression
+        response = g.csv.as_response()
+        response.direct_passthrough = False
+        return g, response
+
+    def test_partitioned_export(self):
+        for sort in (None, 'numericcol', '-firstname'):
+            outputs = []
+            for workers in (1, 2):
+                g = PeopleCSVGrid()
+                if sort:
+                    g.set_sort(sort)
+                g.csv.workers = workers
+                outputs.append(g.csv.build_csv().getvalue())
+            eq_(outputs[0], outputs[1])
+
+        g = PeopleCSVGrid()
+        g.set_sort('-numericcol')
+        g.set_paging(None, None)
+        g.csv.workers = 2
+        query = g.build_query()
+        queries = g.csv.partition_queries(query)
+        # range queries followed by the NULL keys, which sort last when descending in SQLite
+        eq_(len(queries), len(g.csv.partition_bounds(query, Person.numericcol, 8)) + 2)
+        assert_in_query(queries[-1], 'AND persons.numericcol IS NULL')
+
+    def test_partition_key_not_grouped_or_aggregate(self):
+        csv = PeopleCSVGrid().csv
+        query = db.session.query(Person.numericcol)
+        eq_(csv.partition_key(query.order_by(sa.desc(Person.numericcol))),
+            (Person.numericcol, True))
+
+        grouped = db.session.query(Status.label, sa.func.count(Person.id)) \
+            .join(Person.status).group_by(Status.label)
+        eq_(csv.partition_key(grouped.order_by(Status.label)), None)
+        eq_(csv.partition_key(grouped.having(sa.func.count(Person.id) > 1)), None)
+
+        total = sa.func.sum(Person.numericcol).label('total')
+        eq_(csv.partition_key(db.session.query(total).order_by(sa.desc(total))), None)
+        row_number = sa.func.row_number().over(order_by=Person.id)
+        eq_(csv.partition_key(query.order_by(row_number)), None)
+
+    def test_partitions_submitted_as_consumed(self):
+        g = PeopleCSVGrid()
+        g.set_paging(None, None)
+        g.csv.workers = 2
+        g.csv.partitions = 8
+        g.csv.partitions_ahead = 1
+        with mock.patch.object(ProcessPoolExecutor, 'submit', autospec=True,
+                               side_effect=ProcessPoolExecutor.submit) as m_submit:
+            partitions = g.csv.iter_partitions()
+            next(partitions)
+            # the two running ranges, and the one submitted as the first was given back
+            eq_(m_submit.call_count, 3)
+            rest = list(partitions)
+        eq_(m_submit.call_count, len(rest) + 1)
+
+    def test_partition_workers_leave_inherited_connections(self):
+        tmpdir = tempfile.mkdtemp()
+        db_path = os.path.join(tmpdir, 'partitions.db')
+        closed_path = os.path.join(tmpdir, 'closed')
+        parent_pid = os.getpid()
+
+        class Connection(object):
+            # a file-backed database stands in for a server, recording connections of this
+            #   process closed in another one
+            def __init__(self):
+                self.connection = sqlite3.connect(db_path)
+
+            def __getattr__(self, name):
+                return getattr(self.connection, name)
+
+            def close(self):
+                if os.getpid() != parent_pid:
+                    with open(closed_path, 'a') as closed:
+                        closed.write('closed\n')
+
+            __del__ = close
+
+        engine = sa.create_engine('sqlite:///' + db_path, creator=Connection,
+                                  poolclass=sa.pool.QueuePool)
+        engine.execute('select 1')
+
+        renderer = PeopleCSVGrid().csv
+        renderer.prepare_partition_bind(engine)
+
+        def worker():
+            renderers._partitioned_exports['test'] = (renderer, [], engine)
+            renderers._init_partition_worker('test')
+            with engine.connect() as conn:
+                conn.execute('select 1')
+                assert conn.connection._connection_record.info['pid'] == os.getpid()
+            gc.collect()
+
+        process = multiprocessing.get_context('fork').Process(target=worker)
+        process.start()
+        process.join()
+        eq_(process.exitcode, 0)
+        assert not os.path.exists(closed_path)
+        engine.execute('select 1')
+        shutil.rmtree(tmpdir)
+
+    @inrequest('/')
+    def test_gzip_response(self):
+        g, response = self.compressed_response('gzip')
+        eq_(response.mimetype, 'application/gzip')
+        assert response.headers['Content-Disposition'].endswith('.csv.gz')
+        eq_(gzip.decompress(response.get_data()), g.csv.build_csv().getvalue())
+
+    @inrequest('/')
+    def test_zstd_response(self):
+        g, response = self.compressed_response('zstd')
+        eq_(response.mimetype, 'application/zstd')
+        assert response.headers['Content-Disposition'].endswith('.csv.zst')
+        data = zstandard.ZstdDecompressor().decompressobj().decompress(response.get_data())
+        eq_(data, g.csv.build_csv().getvalue())
+
     def test_some_basics(self):
         g = render_in_grid(PeopleCSVGrid, 'csv')(per_page=1)
         csv_data = g.csv.build_csv()
@@ -951,6 +1369,28 @@ class TestCSVRenderer(object):
         assert data[0][0] == 'Created'
         assert data[1][0] == '2016-08-10 01:02:03+0000'
 
+    def test_raw_values(self):
+        ArrowRecord.query.delete()
+        ArrowRecord.testing_create(
+            created_utc=arrow.Arrow(2016, 8, 10, 1, 2, 3)
+        )
+        g = ArrowCSVGrid()
+        g.allowed_export_targets = {'csv': CSV}
+        g.csv.raw_values = True
+        csv_data = g.csv.build_csv()
+        csv_data.seek(0)
+        data = list(csv.reader(six.StringIO(csv_data.read().decode('utf-8'))))
+        eq_(data, [['Created'], ['2016-08-10 01:02:03+00:00']])
+
+        g = render_in_grid(PeopleCSVGrid, 'csv')(per_page=1)
+        g.csv.raw_values = True
+        csv_data = g.csv.build_csv()
+        csv_data.seek(0)
+        data = list(csv.reader(six.StringIO(csv_data.read().decode('utf-8'))))
+        eq_(data[1][0], 'fn004')
+        # NULL is missing data rather than a truth value
+        eq_(data[1][2], '')
+
     def test_it_renders_date_time_with_custom_format(self):
         class CSVGrid(Grid):
             session_on = True
@@ -973,6 +1413,256 @@ class TestCSVRenderer(object):
         assert data[1][0] == '08/10/2016 01:02 AM'
 
 
+class PeopleJSONGrid(PeopleGrid):
+    subtotals = 'all'
+    allowed_export_targets = {'csv': CSV, 'json': JSON}
+
+
+class TestJSONRenderer(object):
+    @inrequest('/?perpage=2&onpage=1')
+    def test_page_of_records(self):
+        g = PeopleJSONGrid()
+        g.apply_qs_args()
+        data = json.loads(g.json.render())
+        eq_(data['record_count'], 3)
+        eq_(data['page_count'], 2)
+        eq_(data['on_page'], 1)
+        eq_(data['per_page'], 2)
+        eq_(len(data['records']), 2)
+        eq_(data['records'][0][0], 'fn004')
+
+    @inrequest('/')
+    def test_column_schema(self):
+        g = PeopleJSONGrid()
+        schema = {col['key']: col for col in json.loads(g.json.render())['columns']}
+        eq_(schema['firstname'], {
+            'key': 'firstname', 'label': 'First Name', 'sortable': True, 'type': 'link',
+        })
+        eq_(schema['createdts']['type'], 'date_time')
+        eq_(schema['numericcol']['type'], 'numeric')
+        eq_(schema['status']['type'], None)
+        # JSON mirrors the HTML table columns
+        assert 'sortorder' not in schema
+        assert 'state' not in schema
+
+    @inrequest('/')
+    def test_totals_and_html_fragments(self):
+        g = PeopleJSONGrid()
+        data = json.loads(g.json.render())
+        eq_(Decimal(data['totals']['page']['numericcol']), Decimal('6.39'))
+        eq_(Decimal(data['totals']['grand']['numericcol']), Decimal('6.39'))
+        assert_tag(data['html']['rows'], 'td', text='Grand Totals (3 records):')
+        assert_tag(data['html']['headings'], 'a', text='First Name')
+        assert_tag(data['html']['paging'], 'li', class_='dead')
+
+    @inrequest('/?export_to=json&perpage=1&onpage=2&sort1=firstname')
+    def test_html_fragments_links_drop_export_target(self):
+        g = PeopleJSONGrid()
+        g.apply_qs_args()
+        fragments = json.loads(g.json.render())['html']
+        for key in ('headings', 'paging'):
+            assert 'export_to' not in fragments[key]
+            assert 'perpage=1' in fragments[key]
+        assert 'onpage=3' in fragments['paging']
+        # links outside the fragments are left alone
+        assert 'export_to=json' in g.html.current_url()
+
+    @inrequest('/?export_to=json')
+    def test_export_target(self):
+        g = PeopleJSONGrid()
+        g.apply_qs_args()
+        eq_(g.export_to, 'json')
+        assert '"value": "json"' in g.html.json_data_key()
+        eq_(PeopleGrid().html.json_data_key(), 'null')
+
+
+class TestFragmentCache(object):
+    def setup(self):
+        HTML.fragment_cache.clear()
+
+    @inrequest('/thepage?op(firstname)=eq&v1(firstname)=foo')
+    def test_op_select_cached(self):
+        g = PeopleGrid()
+        g.apply_qs_args()
+        col = g.column('firstname')
+        with mock.patch.object(HTML, 'render_select', autospec=True,
+                               side_effect=HTML.render_select) as m_render:
+            first = g.html.filtering_col_op_select(col)
+            eq_(m_render.call_count, 1)
+            unfiltered = PeopleGrid()
+            assert unfiltered.html.filtering_col_op_select(unfiltered.column('firstname')) \
+                != first
+            # the grid without a filter set renders with a different selection
+            eq_(m_render.call_count, 2)
+            eq_(g.html.filtering_col_op_select(col), first)
+            eq_(m_render.call_count, 2)
+        assert_tag(first, 'option', value='eq', selected=None)
+
+    @inrequest('/thepage?op(status)=is&v1(status)=1')
+    def test_options_fragments_keyed_by_selection(self):
+        g = PeopleGrid()
+        g.apply_qs_args()
+        html1 = g.html.filtering_col_inputs1(g.column('status'))
+        assert_tag(html1, 'option', value='1', selected=None)
+        assert_tag(html1, 'input', value='1', checked=None)
+
+        g = PeopleGrid()
+        html2 = g.html.filtering_col_inputs1(g.column('status'))
+        assert not find_tag(html2, 'option', selected=None)
+        assert not find_tag(html2, 'input', checked=None)
+
+    @inrequest('/thepage')
+    def test_filter_row_keyed_by_operators(self):
+        g = PeopleGrid()
+        first = g.html.filtering_fields()
+        assert_tag(first, 'option', value='contains')
+
+        g = PeopleGrid()
+        col = g.column('firstname')
+        col.filter.operators = col.filter.operators[:2]
+        fields = g.html.filtering_fields()
+        assert fields != first
+        assert not find_tag(fields, 'option', value='contains')
+
+    @inrequest('/thepage')
+    def test_sorting_select_cached(self):
+        g = PeopleGrid()
+        with mock.patch.object(HTML, 'render_select', autospec=True,
+                               side_effect=HTML.render_select) as m_render:
+            g.html.sorting_select(1)
+            PeopleGrid().html.sorting_select(1)
+            eq_(m_render.call_count, 1)
+            g.html.sorting_select(2)
+            eq_(m_render.call_count, 2)
+
+    @inrequest('/thepage')
+    def test_cache_disabled(self):
+        class NoCacheHTML(HTML):
+            fragment_cache = None
+
+        g = PeopleGrid()
+        html = NoCacheHTML(g)
+        with mock.patch.object(HTML, 'render_select', autospec=True,
+                               side_effect=HTML.render_select) as m_render:
+            html.sorting_select(1)
+            html.sorting_select(1)
+            eq_(m_render.call_count, 2)
+
+
+class PeopleOptionsAssetGrid(PeopleGrid):
+    filter_options_asset_threshold = 1
+
+
+class TestFilterOptionsAsset(object):
+    @inrequest('/thepage?op(status)=is&v1(status)=1')
+    def test_only_selection_inlined(self):
+        g = PeopleOptionsAssetGrid()
+        g.apply_qs_args()
+        inputs_html = g.html.filtering_col_inputs1(g.column('status'))
+        eq_(len(find_tag(inputs_html, 'option')), 1)
+        eq_(len(find_tag(inputs_html, 'input', type='checkbox', value='1')), 1)
+        select = find_tag(inputs_html, 'select')
+        url = select.attr('data-options-url')
+        assert url.startswith('/thepage?filter_options=status&filter_options_v='), url
+
+        # under the threshold, options are inlined
+        g = PeopleGrid()
+        inputs_html = g.html.filtering_col_inputs1(g.column('status'))
+        eq_(len(find_tag(inputs_html, 'option')), 3)
+        assert not find_tag(inputs_html, 'select').attr('data-options-url')
+
+    def test_filter_row_asset_url_per_page(self):
+        rows = []
+        for path in ('/thepage', '/otherpage'):
+            with flask.current_app.test_request_context(path):
+                g = PeopleOptionsAssetGrid()
+                rows.append(g.html.filtering_fields())
+        for path, row in zip(('/thepage', '/otherpage'), rows):
+            url = find_tag(row, 'select', name='v1(status)').attr('data-options-url')
+            assert url.startswith(path + '?filter_options=status'), url
+
+    @inrequest('/thepage')
+    def test_options_asset_response(self):
+        g = PeopleOptionsAssetGrid()
+        version = g.filter_options.version(g.column('status'))
+        with flask.current_app.test_request_context(
+            '/thepage?filter_options=status&filter_options_v={}'.format(version)
+        ):
+            g = PeopleOptionsAssetGrid()
+            g.apply_qs_args()
+            eq_(g.export_to, 'filter_options')
+            response = g.export_as_response()
+            eq_(response.mimetype, 'application/json')
+            eq_(response.cache_control.max_age, g.filter_options.max_age)
+            eq_(
+                [label for _, label in json.loads(response.get_data(as_text=True))],
+                ['complete', 'in process', 'pending']
+            )
+
+        with flask.current_app.test_request_context('/thepage?filter_options=status'):
+            g = PeopleOptionsAssetGrid()
+            g.apply_qs_args()
+            response = g.export_as_response()
+            eq_(response.cache_control.max_age, None)
+
+    @inrequest('/thepage?filter_options=firstname')
+    def test_options_asset_non_options_filter(self):
+        g = PeopleOptionsAssetGrid()
+        g.apply_qs_args()
+        eq_(g.export_to, None)
+
+
+class TestLazyFilterOptions(object):
+    def get_grid(self):
+        g = PeopleGrid()
+        g.column('status').filter.lazy_options = True
+        g.apply_qs_args()
+        return g
+
+    def get_json(self, g):
+        response = g.export_as_response()
+        eq_(response.mimetype, 'application/json')
+        eq_(response.cache_control.max_age, None)
+        return json.loads(response.get_data(as_text=True))
+
+    @inrequest('/thepage?op(status)=is&v1(status)=1')
+    def test_only_selection_inlined(self):
+        g = self.get_grid()
+        inputs_html = g.html.filtering_col_inputs1(g.column('status'))
+        eq_(len(find_tag(inputs_html, 'option')), 1)
+        select = find_tag(inputs_html, 'select')
+        eq_(select.attr('data-options-url'), '/thepage?filter_options=status')
+        eq_(select.attr('data-options-search-arg'), 'filter_options_q')
+        eq_(select.attr('data-options-page-arg'), 'filter_options_page')
+        assert select.attr('data-options-lazy') is not None
+
+    @inrequest('/thepage?filter_options=status&filter_options_q=PEN')
+    def test_search(self):
+        g = self.get_grid()
+        eq_(g.export_to, 'filter_options')
+        data = self.get_json(g)
+        eq_([label for _, label in data['options']], ['pending'])
+        eq_(data['more'], False)
+
+    @inrequest('/thepage?filter_options=status&filter_options_page=2')
+    def test_paging(self):
+        g = self.get_grid()
+        g.filter_options.per_page = 2
+        data = self.get_json(g)
+        eq_([label for _, label in data['options']], ['pending'])
+        eq_(data['more'], False)
+
+        g.filter_options.on_page = 1
+        data = self.get_json(g)
+        eq_([label for _, label in data['options']], ['complete', 'in process'])
+        eq_(data['more'], True)
+
+    @inrequest('/thepage?filter_options=status&filter_options_page=foo')
+    def test_invalid_page(self):
+        g = self.get_grid()
+        eq_(g.filter_options.on_page, 1)
+
+
 class TestHideSection(object):
     @inrequest('/')
     def test_controlls_hidden(self):
@@ -1005,6 +1695,14 @@ class TestArrowDate(object):
         g.column('created_utc').html_format = 'YYYY-MM-DD HH:mm:ss ZZ'
         assert '<td>2016-08-10 01:02:03 +00:00</td>' in g.html(), g.html()
 
+    def test_arrow_export_in_utc(self):
+        col = ArrowGrid().column('created_utc')
+        pacific = arrow.Arrow(2016, 8, 10, 1, 2, 3).to('US/Pacific')
+        for value in (pacific, pacific.datetime):
+            record = BlankObject()
+            record.created_utc = value
+            eq_(col.render_arrow(record), dt.datetime(2016, 8, 10, 1, 2, 3))
+
     def test_xls(self):
         ArrowRecord.query.delete()
         ArrowRecord.testing_create(created_utc=arrow.Arrow(2016, 8, 10, 1, 2, 3))
@@ -2,20 +2,30 @@ from __future__ import absolute_import
 
 from datetime import datetime
 from decimal import Decimal
+import json
 from os import path
+import re
 
+from blazeutils.containers import HTMLAttributes
+from dateutil.parser import parse
 import flask
 from mock import mock
 from nose.tools import assert_regex, eq_
+import sqlalchemy as sa
+import sqlalchemy.orm as saorm
 import sqlalchemy.sql as sasql
 from werkzeug.datastructures import MultiDict
 
 from webgrid import Column, BoolColumn, YesNoColumn
-from webgrid.filters import FilterBase, TextFilter, IntFilter
-from webgrid_ta.model.entities import Person, Status, db
+from webgrid.assets import minify_js
+from webgrid.filters import DateFilter, DateTimeFilter, FilterBase, IntFilter, NumberFilter, \
+    TextFilter, search_value
+from webgrid_ta.model.entities import Email, Person, Status, db
 from webgrid_ta.grids import Grid, PeopleGrid, PeopleGridByConfig
 from .helpers import assert_in_query, assert_not_in_query, query_to_str, inrequest
 from webgrid.renderers import CSV
+from webgrid.session_stores import DatabaseStore, MemoryStore, WebSessionStore
+from webgrid.utils import GridArgsParser
 
 
 class TestGrid(object):
@@ -47,6 +57,92 @@ class TestGrid(object):
         assert g.columns[0] is not g2.columns[0]
         assert g.columns[0] is g.key_column_map['firstname']
 
+    def test_schema_shared_by_instances(self):
+        class CTG(Grid):
+            Column('First Name', Person.firstname, TextFilter)
+            Column('Number', Person.numericcol, has_subtotal='avg')
+
+        class SubCTG(CTG):
+            Column('Last Name', Person.lastname)
+
+        schema = CTG.schema()
+        g = CTG()
+        g2 = CTG()
+        assert CTG.schema() is schema
+        assert SubCTG.schema() is not schema
+        eq_(len(SubCTG().columns), 3)
+        eq_(schema.key_indexes, (('firstname', 0), ('numericcol', 1)))
+        eq_(list(g.filtered_cols), ['firstname'])
+        eq_(list(g.subtotal_cols), ['numericcol'])
+        assert g.subtotal_cols['numericcol'][1] is g.columns[1]
+
+        # settings are shared, per-request state is not
+        assert g.columns[0].expr is g2.columns[0].expr
+        assert g.columns[0].xlwt_stymat is not g2.columns[0].xlwt_stymat
+        assert g.columns[0].kwargs is not g2.columns[0].kwargs
+        assert g.columns[0].grid is g
+        assert g.columns[0].filter is not g2.columns[0].filter
+        assert g.columns[0].head.hah is not g2.columns[0].head.hah
+        g.set_filter('firstname', 'eq', 'foo')
+        eq_(g.columns[0].filter.value1, 'foo')
+        assert g2.columns[0].filter.op is None
+        assert CTG.__cls_cols__[0].filter.op is None
+
+    def test_subclass_constructors_run_per_instance(self):
+        inits = []
+
+        class TrackedFilter(TextFilter):
+            def __init__(self, sa_col):
+                super(TrackedFilter, self).__init__(sa_col)
+                self.seen = []
+                inits.append(self)
+
+        class TrackedColumn(Column):
+            def __init__(self, *args, **kwargs):
+                super(TrackedColumn, self).__init__(*args, **kwargs)
+                inits.append(self)
+
+        class CTG(Grid):
+            TrackedColumn('First Name', Person.firstname, TrackedFilter)
+
+        inits[:] = []
+        g = CTG()
+        g2 = CTG()
+        # the constructors declare no shared state, so run for each grid's column and filter
+        eq_(len(inits), 4)
+        assert g.columns[0].filter.seen is not g2.columns[0].filter.seen
+
+        class SharedFilter(TrackedFilter):
+            instance_state_shared = True
+
+            def __init__(self, sa_col):
+                super(SharedFilter, self).__init__(sa_col)
+
+        col = Column('First Name', Person.firstname, SharedFilter, _dont_assign=True)
+        filters = [col.filter.new_instance(), col.filter.new_instance()]
+        # constructed once for both, with lists still copied for each
+        eq_(len(inits), 6)
+        assert filters[0].seen is not filters[1].seen
+
+    def test_column_attributes_made_when_used(self):
+        class CTG(Grid):
+            Column('First Name', Person.firstname)
+            Column('Last Name', Person.lastname, class_='name')
+
+        g = CTG()
+        g.html()
+        first, last = g.columns
+        assert first.head.attrs is None
+        assert first.body._hah is None
+        eq_(dict(last.head.attrs), {'class': 'name'})
+        first.head.hah.class_ += 'first'
+        eq_(dict(first.head.attrs), {'class': 'first'})
+        # other attributes can be set, as on the BlankObject these replaced
+        first.body.colspan = 2
+        eq_(first.body.colspan, 2)
+        last.body.hah = HTMLAttributes(class_='surname')
+        eq_(dict(last.body.attrs), {'class': 'surname'})
+
     def test_grid_ident(self):
         class Grid1(Grid):
             identifier = 'cars'
@@ -190,6 +286,26 @@ class TestGrid(object):
             for idx, call in enumerate(m_debug.call_args_list):
                 assert_regex(call[0][0], expected[idx])
 
+    def test_iter_records(self):
+        class CTG(Grid):
+            Column('First Name', Person.firstname)
+
+        Person.testing_create()
+        Person.testing_create()
+        g = CTG(per_page=None)
+        records = g.records
+        assert len(records) >= 2
+        g.clear_record_cache()
+        with mock.patch('sqlalchemy.orm.Query.yield_per', autospec=True,
+                        side_effect=lambda query, count: query) as m_yield_per:
+            eq_(list(g.iter_records(batch_size=2)), records)
+        eq_(m_yield_per.call_args[0][1], 2)
+        # streamed records are not kept on the grid
+        assert g._records is None
+
+        g.set_records(records[:1])
+        eq_(list(g.iter_records()), records[:1])
+
     def test_filter_instance(self):
         class CTG(Grid):
             Column('First Name', Person.firstname, TextFilter(Person.lastname))
@@ -430,6 +546,40 @@ class TestGrid(object):
                         " OR lower(persons.last_name) LIKE lower('%foo%')")
         assert_in_query(g, search_where)
 
+    def test_search_value_parsed_once(self):
+        class CTG(Grid):
+            enable_search = True
+            Column('First Name', Person.firstname, TextFilter)
+            Column('Number', Person.numericcol, NumberFilter)
+            Column('Due Date', Person.due_date, DateFilter)
+            Column('Created', Person.createdts, DateTimeFilter)
+
+        g = CTG()
+        g.search_value = '3/14/2015'
+        with mock.patch('webgrid.filters.parse', wraps=parse) as m_parse:
+            query = g.build_query()
+        # once for the date, and once for the fields it gives
+        eq_(m_parse.call_count, 2)
+        assert_in_query(
+            query, "persons.due_date >= '2015-03-14' AND persons.due_date < '2015-03-15'"
+        )
+        # the number column is left out, as the value can't be in the text of a number
+        assert_not_in_query(query, 'CAST(persons.numericcol')
+
+    def test_search_value_not_kept_between_searches(self):
+        class CTG(Grid):
+            enable_search = True
+            Column('Due Date', Person.due_date, DateFilter)
+
+        g = CTG()
+        g.search_value = 'June'
+        with mock.patch('webgrid.filters.parse', wraps=parse) as m_parse:
+            g.build_query()
+            g.build_query()
+        # partial dates are read relative to today, so each search parses the value again
+        eq_(m_parse.call_count, 4)
+        assert search_value('June') is not search_value('June')
+
 
 class TestQueryStringArgs(object):
 
@@ -765,3 +915,378 @@ class TestQueryStringArgs(object):
         g.enable_search = True
         g.apply_qs_args()
         assert g.search_value is None
+
+
+class TestGridArgsParser(object):
+    def test_parse(self):
+        args = MultiDict([
+            ('dg_op(status)', 'is'), ('dg_v1(status)', '1'), ('dg_v1(status)', '2'),
+            ('dg_onpage', '2'), ('dg_sort1', 'firstname'), ('dg_sort2', '-status'),
+            ('search', 'bob'), ('dg_session_key', 'abc'), ('dg_export_to', 'xlsx'),
+            ('foo', 'bar'), ('op(firstname)', 'eq'),
+        ])
+        grid_args = GridArgsParser('dg_').parse(args)
+        eq_(grid_args.filters, {'status': {'op': ['is'], 'v1': ['1', '2']}})
+        assert grid_args.has_filters
+        eq_(grid_args.filter_value('status', 'v1'), '1')
+        eq_(grid_args.filter_value('status', 'v1', multi=True), ['1', '2'])
+        assert grid_args.filter_value('status', 'v2') is None
+        eq_(grid_args.filter_value('status', 'v2', multi=True), [])
+        eq_(grid_args.paging, {'onpage': '2'})
+        eq_(grid_args.sort, {'sort1': 'firstname', 'sort2': '-status'})
+        eq_(grid_args.search, 'bob')
+        eq_(grid_args.session, {'session_key': 'abc'})
+        eq_(grid_args.export, {'export_to': 'xlsx'})
+
+    def test_values_without_op_are_not_active_filters(self):
+        grid_args = GridArgsParser().parse(MultiDict([('v1(firstname)', 'bob')]))
+        assert not grid_args.has_filters
+
+    def test_parser_cached_per_prefix(self):
+        assert GridArgsParser.for_prefix('dg_') is GridArgsParser.for_prefix('dg_')
+        assert GridArgsParser.for_prefix('dg_') is not GridArgsParser.for_prefix('')
+        # a grid without options filters, which need the database's options to be built
+        eq_(TestGrid.TG(qs_prefix='dg_').qs_args_parser.prefix, 'dg_')
+
+
+class TestSessionStores(object):
+    def grid_cls(self, store):
+        class StoreGrid(PeopleGrid):
+            session_store = store
+        return StoreGrid
+
+    def apply_args(self, grid_cls, args):
+        flask.request.args = MultiDict(args)
+        pg = grid_cls()
+        pg.apply_qs_args()
+        return pg
+
+    def check_round_trip(self, grid_cls):
+        pg = self.apply_args(grid_cls, [('op(firstname)', 'eq'), ('v1(firstname)', 'bob')])
+        pg2 = self.apply_args(grid_cls, [])
+        eq_(pg2.column('firstname').filter.op, 'eq')
+        eq_(pg2.column('firstname').filter.value1, 'bob')
+
+        self.apply_args(grid_cls, [('op(firstname)', '!eq'), ('v1(firstname)', 'bob')])
+        pg3 = self.apply_args(grid_cls, [('session_key', pg.session_key)])
+        eq_(pg3.column('firstname').filter.op, 'eq')
+
+    @inrequest('/foo')
+    def test_web_session_store_bounded(self):
+        grid_cls = self.grid_cls(WebSessionStore(max_entries=2))
+        session_keys = [self.apply_args(grid_cls, []).session_key for _ in range(3)]
+        dgsessions = flask.session['dgsessions']
+        assert session_keys[0] not in dgsessions
+        assert session_keys[1] in dgsessions
+        assert session_keys[2] in dgsessions
+        assert '_StoreGrid' in dgsessions
+        eq_(flask.session['dgsessions_order'], session_keys[1:])
+
+    @inrequest('/foo')
+    def test_memory_store(self):
+        grid_cls = self.grid_cls(MemoryStore())
+        self.check_round_trip(grid_cls)
+        assert 'dgsessions' not in flask.session
+        assert flask.session['dgstate_token']
+
+    @inrequest('/foo')
+    def test_memory_store_bounded(self):
+        store = MemoryStore(max_entries=2)
+        grid_cls = self.grid_cls(store)
+        pg = self.apply_args(grid_cls, [])
+        self.apply_args(grid_cls, [])
+        assert store.get(pg.manager, pg.session_key) is None
+        assert store.get(pg.manager, '_StoreGrid')
+
+    @inrequest('/foo')
+    def test_database_store(self):
+        store = DatabaseStore('sqlite://')
+        grid_cls = self.grid_cls(store)
+        self.check_round_trip(grid_cls)
+        assert 'dgsessions' not in flask.session
+        with store.engine.connect() as conn:
+            eq_(conn.execute(store.table.count()).scalar(), 4)
+
+        store.max_entries = 2
+        pg = self.apply_args(grid_cls, [])
+        with store.engine.connect() as conn:
+            eq_(
+                sorted(row.state_key for row in conn.execute(store.table.select())),
+                sorted([pg.session_key, '_StoreGrid'])
+            )
+
+    @inrequest('/foo')
+    def test_default_args_not_stored(self):
+        pg = self.apply_args(PeopleGrid, [
+            ('op(firstname)', ''), ('v1(firstname)', 'bob'), ('op(status)', 'is'),
+            ('v1(status)', '1'), ('onpage', '1'), ('perpage', '5'), ('sort1', 'firstname'),
+            ('sort2', ''), ('export_to', 'xls'),
+        ])
+        stored = MultiDict(json.loads(flask.session['dgsessions'][pg.session_key]))
+        eq_(sorted(stored.keys()), ['datagrid', 'op(status)', 'perpage', 'sort1', 'v1(status)'])
+
+    @inrequest('/foo')
+    def test_unchanged_state_not_saved(self):
+        pg = self.apply_args(PeopleGrid, [('op(firstname)', 'eq'), ('v1(firstname)', 'bob')])
+        with mock.patch.object(pg.manager, 'persist_web_session') as m_persist:
+            # same state, args in a different order
+            self.apply_args(PeopleGrid, [
+                ('v1(firstname)', 'bob'), ('session_key', pg.session_key), ('op(firstname)', 'eq'),
+            ])
+            eq_(m_persist.call_count, 0)
+
+            self.apply_args(PeopleGrid, [('session_key', pg.session_key), ('export_to', 'xls')])
+            eq_(m_persist.call_count, 0)
+
+            self.apply_args(PeopleGrid, [('session_key', pg.session_key), ('perpage', '5')])
+            eq_(m_persist.call_count, 1)
+
+
+class VersionedGrid(Grid):
+    version = 1
+    allowed_export_targets = {'csv': CSV}
+    Column('First Name', Person.firstname, TextFilter)
+    Column('Last Name', Person.lastname)
+
+    def data_version(self):
+        return self.version
+
+
+class TestCountQuery(object):
+    class EmailsGrid(Grid):
+        Column('First Name', Person.firstname, TextFilter)
+        Column('Email', Email.email)
+        query_outer_joins = (Person.emails, )
+
+    class EagerEmailsGrid(Grid):
+        Column('First Name', Person.firstname, TextFilter)
+
+        def query_prep(self, query, has_sort, has_filters):
+            return query.add_entity(Person).options(saorm.joinedload(Person.emails))
+
+    class GroupedGrid(Grid):
+        Column('Status', Status.label, TextFilter)
+
+        def query_prep(self, query, has_sort, has_filters):
+            return query.add_columns(sa.func.count(Person.id)).join(
+                Person.status).group_by(Status.label)
+
+    def setUp(self):
+        Status.delete_cascaded()
+        in_process = Status.testing_create('in process')
+        complete = Status.testing_create('complete')
+        bob = Person.testing_create('bob', status=in_process)
+        Person.testing_create('bob', status=complete)
+        Person.testing_create('fred', status=complete)
+        Person.testing_create('sue')
+        Email.add(person=bob, email='bob@example.com')
+        Email.add(person=bob, email='bob@example.net')
+
+    def count_sql(self, grid):
+        return query_to_str(grid.count_statement(grid.build_query(for_count=True)), db.engine)
+
+    def assert_counts(self, grid, expected):
+        # the same count as SQLAlchemy's count of the full query
+        eq_(grid.build_query(for_count=True).count(), expected)
+        eq_(grid.record_count, expected)
+
+    def test_many_to_one_outer_join_removed(self):
+        for grid_cls in (PeopleGrid, PeopleGridByConfig):
+            g = grid_cls()
+            sql = self.count_sql(g)
+            assert 'ORDER BY' not in sql, sql
+            assert 'JOIN' not in sql, sql
+            assert 'statuses' not in sql, sql
+            self.assert_counts(g, 4)
+
+    def test_filtered_outer_join_kept(self):
+        complete = Status.get_by(label='complete')
+        g = PeopleGridByConfig()
+        g.set_filter('status', 'is', [complete.id])
+        assert 'LEFT OUTER JOIN statuses' in self.count_sql(g)
+        self.assert_counts(g, 2)
+
+        g = PeopleGridByConfig()
+        g.set_filter('status', 'empty', None)
+        self.assert_counts(g, 1)
+
+    def test_searched_outer_join_kept(self):
+        g = PeopleGridByConfig()
+        g.enable_search = True
+        g.search_value = 'complete'
+        assert 'LEFT OUTER JOIN statuses' in self.count_sql(g)
+        self.assert_counts(g, 2)
+
+    def test_one_to_many_outer_join_kept(self):
+        g = self.EmailsGrid()
+        assert 'LEFT OUTER JOIN emails' in self.count_sql(g)
+        self.assert_counts(g, 5)
+
+        g = self.EmailsGrid()
+        g.set_filter('firstname', 'eq', 'bob')
+        self.assert_counts(g, 3)
+
+    def test_eager_loads_not_counted(self):
+        g = self.EagerEmailsGrid()
+        assert 'emails' not in self.count_sql(g)
+        self.assert_counts(g, 4)
+        # the eager load is still made for the records
+        eq_(len(g.records), 4)
+        assert 'LEFT OUTER JOIN emails' in query_to_str(g.build_query())
+
+    def test_grouped_query_counted_as_subquery(self):
+        g = self.GroupedGrid()
+        assert g.count_statement(g.build_query(for_count=True)) is None
+        self.assert_counts(g, 2)
+
+        g = self.GroupedGrid()
+        g.set_filter('label', 'eq', 'complete')
+        self.assert_counts(g, 1)
+
+
+class TestWindowCount(object):
+    class WCGrid(Grid):
+        window_count = True
+        Column('First Name', Person.firstname, TextFilter)
+        Column('Last Name', Person.lastname)
+
+    def setUp(self):
+        Status.delete_cascaded()
+        for firstname in ('bob', 'bob', 'fred', 'sue', 'tom'):
+            Person.testing_create(firstname)
+
+    def query_logs(self, m_debug):
+        return [
+            call[0][0].split(' ran')[0] for call in m_debug.call_args_list
+            if ' query ran' in call[0][0]
+        ]
+
+    @mock.patch('logging.Logger.debug')
+    def test_count_from_page_query(self, m_debug):
+        g = self.WCGrid(per_page=2)
+        assert g.uses_window_count()
+        assert_in_query(
+            g.build_query().add_columns(sa.func.count().over()), 'count(*) OVER ()'
+        )
+        eq_(g.record_count, 5)
+        eq_(g.page_count, 3)
+        eq_(len(g.records), 2)
+        eq_(g.records[0].webgrid_record_count, 5)
+        eq_(self.query_logs(m_debug), ['Data query'])
+
+        m_debug.reset_mock()
+        g = self.WCGrid(per_page=2)
+        g.set_filter('firstname', 'eq', 'bob')
+        eq_(g.record_count, 2)
+        eq_(len(g.records), 2)
+        eq_(self.query_logs(m_debug), ['Data query'])
+
+    @mock.patch('logging.Logger.debug')
+    def test_empty_page_counted_separately(self, m_debug):
+        g = self.WCGrid(per_page=2)
+        g.set_filter('firstname', 'eq', 'nobody')
+        eq_(g.records, [])
+        eq_(g.record_count, 0)
+        eq_(self.query_logs(m_debug), ['Data query', 'Count query'])
+
+    @inrequest('/foo?perpage=2&onpage=10')
+    @mock.patch('logging.Logger.debug')
+    def test_on_page_past_last_page(self, m_debug):
+        g = self.WCGrid()
+        g.apply_qs_args()
+        eq_(self.query_logs(m_debug), [])
+        eq_(len(g.records), 1)
+        eq_(g.on_page, 3)
+        eq_(g.record_count, 5)
+        eq_(self.query_logs(m_debug), ['Data query', 'Count query', 'Data query'])
+
+    def test_not_used(self):
+        class CTG(Grid):
+            Column('First Name', Person.firstname)
+
+        assert not CTG().uses_window_count()
+        assert not self.WCGrid(per_page=None).uses_window_count()
+        g = self.WCGrid()
+        with mock.patch.dict(g.window_count_dialects, {'sqlite': (99, )}):
+            assert not g.uses_window_count()
+
+
+class TestETag(object):
+
+    def test_etag_state(self):
+        eq_(Grid().etag(), None)
+
+        g = VersionedGrid()
+        etag = g.etag()
+        eq_(VersionedGrid().etag(), etag)
+
+        g.version = 2
+        assert g.etag() != etag
+
+        g = VersionedGrid()
+        g.set_sort('lastname')
+        assert g.etag() != etag
+
+        g = VersionedGrid()
+        g.set_filter('firstname', 'eq', 'foo')
+        assert g.etag() != etag
+
+    @inrequest('/', headers={'If-None-Match': '"stale"'})
+    def test_modified(self):
+        eq_(VersionedGrid().not_modified_response(), None)
+
+    def test_not_modified(self):
+        etag = VersionedGrid().etag()
+        headers = {'If-None-Match': '"{0}"'.format(etag)}
+        with flask.current_app.test_request_context('/', headers=headers):
+            g = VersionedGrid()
+            g.apply_qs_args()
+            with mock.patch.object(g, 'build_query') as m_build_query:
+                response = g.not_modified_response()
+            eq_(response.status_code, 304)
+            eq_(response.get_etag(), (etag, False))
+            assert not m_build_query.called
+
+    @inrequest('/?export_to=csv')
+    def test_export_etag(self):
+        g = VersionedGrid()
+        g.apply_qs_args()
+        response = g.export_as_response()
+        eq_(response.get_etag(), (g.etag(), False))
+
+
+class TestStaticBundle(object):
+
+    def test_bundles(self):
+        manager = Grid.manager
+        js_url = manager.bundle_url('js')
+        assert re.match(r'^/static/webgrid/bundle/webgrid-[0-9a-f]{16}\.js$', js_url), js_url
+
+        client = flask.current_app.test_client()
+        response = client.get(js_url)
+        eq_(response.status_code, 200)
+        eq_(response.mimetype, 'application/javascript')
+        eq_(response.headers['Cache-Control'], 'public, max-age=31536000, immutable')
+        js = response.get_data(as_text=True)
+        assert 'function datagrid_add_filter' in js
+        assert 'multipleSelect' in js
+
+        response = client.get(manager.bundle_url('css'))
+        eq_(response.mimetype, 'text/css')
+        css = response.get_data(as_text=True)
+        assert '.datagrid' in css
+        assert 'url(data:image/png;base64,' in css
+        assert 'th_arrow_up.png' not in css
+
+        eq_(client.get('/static/webgrid/bundle/webgrid-0000000000000000.js').status_code, 404)
+
+    def test_minify_js(self):
+        source = '/* license */\nvar a = 1;\n\n    // comment\n/*\n * doc\n */\n    a += 1;\n'
+        eq_(minify_js(source), '/* license */\nvar a = 1;\na += 1;')
+
+    @inrequest('/')
+    def test_inline_images(self):
+        manager = Grid.manager
+        assert manager.static_url('b_firstpage.png').startswith('/static/webgrid/')
+        with mock.patch.object(manager, 'bundle_assets', True):
+            assert manager.static_url('b_firstpage.png').startswith('data:image/png;base64,')
@@ -1,3 +1,12 @@
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, defaultdict
+import re
+import threading
+
+from werkzeug.datastructures import iter_multi_items
+from werkzeug.urls import url_encode
+
+
 def current_url(manager, root_only=False, host_only=False, strip_querystring=False,
                 strip_host=False, https=None):
     """
@@ -47,3 +56,198 @@ def current_url(manager, root_only=False, host_only=False, strip_querystring=Fal
             retval = retval.replace('https://', 'http://', 1)
 
     return retval
+
+
+def shares_instance_state(cls, flag):
+    """
+        Whether instances of `cls` may start from a copy of the state of one constructed
+        instance, rather than be constructed. The class defining the constructor declares this
+        by setting `flag` in its body, so subclasses overriding `__init__` are constructed
+        unless they declare it too.
+    """
+    for klass in cls.__mro__:
+        if '__init__' in vars(klass):
+            return vars(klass).get(flag, False)
+    return False
+
+
+def copy_instance_state(state):
+    """A copy of an instance's attributes, with lists, dicts and sets copied for the instance."""
+    return {
+        key: value.copy() if isinstance(value, (list, dict, set)) else value
+        for key, value in state.items()
+    }
+
+
+class URLBuilder(object):
+    """
+        Builds URLs from a base URL and a set of request args, replacing some of the args. The
+        request args are encoded and sorted once, so each URL only has to encode the args it
+        replaces and merge them in. Output is the same as ``Href(base_url, sort=True)`` with
+        the merged args.
+    """
+
+    def __init__(self, base_url, args, encoded_args=None):
+        self.base_url = base_url
+        self.args = args
+        if encoded_args is None:
+            encoded_args = [
+                (key, value, url_encode([(key, value)]))
+                for key, value in sorted(iter_multi_items(args))
+            ]
+        self.encoded_args = encoded_args
+        self.keys = [item[0] for item in encoded_args]
+        self.encoded = [item[2] for item in encoded_args]
+
+    def __call__(self, replace_args):
+        replacements = defaultdict(list)
+        for key, value in iter_multi_items(replace_args):
+            if value is not None:
+                replacements[key].append((value, url_encode([(key, value)])))
+        # the request args are sorted by key, so each replaced key's args are a slice of them,
+        #   which the replacements take the place of
+        parts = []
+        start = 0
+        for key in sorted(replace_args):
+            low = bisect_left(self.keys, key, start)
+            parts.extend(self.encoded[start:low])
+            parts.extend(encoded for value, encoded in sorted(replacements[key]))
+            start = bisect_right(self.keys, key, low)
+        parts.extend(self.encoded[start:])
+        if not parts:
+            return self.base_url
+        return self.base_url + '?' + '&'.join(parts)
+
+    def without(self, *keys):
+        """A builder for the same URL that leaves the given request args out of every link."""
+        return URLBuilder(self.base_url, self.args,
+                          [item for item in self.encoded_args if item[0] not in keys])
+
+
+class GridArgs(object):
+    """
+        A grid's query string args, classified by what they control. Keys are stored without
+        the grid's `qs_prefix`. Filter args are kept as lists (options filters receive several
+        values), the others as their first value.
+    """
+
+    def __init__(self):
+        # column key -> {'op': [...], 'v1': [...], 'v2': [...]}
+        self.filters = {}
+        # onpage, perpage
+        self.paging = {}
+        # sort1, sort2, sort3
+        self.sort = {}
+        self.search = None
+        # session_key, session_override, apply, dgreset
+        self.session = {}
+        # export_to and the filter_options args
+        self.export = {}
+
+    @property
+    def has_filters(self):
+        return any('op' in filter_args for filter_args in self.filters.values())
+
+    def filter_value(self, col_key, part, multi=False):
+        values = self.filters.get(col_key, {}).get(part, [])
+        if multi:
+            return values
+        return values[0] if values else None
+
+
+class GridArgsParser(object):
+    """
+        Classifies a grid's query string args in a single pass. One parser is kept per
+        `qs_prefix` (see `for_prefix`), so its lookups are only built once.
+    """
+    arg_kinds = {
+        'onpage': 'paging',
+        'perpage': 'paging',
+        'sort1': 'sort',
+        'sort2': 'sort',
+        'sort3': 'sort',
+        'session_key': 'session',
+        'session_override': 'session',
+        'apply': 'session',
+        'dgreset': 'session',
+        'export_to': 'export',
+        'filter_options': 'export',
+        'filter_options_v': 'export',
+        'filter_options_q': 'export',
+        'filter_options_page': 'export',
+    }
+    # the search arg is not prefixed
+    search_key = 'search'
+
+    _parsers = {}
+
+    def __init__(self, prefix=''):
+        self.prefix = prefix
+        self.filter_re = re.compile(re.escape(prefix) + r'(op|v1|v2)\((.+)\)$')
+        self.arg_keys = {prefix + name: (kind, name) for name, kind in self.arg_kinds.items()}
+
+    @classmethod
+    def for_prefix(cls, prefix):
+        parser = cls._parsers.get(prefix)
+        if parser is None:
+            parser = cls._parsers[prefix] = cls(prefix)
+        return parser
+
+    def parse(self, args):
+        grid_args = GridArgs()
+        for key, value in iter_multi_items(args):
+            if key in self.arg_keys:
+                kind, name = self.arg_keys[key]
+                getattr(grid_args, kind).setdefault(name, value)
+            elif key == self.search_key:
+                if grid_args.search is None:
+                    grid_args.search = value
+            else:
+                match = self.filter_re.match(key)
+                if match:
+                    part, col_key = match.groups()
+                    grid_args.filters.setdefault(col_key, {}).setdefault(part, []).append(value)
+        return grid_args
+
+
+class LRUCache(object):
+    """
+        A small thread-safe mapping that holds at most `maxsize` entries, evicting the least
+        recently used entry when full. Used for caches shared across requests (and so across
+        threads), where an unbounded dict would grow with every distinct key seen.
+    """
+
+    def __init__(self, maxsize=500):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+                return self._data[key]
+            except KeyError:
+                return default
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        return len(self._data)